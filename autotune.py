@@ -0,0 +1,274 @@
+from __future__ import print_function
+
+import argparse
+import ast
+import copy
+import hashlib
+import json
+import os
+import os.path
+import sys
+
+import registry
+import rewrite
+import visitor
+
+# Ops the search picks from by default, those that only transform the tree
+DEFAULT_OPS = ('constprop', 'inline', 'partialeval', 'strconcat', 'tailcall')
+
+MANIFEST = 'autotune.json'
+
+class LoopCallsVisitor(visitor.DispatchVisitor):
+    # Counts calls that run once per iteration of some loop
+
+    def __init__(self):
+        self.depth = 0
+        self.calls = 0
+
+    def visit_looped(self, nodes):
+        self.depth += 1
+        try:
+            for n in nodes:
+                self.visit(n)
+        finally:
+            self.depth -= 1
+
+    def visit_For(self, n):
+        self.visit(n.target)
+        self.visit(n.iter)
+        self.visit_looped(n.body)
+        for stmt in n.orelse:
+            self.visit(stmt)
+
+    def visit_While(self, n):
+        self.visit_looped([n.test] + n.body)
+        for stmt in n.orelse:
+            self.visit(stmt)
+
+    def visit_comp(self, n):
+        # The first iterable is evaluated once, everything else per item
+        self.visit(n.generators[0].iter)
+        looped = [n.generators[0].target] + n.generators[0].ifs
+        for gen in n.generators[1:]:
+            looped.extend([gen.target, gen.iter] + gen.ifs)
+        if isinstance(n, ast.DictComp):
+            looped.extend([n.key, n.value])
+        else:
+            looped.append(n.elt)
+        self.visit_looped(looped)
+
+    visit_ListComp = visit_GeneratorExp = visit_SetComp = visit_DictComp = visit_comp
+
+    def visit_Call(self, n):
+        if self.depth:
+            self.calls += 1
+        self.generic_visit(n)
+
+class CostModel(object):
+    # Static estimate of how expensive a tree is to run and ship, lower
+    # is better: its size in nodes, calls inside loops, and emitted bytes
+
+    node_weight = 1.0
+    loop_call_weight = 10.0
+    byte_weight = 0.1
+
+    def __init__(self, decompile):
+        self.decompile = decompile
+
+    def cost(self, root):
+        nodes = sum([1 for _ in ast.walk(root)])
+        loops = LoopCallsVisitor()
+        loops.visit(root)
+        size = len(self.decompile.decompile(root))
+        return (
+            self.node_weight * nodes
+            + self.loop_call_weight * loops.calls
+            + self.byte_weight * size
+        )
+
+class Tuner(object):
+    # Beam search over op sequences. Each sequence's tree is derived from
+    # its prefix's, which is kept, so every op runs once per prefix, and
+    # sequences producing a tree some other sequence already produced (like
+    # those whose last op didn't change anything) aren't expanded further.
+    # Neither are ops the registry says can't have new work to do yet.
+
+    def __init__(self, root, ops = DEFAULT_OPS, backend = (), beam_width = 4, max_length = 6, cost_model = None):
+        self.ops = ops
+        self.backend = list(backend)
+        self.beam_width = beam_width
+        self.max_length = max_length
+        decompile = rewrite.pipeline(self.backend)[1]
+        self.cost_model = cost_model or CostModel(decompile)
+        self.trees = { () : root }
+        self.costs = {}
+        self.seen = { ast.dump(root) : () }
+
+    def tree(self, seq):
+        rv = self.trees.get(seq)
+        if rv is None:
+            parent = self.tree(seq[:-1])
+            rv = rewrite.transform(copy.deepcopy(parent), [seq[-1]])[0]
+            self.trees[seq] = rv
+        return rv
+
+    def cost(self, seq):
+        rv = self.costs.get(seq)
+        if rv is None:
+            rv = self.costs[seq] = self.cost_model.cost(self.tree(seq))
+        return rv
+
+    def expand(self, seq):
+        for op in self.ops:
+            if not registry.registry.schedulable(registry.registry.get(op), seq):
+                continue
+            new = seq + (op,)
+            try:
+                dump = ast.dump(self.tree(new))
+                self.cost(new)
+            except Exception:
+                # A pass that can't handle this tree, not a candidate
+                self.trees.pop(new, None)
+                continue
+            if dump in self.seen:
+                self.trees.pop(new, None)
+                continue
+            self.seen[dump] = new
+            yield new
+
+    def search(self):
+        # Returns every distinct sequence found, best first
+        found = [()]
+        beam = [()]
+        for _ in xrange(self.max_length):
+            candidates = [new for seq in beam for new in self.expand(seq)]
+            if not candidates:
+                break
+            candidates.sort(key=self.rank)
+            found.extend(candidates)
+            beam = candidates[:self.beam_width]
+        found.sort(key=self.rank)
+        return found
+
+    def rank(self, seq):
+        return (self.cost(seq), len(seq), seq)
+
+def benchmark_rank(path, seqs, backend, repeat = 5):
+    # Re-ranks by measured time of the recorded calls, dropping sequences
+    # that change behavior. Returns [(time, seq)], fastest first.
+    import difftest
+    calls = None
+    rv = []
+    for seq in seqs:
+        report = difftest.compare(path, list(seq) + list(backend), calls, repeat)
+        calls = report['calls']
+        if report['stdout_matches'] and not report['mismatches']:
+            total = sum([f['rewritten_time'] for f in report['functions'].itervalues()])
+            rv.append((total, seq))
+    rv.sort(key=lambda (t, seq): (t, len(seq)))
+    return rv
+
+def source_hash(source):
+    return hashlib.sha1(source).hexdigest()
+
+def manifest_path(module):
+    return os.path.join(os.path.dirname(os.path.abspath(module)), MANIFEST)
+
+def manifest_key(manifest, module):
+    return os.path.relpath(os.path.abspath(module), os.path.dirname(os.path.abspath(manifest)))
+
+def load_manifest(manifest):
+    try:
+        with open(manifest, "r") as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+def save_manifest(manifest, data):
+    tmp = manifest + '.tmp'
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.rename(tmp, manifest)
+
+def lookup(module, source, backend = (), manifest = None):
+    # The recorded ops for the module, or None when there are none or they
+    # were tuned for a different version of it or another backend
+    manifest = manifest or manifest_path(module)
+    entry = load_manifest(manifest).get(manifest_key(manifest, module))
+    if entry is None or entry.get('source_hash') != source_hash(source) or entry.get('backend') != list(backend):
+        return None
+    return [str(op) for op in entry['ops']]
+
+def record(module, entry, manifest = None):
+    manifest = manifest or manifest_path(module)
+    data = load_manifest(manifest)
+    data[manifest_key(manifest, module)] = entry
+    save_manifest(manifest, data)
+
+def tune(module, source, ops = DEFAULT_OPS, backend = (), beam_width = 4, max_length = 6, benchmark = 0):
+    tuner = Tuner(ast.parse(source, module), ops, backend, beam_width, max_length)
+    found = tuner.search()
+    best = found[0]
+    entry = {
+        'ops' : list(best),
+        'backend' : list(backend),
+        'cost' : tuner.cost(best),
+        'baseline_cost' : tuner.cost(()),
+        'source_hash' : source_hash(source),
+    }
+    if benchmark:
+        timed = benchmark_rank(module, found[:benchmark], backend)
+        if timed:
+            entry['ops'] = list(timed[0][1])
+            entry['cost'] = tuner.cost(timed[0][1])
+            entry['time'] = timed[0][0]
+    return entry
+
+def expand_auto(module, ops, source = None, save = True):
+    # Replaces the `auto` op with the module's tuned ops, tuning it on the
+    # spot if the manifest doesn't have them (and recording them if save)
+    if 'auto' not in ops:
+        return ops
+    if source is None:
+        with open(module, "r") as f:
+            source = f.read()
+    backends = registry.registry.names(registry.BACKEND)
+    backend = [op for op in ops if op in backends]
+    tuned = lookup(module, source, backend)
+    if tuned is None:
+        entry = tune(module, source, backend=backend)
+        if save:
+            record(module, entry)
+        tuned = entry['ops']
+    i = ops.index('auto')
+    return ops[:i] + tuned + [op for op in ops[i + 1:] if op != 'auto']
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Find the best rewrite.py op sequence for modules")
+    parser.add_argument('--ops', default=" ".join(DEFAULT_OPS), help="Space-separated ops to choose from")
+    parser.add_argument('--backend', default='', help="Backend ops appended to every sequence, eg: js2")
+    parser.add_argument('--beam', type=int, default=4, help="Sequences kept at each step")
+    parser.add_argument('--max-length', type=int, default=6)
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+        help="Pick among the N best by measuring them with difftest (Python output only)")
+    parser.add_argument('--manifest', help="Defaults to %s next to each module" % MANIFEST)
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv[1:])
+    try:
+        registry.registry.resolve(args.ops.split() + args.backend.split())
+    except registry.UnknownOpError as e:
+        sys.exit(str(e))
+
+    for module in args.files:
+        with open(module, "r") as f:
+            source = f.read()
+        entry = tune(module, source, args.ops.split(), args.backend.split(),
+            args.beam, args.max_length, args.benchmark)
+        record(module, entry, args.manifest)
+        print("%s: %s (cost %.1f, was %.1f)" % (module, " ".join(entry['ops']) or "(no ops)",
+            entry['cost'], entry['baseline_cost']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,355 @@
+from __future__ import print_function
+
+import argparse
+import ast
+import multiprocessing
+import os.path
+import sys
+
+import jsruntime
+import registry
+import rewrite
+
+def module_var(name):
+    return "__mod_" + name.replace('.', '$')
+
+def is_pure(stmt):
+    # Whether running the top-level statement only defines names
+    if isinstance(stmt, ast.FunctionDef):
+        return not stmt.decorator_list and not any([
+            isinstance(v, ast.Call) for d in stmt.args.defaults for v in ast.walk(d)
+        ])
+    elif isinstance(stmt, ast.Assign):
+        return all([isinstance(t, (ast.Name, ast.Tuple)) for t in stmt.targets]) and not any([
+            isinstance(v, (ast.Call, ast.Yield)) for v in ast.walk(stmt.value)
+        ])
+    elif isinstance(stmt, ast.Expr):
+        return isinstance(stmt.value, ast.Str)
+    return isinstance(stmt, (ast.Pass, ast.Import, ast.ImportFrom))
+
+def bound_names(stmt):
+    # Names a top-level statement binds at module level
+    rv = set()
+    pending = [stmt]
+    while pending:
+        n = pending.pop()
+        if isinstance(n, (ast.FunctionDef, ast.ClassDef)):
+            rv.add(n.name)
+            continue
+        elif isinstance(n, (ast.Lambda, ast.GeneratorExp, ast.SetComp, ast.DictComp)):
+            continue
+        elif isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store):
+            rv.add(n.id)
+        elif isinstance(n, (ast.Import, ast.ImportFrom)):
+            rv.update([a.asname or a.name.split('.')[0] for a in n.names if a.name != '*'])
+        pending.extend(ast.iter_child_nodes(n))
+    return rv
+
+class Module(object):
+
+    def __init__(self, name, path, is_package):
+        self.name = name
+        self.path = path
+        self.is_package = is_package
+        with open(path, "r") as f:
+            self.source = f.read()
+        self.root = ast.parse(self.source, path)
+        # Top-level name -> indexes of the statements binding it
+        self.defs = {}
+        for i, stmt in enumerate(self.root.body):
+            for name in bound_names(stmt):
+                self.defs.setdefault(name, []).append(i)
+        # Local name -> (module, attribute or None for the module itself)
+        self.imported = {}
+        # (lineno, col_offset) of each import -> [(local, module, attribute)]
+        self.bindings = {}
+        self.deps = set()
+        self.live = set()
+        self.exports = set()
+
+    def package(self):
+        return self.name if self.is_package else self.name.rpartition('.')[0]
+
+class Bundler(object):
+    # Bundles an entry module and the project modules it imports, directly
+    # or not, as a single JS file. Each module becomes a function returning
+    # an object with the names other modules use, and only statements
+    # reachable from code that runs at import time are kept, so functions
+    # nobody calls and modules nobody uses are left out.
+
+    def __init__(self, entry, path = (), ops = ('js2',), jobs = None):
+        self.entry = os.path.splitext(os.path.basename(entry))[0]
+        self.path = [os.path.dirname(os.path.abspath(entry))] + list(path)
+        self.ops = list(ops)
+        self.jobs = jobs
+        self.modules = {}
+        self.load(self.entry, os.path.abspath(entry), False)
+
+    def find(self, name):
+        parts = name.split('.')
+        for base in self.path:
+            path = os.path.join(base, *parts)
+            if os.path.isfile(path + '.py'):
+                return path + '.py', False
+            elif os.path.isfile(os.path.join(path, '__init__.py')):
+                return os.path.join(path, '__init__.py'), True
+        return None, False
+
+    def load(self, name, path = None, is_package = False):
+        # Loads the module and what it imports, returns None if not found
+        if name in self.modules:
+            return self.modules[name]
+        if path is None:
+            path, is_package = self.find(name)
+            if path is None:
+                return None
+        m = self.modules[name] = Module(name, path, is_package)
+        parent = name.rpartition('.')[0]
+        if parent and self.load(parent) is not None:
+            m.deps.add(parent)
+        for n in ast.walk(m.root):
+            if isinstance(n, ast.Import):
+                self.load_Import(m, n)
+            elif isinstance(n, ast.ImportFrom):
+                self.load_ImportFrom(m, n)
+        return m
+
+    def require(self, m, n, name):
+        if self.load(name) is None:
+            raise ValueError("%s:%d: can't bundle %s, it's not in the project" % (m.path, n.lineno, name))
+        m.deps.add(name)
+
+    def bind(self, m, n, local, module, attr):
+        m.bindings.setdefault((n.lineno, n.col_offset), []).append((local, module, attr))
+        m.imported[local] = (module, attr)
+
+    def load_Import(self, m, n):
+        for alias in n.names:
+            parts = alias.name.split('.')
+            for i in xrange(len(parts)):
+                self.require(m, n, '.'.join(parts[:i + 1]))
+            if alias.asname:
+                self.bind(m, n, alias.asname, alias.name, None)
+            else:
+                self.bind(m, n, parts[0], parts[0], None)
+
+    def load_ImportFrom(self, m, n):
+        base = n.module or ''
+        if n.level:
+            package = m.package().split('.') if m.package() else []
+            if n.level - 1 > len(package):
+                raise ValueError("%s:%d: relative import beyond the top level" % (m.path, n.lineno))
+            package = package[:len(package) - (n.level - 1)]
+            base = '.'.join(filter(None, ['.'.join(package), base]))
+        self.require(m, n, base)
+        for alias in n.names:
+            if alias.name == '*':
+                for name in self.modules[base].defs:
+                    if not name.startswith('_'):
+                        self.bind(m, n, name, base, name)
+                        if n in m.root.body:
+                            m.defs.setdefault(name, []).append(m.root.body.index(n))
+            elif self.load(base + '.' + alias.name) is not None:
+                m.deps.add(base + '.' + alias.name)
+                self.bind(m, n, alias.asname or alias.name, base + '.' + alias.name, None)
+            else:
+                self.bind(m, n, alias.asname or alias.name, base, alias.name)
+
+    def order(self):
+        # Dependencies first
+        rv = []
+        seen = set()
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dep in sorted(self.modules[name].deps):
+                visit(dep)
+            rv.append(name)
+        visit(self.entry)
+        return rv
+
+    def references(self, m, stmt):
+        # (module, name, follow) for each name a statement of m uses, name
+        # being None for uses of a whole module. Imports binding a module
+        # used only to get to its attributes aren't followed.
+        consumed = set()
+        for n in ast.walk(stmt):
+            if id(n) in consumed:
+                continue
+            if isinstance(n, ast.Attribute):
+                chain = []
+                v = n
+                while isinstance(v, ast.Attribute):
+                    consumed.add(id(v))
+                    chain.append(v.attr)
+                    v = v.value
+                if not isinstance(v, ast.Name):
+                    continue
+                consumed.add(id(v))
+                chain.append(v.id)
+                chain.reverse()
+                module, attr = m.imported.get(chain[0], (None, None))
+                if module is None or attr is not None:
+                    yield m.name, chain[0], True
+                    continue
+                yield m.name, chain[0], False
+                # Follow submodules, eg: a.b.f
+                for i, part in enumerate(chain[1:]):
+                    if module + '.' + part in self.modules:
+                        module = module + '.' + part
+                    else:
+                        yield module, part, True
+                        break
+                else:
+                    yield module, None, True
+            elif isinstance(n, ast.Name):
+                yield m.name, n.id, True
+
+    def mark(self, pending, module, name, user, follow = True):
+        m = self.modules[module]
+        if name is None:
+            names = m.defs.keys()
+        else:
+            names = [name]
+        for name in names:
+            if module != user:
+                m.exports.add(name)
+            for i in m.defs.get(name, ()):
+                if i not in m.live:
+                    m.live.add(i)
+                    pending.append((m, m.root.body[i]))
+            if follow and name in m.imported:
+                target, attr = m.imported[name]
+                self.mark(pending, target, attr, module)
+
+    def find_live(self):
+        pending = []
+        for m in self.modules.itervalues():
+            for i, stmt in enumerate(m.root.body):
+                if not is_pure(stmt):
+                    m.live.add(i)
+                    pending.append((m, stmt))
+        while pending:
+            m, stmt = pending.pop()
+            for module, name, follow in self.references(m, stmt):
+                self.mark(pending, module, name, m.name, follow)
+
+    def included(self):
+        # Modules with live code, or bound by imports in it
+        used = set([self.entry])
+        for m in self.modules.itervalues():
+            if m.live:
+                used.add(m.name)
+            for i in m.live:
+                for n in ast.walk(m.root.body[i]):
+                    if isinstance(n, (ast.Import, ast.ImportFrom)):
+                        used.update([module for local, module, attr in m.bindings.get((n.lineno, n.col_offset), ())])
+        return [name for name in self.order() if name in used]
+
+    def live_bindings(self, m):
+        # Drops names imported from modules that don't keep them, like those
+        # of star imports nothing uses
+        return dict([
+            (key, [(local, module, attr) for local, module, attr in bindings
+                if attr is None or attr in self.modules[module].exports])
+            for key, bindings in m.bindings.iteritems()
+        ])
+
+    def bundle(self):
+        self.find_live()
+        names = self.included()
+        jobs = [
+            (self.modules[name].source, self.modules[name].path, sorted(self.modules[name].live),
+                self.live_bindings(self.modules[name]), self.ops)
+            for name in names
+        ]
+        if self.jobs == 1 or len(jobs) == 1:
+            results = map(_translate, jobs)
+        else:
+            pool = multiprocessing.Pool(self.jobs)
+            try:
+                results = pool.map(_translate, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+        runtime = set()
+        parts = []
+        for name, (code, variables, used) in zip(names, results):
+            m = self.modules[name]
+            runtime.update(used)
+            parts.append("var %s = (function() {\n" % module_var(name))
+            if variables:
+                parts.append("    var %s;\n" % ", ".join(sorted(variables)))
+            parts.extend(["    " + line + "\n" for line in code.splitlines()])
+            parts.append("    return {%s};\n})();\n" % ", ".join([
+                "%s: %s" % (e, e) for e in sorted(m.exports) if e in m.defs
+            ]))
+            parent = name.rpartition('.')[0]
+            if parent in names:
+                parts.append("%s.%s = %s;\n" % (module_var(parent), name.rpartition('.')[2], module_var(name)))
+        return jsruntime.prelude(runtime) + "".join(parts)
+
+def _translate(job):
+    # Runs in a pool worker: prunes and rewrites one module, and returns
+    # its JS, the module-level variables it assigns and the runtime helpers
+    # it uses
+    source, path, live, bindings, ops = job
+    root = ast.parse(source, path)
+    root.body = [stmt for i, stmt in enumerate(root.body) if i in live]
+    root = ImportTransformer(bindings).visit(root)
+    variables = set()
+    for stmt in root.body:
+        if not isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+            variables.update(bound_names(stmt))
+    root, decompile, output = rewrite.transform(root, ops)
+    if output is not None or decompile.extension != '.js':
+        raise ValueError("bundles need a JS backend, add js or js2 to the ops")
+    v = decompile.StatementDecompilingVisitor()
+    v.visit(root)
+    return v.buf.getvalue(), variables, v.runtime
+
+class ImportTransformer(ast.NodeTransformer):
+    # Turns imports into assignments from the bundled modules' objects
+
+    def __init__(self, bindings):
+        self.bindings = bindings
+
+    def visit_import(self, n):
+        rv = []
+        for local, module, attr in self.bindings.get((n.lineno, n.col_offset), ()):
+            value = ast.Name(id=module_var(module), ctx=ast.Load())
+            if attr is not None:
+                value = ast.Attribute(value=value, attr=attr, ctx=ast.Load())
+            rv.append(ast.copy_location(
+                ast.Assign(targets=[ast.Name(id=local, ctx=ast.Store())], value=value), n))
+        return rv or ast.copy_location(ast.Pass(), n)
+
+    visit_Import = visit_ImportFrom = visit_import
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Translate a module and the project modules it imports into one JS file")
+    parser.add_argument('entry')
+    parser.add_argument('--ops', default='js2', help="Space-separated rewrite.py op list, with a JS backend")
+    parser.add_argument('-I', '--path', action='append', default=[],
+        help="Directories to look for modules in, after the entry module's")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help="Translation processes (default: one per CPU)")
+    parser.add_argument('-o', '--output')
+    args = parser.parse_args(argv[1:])
+
+    try:
+        registry.registry.resolve(args.ops.split())
+        js = Bundler(args.entry, args.path, args.ops.split(), args.jobs).bundle()
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(js)
+    else:
+        sys.stdout.write(js)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,43 @@
+import ast
+import imp
+import marshal
+import os
+import os.path
+import struct
+import StringIO
+import zipfile
+
+def compile_module(root, filename):
+    ast.fix_missing_locations(root)
+    return compile(root, filename, 'exec', 0, True)
+
+def pyc_bytes(code, mtime):
+    return imp.get_magic() + struct.pack('<I', int(mtime) & 0xFFFFFFFF) + marshal.dumps(code)
+
+def module_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def zip_bytes(code, filename, mtime):
+    buf = StringIO.StringIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(module_name(filename) + '.pyc', pyc_bytes(code, mtime))
+    return buf.getvalue()
+
+def write_pyc(root, filename):
+    code = compile_module(root, filename)
+    path = os.path.splitext(filename)[0] + '.pyc'
+    data = pyc_bytes(code, os.stat(filename).st_mtime)
+    # Write to a temporary name and rename so a concurrent import never
+    # sees a half-written file
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+    return path
+
+def write_zip(root, filename):
+    code = compile_module(root, filename)
+    path = os.path.splitext(filename)[0] + '.zip'
+    with open(path, 'wb') as f:
+        f.write(zip_bytes(code, filename, os.stat(filename).st_mtime))
+    return path
@@ -1,6 +1,274 @@
 import ast
+import collections
 
-class ConstPropTransformer(ast.NodeTransformer):
+import visitor
+
+def bool_and(values):
+    rv = values[0]
+    if rv:
+        for v in values[1:]:
+            rv = rv and v
+            if not rv:
+                break
+    return rv
+
+def bool_or(values):
+    rv = values[0]
+    if not rv:
+        for v in values[1:]:
+            rv = rv or v
+            if rv:
+                break
+    return rv
+
+def value_size(val):
+    if isinstance(val, (int, long)):
+        return (abs(val).bit_length() + 7) // 8
+    elif isinstance(val, basestring):
+        return len(val)
+    elif isinstance(val, (tuple, list, set, frozenset)):
+        return len(val) + sum(map(value_size, val))
+    return 1
+
+def is_immutable(val):
+    if isinstance(val, tuple):
+        return all(map(is_immutable, val))
+    return val is None or isinstance(val, (bool, int, long, float, basestring))
+
+class BindingsVisitor(visitor.DispatchVisitor):
+    # Counts, over a whole module, how many times each name gets bound in any
+    # scope, to find the ones assigned exactly once at module level
+
+    def __init__(self):
+        self.bindings = collections.defaultdict(int)
+        self.module_assigned = set()
+        self.declared_global = set()
+        # Names read other than by subscripting them, ie: that may be mutated
+        self.escaping = set()
+        # Star imports and exec can bind anything
+        self.opaque = False
+
+    def add_statement(self, stmt):
+        if (        isinstance(stmt, ast.Assign)
+                    and len(stmt.targets) == 1
+                    and isinstance(stmt.targets[0], ast.Name)
+                ):
+            self.module_assigned.add(stmt.targets[0].id)
+        self.visit(stmt)
+
+    def visit_Module(self, n):
+        for stmt in n.body:
+            self.add_statement(stmt)
+
+    def constant_candidates(self):
+        if self.opaque:
+            return set()
+        return set([
+            name for name in self.module_assigned
+            if self.bindings.get(name, 0) == 1 and name not in self.declared_global
+        ])
+
+    def visit_Name(self, n):
+        if isinstance(n.ctx, ast.Load):
+            self.escaping.add(n.id)
+        else:
+            self.bindings[n.id] += 1
+
+    def visit_Subscript(self, n):
+        if isinstance(n.value, ast.Name) and isinstance(n.ctx, ast.Load):
+            self.visit(n.slice)
+        else:
+            if isinstance(n.value, ast.Name):
+                self.escaping.add(n.value.id)
+            self.generic_visit(n)
+
+    def visit_arguments(self, n):
+        for name in (n.vararg, n.kwarg):
+            if name:
+                self.bindings[name] += 1
+        self.generic_visit(n)
+
+    def visit_FunctionDef(self, n):
+        self.bindings[n.name] += 1
+        self.generic_visit(n)
+
+    def visit_ClassDef(self, n):
+        self.bindings[n.name] += 1
+        self.generic_visit(n)
+
+    def visit_alias(self, n):
+        if n.name == '*':
+            self.opaque = True
+        else:
+            self.bindings[n.asname or n.name.split('.')[0]] += 1
+
+    def visit_Global(self, n):
+        self.declared_global.update(n.names)
+
+    def visit_Exec(self, n):
+        self.opaque = True
+        self.generic_visit(n)
+
+class ConstPropTransformer(visitor.DispatchTransformer):
+
+    pass_name = 'constprop'
+
+    const_names = {
+        'None' : None,
+        'True' : True,
+        'False' : False,
+    }
+
+    unops = {
+        ast.Invert : lambda x : ~x,
+        ast.Not : lambda x : not x,
+        ast.UAdd : lambda x : +x,
+        ast.USub : lambda x : -x,
+    }
+
+    binops = {
+        ast.Add : lambda l,r : l+r,
+        ast.Sub : lambda l,r : l-r,
+        ast.Mult : lambda l,r : l*r,
+        ast.Div : lambda l,r : l/r,
+        ast.Mod : lambda l,r : l%r,
+        ast.Pow : lambda l,r : l**r,
+        ast.LShift : lambda l,r : l<<r,
+        ast.RShift : lambda l,r : l>>r,
+        ast.BitOr : lambda l,r : l|r,
+        ast.BitXor : lambda l,r : l^r,
+        ast.BitAnd : lambda l,r : l&r,
+        ast.FloorDiv : lambda l,r : l//r,
+    }
+
+    cmpops = {
+        ast.Eq : lambda l,r:l==r,
+        ast.NotEq : lambda l,r:l!=r,
+        ast.Lt : lambda l,r:l<r,
+        ast.LtE : lambda l,r:l<=r,
+        ast.Gt : lambda l,r:l>r,
+        ast.GtE : lambda l,r:l>=r,
+        ast.Is : lambda l,r:l is r,
+        ast.IsNot : lambda l,r:l is not r,
+        ast.In : lambda l,r:l in r,
+        ast.NotIn : lambda l,r:l not in r,
+    }
+
+    boolops = {
+        ast.And : bool_and,
+        ast.Or : bool_or,
+    }
+
+    # Builtins and methods without side effects, safe to evaluate when all
+    # their arguments are constant. Subclasses may extend these.
+    builtins = {
+        'str' : str,
+        'int' : int,
+        'float' : float,
+        'long' : long,
+        'bool' : bool,
+        'len' : len,
+        'min' : min,
+        'max' : max,
+        'sum' : sum,
+        'abs' : abs,
+        'tuple' : tuple,
+        'sorted' : sorted,
+        'chr' : chr,
+        'ord' : ord,
+        'hex' : hex,
+        'oct' : oct,
+    }
+
+    str_methods = set([
+        'capitalize', 'center', 'count', 'endswith', 'find', 'index',
+        'isalnum', 'isalpha', 'isdigit', 'islower', 'isspace', 'istitle',
+        'isupper', 'join', 'ljust', 'lower', 'lstrip', 'partition', 'replace',
+        'rfind', 'rindex', 'rjust', 'rpartition', 'rsplit', 'rstrip', 'split',
+        'splitlines', 'startswith', 'strip', 'swapcase', 'title', 'upper',
+        'zfill',
+    ])
+
+    methods = {
+        str : str_methods,
+        unicode : str_methods,
+        tuple : set(['count', 'index']),
+        list : set(['count', 'index']),
+    }
+
+    # Results bigger than this (see value_size) are left to be computed at
+    # runtime, both to keep the output small and to avoid materializing huge
+    # values at transform time. Limits for specific builtins or methods, by
+    # name, override it.
+    max_result_size = 1024
+    result_size_limits = {
+        'str' : 128,
+        'hex' : 128,
+        'oct' : 128,
+    }
+
+    def __init__(self, bindings = None):
+        # Binding counts for the module, computed when visiting it unless
+        # given (eg: when it's visited a statement at a time)
+        self.bindings = None
+        self.candidates = set()
+        self.constants = {}
+        if bindings is not None:
+            self.set_bindings(bindings)
+
+    def size_limit(self, name = None):
+        return self.result_size_limits.get(name, self.max_result_size)
+
+    def fold(self, n, limit, f, *args):
+        # Replaces n with the constant f(*args), unless evaluating it raises
+        # (then it's left for the runtime to raise) or the result is too big
+        # or has no literal form
+        try:
+            val = f(*args)
+        except Exception as e:
+            self.missed(n, "evaluating %s raises %s", type(n).__name__, type(e).__name__)
+            return n
+        if isinstance(val, float) and (val != val or val in (float('inf'), float('-inf'))):
+            self.missed(n, "%s evaluates to inf or nan", type(n).__name__)
+            return n
+        if value_size(val) > limit:
+            self.missed(n, "%s result is bigger than %d", type(n).__name__, limit)
+            return n
+        rv = self.make_const(val, n)
+        if rv is None:
+            self.missed(n, "%s result has no literal form", type(n).__name__)
+            return n
+        self.applied(n, "folded %s", type(n).__name__)
+        return rv
+
+    def is_cheap_binop(self, op, l, r, limit):
+        # Guards against things like 'x' * 10**9 or 1 << 10**9, which would
+        # take forever or exhaust memory before the result could be measured
+        bits = limit * 8
+        if isinstance(op, ast.Mult):
+            for seq, times in ((l, r), (r, l)):
+                if isinstance(seq, (basestring, tuple, list)) and isinstance(times, (int, long)):
+                    return len(seq) * times <= limit
+        elif isinstance(op, ast.Pow):
+            if isinstance(l, (int, long)) and isinstance(r, (int, long)):
+                return r < 0 or abs(l).bit_length() * r <= bits
+            if isinstance(r, (int, long)):
+                return abs(r) <= bits
+        elif isinstance(op, ast.LShift):
+            if isinstance(l, (int, long)) and isinstance(r, (int, long)):
+                return abs(l).bit_length() + r <= bits
+        return True
+
+    def is_cheap_call(self, name, args, limit):
+        # Same as is_cheap_binop, for calls whose result size is one of their
+        # arguments rather than related to their size
+        if name in ('center', 'ljust', 'rjust', 'zfill') and args:
+            return not isinstance(args[0], (int, long)) or args[0] <= limit
+        return True
+
+    def set_bindings(self, bindings):
+        self.bindings = bindings
+        self.candidates = bindings.constant_candidates()
 
     def make_const(self, val, n):
         if isinstance(val, (list, tuple, set)):
@@ -9,15 +277,21 @@ class ConstPropTransformer(ast.NodeTransformer):
             elif isinstance(val, tuple):
                 ntype = ast.Tuple
             elif isinstance(val, set):
+                if not val:
+                    # {} is a dict
+                    return None
                 ntype = ast.Set
             else:
                 raise AssertionError
-            return ast.copy_location(ntype(
-                elts = map(self.make_const, val),
-                ctx = n.ctx,
-            ), n)
+            elts = [self.make_const(v, n) for v in val]
+            if None in elts:
+                # Some element has no literal form
+                return None
+            return ast.copy_location(ntype(elts=elts, ctx=ast.Load()), n)
         elif val is True or val is False or val is None:
-            return ast.copy_location(ast.Name(id=str(val)), n)
+            return ast.copy_location(ast.Name(id=str(val), ctx=ast.Load()), n)
+        elif isinstance(val, float) and (val != val or val in (float('inf'), float('-inf'))):
+            return None
         elif isinstance(val, (int, long, float)):
             return ast.copy_location(ast.Num(n=val), n)
         elif isinstance(val, basestring):
@@ -25,125 +299,150 @@ class ConstPropTransformer(ast.NodeTransformer):
 
     def get_value(self, n):
         if isinstance(n, ast.Name):
-            builtins = {
-                'None' : None,
-                'True' : True,
-                'False' : False,
-            }
-            return builtins[n.id]
+            return self.const_names[n.id]
         elif isinstance(n, ast.Num):
             return n.n
         elif isinstance(n, ast.Str):
             return n.s
         elif isinstance(n, (ast.List, ast.Set, ast.Tuple)):
-            if isinstance(n, list):
+            if isinstance(n, ast.List):
                 ltype = list
-            elif isinstance(n, tuple):
+            elif isinstance(n, ast.Tuple):
                 ltype = tuple
-            elif isinstance(n, set):
+            elif isinstance(n, ast.Set):
                 ltype = set
             return ltype(map(self.get_value, n.elts))
 
     def is_const(self, n):
         if isinstance(n, ast.Name):
-            return n.id in ('None', 'True', 'False' )
+            return n.id in self.const_names
         elif isinstance(n, (ast.Num, ast.Str)):
             return True
         elif isinstance(n, (ast.List, ast.Set, ast.Tuple)):
             return all(map(self.is_const, n.elts))
         return False
 
+    def visit_Module(self, n):
+        if self.bindings is None:
+            bindings = BindingsVisitor()
+            bindings.visit(n)
+            self.set_bindings(bindings)
+        return self.generic_visit(n)
+
+    def visit_Assign(self, n):
+        n = self.generic_visit(n)
+        if (        self.candidates
+                    and len(n.targets) == 1
+                    and isinstance(n.targets[0], ast.Name)
+                    and n.targets[0].id in self.candidates
+                    and self.is_const(n.value)
+                ):
+            # Being a candidate, this is the only binding of the name, and
+            # uses from here on will see this value
+            value = self.get_value(n.value)
+            name = n.targets[0].id
+            if is_immutable(value) or (
+                    isinstance(value, (list, set))
+                    and all(map(is_immutable, value))
+                    and name not in self.bindings.escaping):
+                self.constants[name] = value
+                self.applied(n, "recorded constant %s", name)
+            else:
+                self.missed(n, "%s is a mutable container used other than by subscripting", name)
+        elif (      self.bindings is not None
+                    and len(n.targets) == 1
+                    and isinstance(n.targets[0], ast.Name)
+                    and n.targets[0].id in self.bindings.module_assigned
+                    and self.is_const(n.value)
+                ):
+            name = n.targets[0].id
+            if self.bindings.opaque:
+                self.missed(n, "%s could be rebound by exec or import *", name)
+            elif name in self.bindings.declared_global:
+                self.missed(n, "%s is declared global", name)
+            else:
+                self.missed(n, "%s is bound %d times", name, self.bindings.bindings.get(name, 0))
+        return n
+
+    def visit_Name(self, n):
+        if isinstance(n.ctx, ast.Load) and n.id in self.constants:
+            val = self.constants[n.id]
+            # Mutable containers are only ever folded through subscripts
+            if is_immutable(val):
+                self.applied(n, "propagated constant %s", n.id)
+                return self.make_const(val, n)
+        return n
+
+    def visit_Subscript(self, n):
+        n = self.generic_visit(n)
+        if not isinstance(n.ctx, ast.Load):
+            return n
+        if isinstance(n.value, ast.Name) and n.value.id in self.constants:
+            val = self.constants[n.value.id]
+        elif self.is_const(n.value):
+            val = self.get_value(n.value)
+        else:
+            return n
+        if isinstance(n.slice, ast.Index) and self.is_const(n.slice.value):
+            item = self.fold(n, self.size_limit(), lambda : val[self.get_value(n.slice.value)])
+            # Items of mutable containers could be mutated through it
+            if item is not n and (is_immutable(val) or not isinstance(item, (ast.List, ast.Set))):
+                return item
+            elif item is not n:
+                self.missed(n, "item of a mutable container could be mutated through it")
+        elif isinstance(n.slice, ast.Slice):
+            bounds = [n.slice.lower, n.slice.upper, n.slice.step]
+            if all([b is None or self.is_const(b) for b in bounds]):
+                bounds = [b if b is None else self.get_value(b) for b in bounds]
+                # Slices are copies, so a literal is equivalent even for lists
+                return self.fold(n, self.size_limit(), lambda : val[slice(*bounds)])
+        return n
+
     def visit_UnaryOp(self, n):
-        n.value = self.visit(n.value)
-        if self.is_const(n.value):
-            unops = {
-                ast.Invert : lambda x : ~x,
-                ast.Not : lambda x : not x,
-                ast.UAdd : lambda x : +x,
-                ast.USub : lambda x : -x,
-            }
-            return self.make_const(unops[type(n.op)](self.get_value(n.value)), n)
+        n.operand = self.visit(n.operand)
+        if self.is_const(n.operand):
+            return self.fold(n, self.size_limit(),
+                self.unops[type(n.op)], self.get_value(n.operand))
         return n
 
     def visit_BinOp(self, n):
         n.left = self.visit(n.left)
         n.right = self.visit(n.right)
         if self.is_const(n.left) and self.is_const(n.right):
-            binops = {
-                ast.Add : lambda l,r : l+r,
-                ast.Sub : lambda l,r : l-r,
-                ast.Mult : lambda l,r : l*r,
-                ast.Div : lambda l,r : l/r,
-                ast.Mod : lambda l,r : l%r,
-                ast.Pow : lambda l,r : l**r,
-                ast.LShift : lambda l,r : l<<r,
-                ast.RShift : lambda l,r : l>>r,
-                ast.BitOr : lambda l,r : l|r,
-                ast.BitXor : lambda l,r : l^r,
-                ast.BitAnd : lambda l,r : l&r,
-                ast.FloorDiv : lambda l,r : l//r,
-            }
-            return self.make_const(binops[type(n.op)](
-                self.get_value(n.left),
-                self.get_value(n.right),
-            ), n)
+            l = self.get_value(n.left)
+            r = self.get_value(n.right)
+            limit = self.size_limit()
+            if self.is_cheap_binop(n.op, l, r, limit):
+                return self.fold(n, limit, self.binops[type(n.op)], l, r)
+            self.missed(n, "%s result would be too big to compute", type(n.op).__name__)
+        elif self.is_const(n.left) or self.is_const(n.right):
+            self.missed(n, "%s operand isn't constant", "right" if self.is_const(n.left) else "left")
         return n
 
     def visit_Compare(self, n):
         n.left = self.visit(n.left)
         n.comparators = [ self.visit(v) for v in n.comparators ]
-        cmpops = {
-            ast.Eq : lambda l,r:l==r,
-            ast.NotEq : lambda l,r:l!=r,
-            ast.Lt : lambda l,r:l<r,
-            ast.LtE : lambda l,r:l<=r,
-            ast.Gt : lambda l,r:l>r,
-            ast.GtE : lambda l,r:l>=r,
-            ast.Is : lambda l,r:l is r,
-            ast.IsNot : lambda l,r:l is not r,
-            ast.In : lambda l,r:l in r,
-            ast.NotIn : lambda l,r:l not in r,
-        }
         if self.is_const(n.left) and all(map(self.is_const, n.comparators)):
-            prev = self.get_value(n.left)
-            rv = True
-            for op, v in zip(n.ops, n.comparators):
-                cur = self.get_value(v)
-                rv = cmpops[type(op)](prev, cur)
-                prev = cur
-                if not rv:
-                    break
-            return self.make_const(rv, n)
-        else:
-            return n
+            def compare():
+                prev = self.get_value(n.left)
+                rv = True
+                for op, v in zip(n.ops, n.comparators):
+                    cur = self.get_value(v)
+                    rv = self.cmpops[type(op)](prev, cur)
+                    prev = cur
+                    if not rv:
+                        break
+                return rv
+            return self.fold(n, self.size_limit(), compare)
+        elif any(map(self.is_const, [n.left] + n.comparators)):
+            self.missed(n, "comparison has non-constant operands")
+        return n
 
     def visit_BoolOp(self, n):
         n.values = [ self.visit(v) for v in n.values ]
         if all(map(self.is_const, n.values)):
-            def bool_and(values):
-                rv = values[0]
-                if rv:
-                    for v in values[1:]:
-                        rv = rv and v
-                        if not rv:
-                            break
-                return rv
-            def bool_or(values):
-                rv = values[0]
-                if not rv:
-                    for v in values[1:]:
-                        rv = rv or v
-                        if rv:
-                            break
-                return rv
-            boolops = {
-                ast.And : bool_and,
-                ast.Or : bool_or,
-            }
-            return self.make_const(
-                boolops[type(n.op)](map(self.get_value, n.values)),
-                n
-            )
+            return self.fold(n, self.size_limit(),
+                self.boolops[type(n.op)], map(self.get_value, n.values))
         else:
             return n
 
@@ -160,21 +459,38 @@ class ConstPropTransformer(ast.NodeTransformer):
             return n
 
     def visit_Call(self, n):
-        n = self.generic_visit(n)
-        if (        isinstance(n.func, ast.Name)
-                    and (not n.args or all(map(self.is_const, n.args)))
-                    and (not n.keywords or all(map(self.is_const, [kw.arg for kw in n.keywords])))
+        return self.fold_call(self.generic_visit(n))
+
+    def get_pure_callable(self, func):
+        # Returns (name, callable) for calls that can be evaluated at
+        # transform time, or (None, None)
+        if isinstance(func, ast.Name):
+            f = self.builtins.get(func.id)
+            if f is not None and not self.is_bound(func.id):
+                return func.id, f
+        elif isinstance(func, ast.Attribute):
+            if isinstance(func.value, ast.Name) and func.value.id in self.constants:
+                val = self.constants[func.value.id]
+            elif self.is_const(func.value):
+                val = self.get_value(func.value)
+            else:
+                return None, None
+            if func.attr in self.methods.get(type(val), ()):
+                return func.attr, getattr(val, func.attr)
+        return None, None
+
+    def is_bound(self, name):
+        # Whether the module binds the name somewhere, eg: shadowing a builtin.
+        # Star imports and exec may bind anything.
+        return self.bindings is not None and (self.bindings.opaque or self.bindings.bindings.get(name, 0) > 0)
+
+    def fold_call(self, n):
+        if (        (not n.args or all(map(self.is_const, n.args)))
+                    and (not n.keywords or all([self.is_const(kw.value) for kw in n.keywords]))
                     and (not n.starargs or self.is_const(n.starargs))
                     and (not n.kwargs or self.is_const(n.kwargs))
                 ):
-            builtins = {
-                'str' : str,
-                'int' : int,
-                'float' : float,
-                'long' : long,
-                'bool' : bool,
-            }
-            f = builtins.get(n.func.id)
+            name, f = self.get_pure_callable(n.func)
             if f is not None:
                 args = map(self.get_value, n.args)
                 if n.kwargs:
@@ -186,6 +502,13 @@ class ConstPropTransformer(ast.NodeTransformer):
                 else:
                     starargs = []
                 if n.keywords:
-                    kwargs.update({ kw.id : self.get_value(kw.arg) for kw in n.keywords })
-                return self.make_const(f(*(args + starargs), **kwargs), n)
+                    kwargs.update({ kw.arg : self.get_value(kw.value) for kw in n.keywords })
+                limit = self.size_limit(name)
+                if self.is_cheap_call(name, args + starargs, limit):
+                    return self.fold(n, limit, lambda : f(*(args + starargs), **kwargs))
+                self.missed(n, "%s result would be too big to compute", name)
+        elif self.remarks is not None:
+            name, f = self.get_pure_callable(n.func)
+            if f is not None:
+                self.missed(n, "%s has non-constant arguments", name)
         return n
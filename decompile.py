@@ -1,12 +1,58 @@
 import ast
 import StringIO
 
-class ExpressionDecompilingVisitor(ast.NodeVisitor):
+import visitor
+
+extension = ".py"
+
+class ExpressionDecompilingVisitor(visitor.DispatchVisitor):
+
+    cmpops = {
+        ast.Eq : '==',
+        ast.NotEq : '!=',
+        ast.Lt : '<',
+        ast.LtE : '<=',
+        ast.Gt : '>',
+        ast.GtE : '>=',
+        ast.Is : 'is',
+        ast.IsNot : 'is not',
+        ast.In : 'in',
+        ast.NotIn : 'not in',
+    }
+
+    binops = {
+        ast.Add : '+',
+        ast.Sub : '-',
+        ast.Mult : '*',
+        ast.Div : '/',
+        ast.Mod : '%',
+        ast.Pow : '**',
+        ast.LShift : '<<',
+        ast.RShift : '>>',
+        ast.BitOr : '|',
+        ast.BitXor : '^',
+        ast.BitAnd : '&',
+        ast.FloorDiv : '//',
+    }
+
+    boolops = {
+        ast.And : ' and ',
+        ast.Or : ' or ',
+    }
+
+    unops = {
+        ast.Invert : '~',
+        ast.Not : 'not',
+        ast.UAdd : '+',
+        ast.USub : '-',
+    }
 
     def visit_Expr(self, n):
         return "(%s)" % (self.visit(n.value),)
 
     def visit_Tuple(self, n):
+        if len(n.elts) == 1:
+            return "(%s,)" % (self.visit(n.elts[0]),)
         return "(%s)" % (", ".join([self.visit(e) for e in n.elts]))
 
     def visit_List(self, n):
@@ -18,6 +64,12 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
             " ".join(map(self.visit_comprehension, n.generators))
         )
 
+    def visit_GeneratorExp(self, n):
+        return "(%s %s)" % (
+            self.visit(n.elt),
+            " ".join(map(self.visit_comprehension, n.generators))
+        )
+
     def visit_DictComp(self, n):
         return "{%s:%s %s}" % (
             self.visit(n.key), self.visit(n.value),
@@ -44,6 +96,9 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
         return "{%s}" % (", ".join([self.visit(e) for e in n.elts]))
 
     def visit_Num(self, n):
+        if n.n in (float('inf'), float('-inf')):
+            # Out of range literals are how the source spells them
+            return "1e999" if n.n > 0 else "-1e999"
         return repr(n.n)
 
     def visit_Str(self, n):
@@ -62,7 +117,7 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
         return self.visit(n.value)
 
     def visit_ExtSlice(self, n):
-        return ":".join(map(self.visit, n.dims))
+        return ", ".join(map(self.visit, n.dims))
 
     def visit_Slice(self, n):
         return "%s:%s%s" % (
@@ -74,6 +129,11 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
     def visit_Ellipsis(self, n):
         return "..."
 
+    def visit_Yield(self, n):
+        if n.value is None:
+            return "(yield)"
+        return "(yield %s)" % (self.visit(n.value),)
+
     def visit_Repr(self, n):
         return "repr(%s)" % (self.visit(n.value),)
 
@@ -89,59 +149,23 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
 
     def visit_Compare(self, n):
         parts = [self.visit(n.left)]
-        cmpops = {
-            ast.Eq : '==',
-            ast.NotEq : '!=',
-            ast.Lt : '<',
-            ast.LtE : '<=',
-            ast.Gt : '>',
-            ast.GtE : '>=',
-            ast.Is : 'is',
-            ast.IsNot : 'is not',
-            ast.In : 'in',
-            ast.NotIn : 'not in',
-        }
         for op, v in zip(n.ops, n.comparators):
-            parts.append(cmpops[type(op)])
+            parts.append(self.cmpops[type(op)])
             parts.append(self.visit(v))
         return "(%s)" % " ".join(parts)
 
     def visit_BinOp(self, n):
-        binops = {
-            ast.Add : '+',
-            ast.Sub : '-',
-            ast.Mult : '*',
-            ast.Div : '/',
-            ast.Mod : '%',
-            ast.Pow : '**',
-            ast.LShift : '<<',
-            ast.RShift : '>>',
-            ast.BitOr : '|',
-            ast.BitXor : '^',
-            ast.BitAnd : '&',
-            ast.FloorDiv : '//',
-        }
         return "(%s)" % " ".join([
             self.visit(n.left),
-            binops[type(n.op)],
+            self.binops[type(n.op)],
             self.visit(n.right)
         ])
 
     def visit_BoolOp(self, n):
-        boolops = {
-            ast.And : ' and ',
-            ast.Or : ' or ',
-        }
-        return "(%s)" % boolops[type(n.op)].join(map(self.visit, n.values))
+        return "(%s)" % self.boolops[type(n.op)].join(map(self.visit, n.values))
 
     def visit_UnaryOp(self, n):
-        unops = {
-            ast.Invert : '~',
-            ast.Not : 'not',
-            ast.UAdd : '+',
-            ast.USub : '-',
-        }
-        return "(%s(%s))" % (unops[type(n.op)], self.visit(n.operand))
+        return "(%s(%s))" % (self.unops[type(n.op)], self.visit(n.operand))
 
     def visit_Lambda(self, n):
         return "(lambda %s:%s)" % (
@@ -171,14 +195,32 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
         ])
 
 
-class StatementDecompilingVisitor(ast.NodeVisitor):
+class StatementDecompilingVisitor(visitor.DispatchVisitor):
+
+    augops = {
+        ast.Add : '+=',
+        ast.Sub : '-=',
+        ast.Mult : '*=',
+        ast.Div : '/=',
+        ast.Mod : '%=',
+        ast.Pow : '**=',
+        ast.LShift : '<<=',
+        ast.RShift : '>>=',
+        ast.BitOr : '|=',
+        ast.BitXor : '^=',
+        ast.BitAnd : '&=',
+        ast.FloorDiv : '//=',
+    }
 
     def __init__(self):
         self.indent = 0
         self.buf = StringIO.StringIO()
 
+    def expression_visitor(self):
+        return ExpressionDecompilingVisitor()
+
     def decompile_expr(self, n):
-        return ExpressionDecompilingVisitor().visit(n)
+        return self.expression_visitor().visit(n)
 
     def emit_line(self, fmt, *p, **kw):
         assert not kw or not p
@@ -189,35 +231,24 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         self.emit_line("%s", self.decompile_expr(n.value))
 
     def visit_Return(self, n):
-        self.emit_line("return %s", self.decompile_expr(n.value))
+        if n.value is None:
+            self.emit_line("return")
+        else:
+            self.emit_line("return %s", self.decompile_expr(n.value))
 
     def visit_Delete(self, n):
-        self.emit_line("delete %s", ", ".join(map(self.decompile_expr, n.targets)))
+        self.emit_line("del %s", ", ".join(map(self.decompile_expr, n.targets)))
 
     def visit_Assign(self, n):
         self.emit_line("%s = %s",
-            ", ".join(map(self.decompile_expr, n.targets)),
+            " = ".join(map(self.decompile_expr, n.targets)),
             self.decompile_expr(n.value),
         )
 
     def visit_AugAssign(self, n):
-        binops = {
-            ast.Add : '+=',
-            ast.Sub : '-=',
-            ast.Mult : '*=',
-            ast.Div : '/=',
-            ast.Mod : '%=',
-            ast.Pow : '**=',
-            ast.LShift : '<<=',
-            ast.RShift : '>>=',
-            ast.BitOr : '|=',
-            ast.BitXor : '^=',
-            ast.BitAnd : '&=',
-            ast.FloorDiv : '//=',
-        }
         self.emit_line("%s %s %s",
             self.decompile_expr(n.target),
-            binops[type(n.op)],
+            self.augops[type(n.op)],
             self.decompile_expr(n.value),
         )
 
@@ -280,8 +311,10 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
             if h.name:
                 self.emit_line("except %s as %s:",
                     self.decompile_expr(h.type), self.decompile_expr(h.name))
-            else:
+            elif h.type:
                 self.emit_line("except %s:", self.decompile_expr(h.type))
+            else:
+                self.emit_line("except:")
             self.indent_visit(h.body)
         if n.orelse:
             self.emit_line("else:")
@@ -293,6 +326,13 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         self.emit_line("finally:")
         self.indent_visit(n.finalbody)
 
+    def visit_Exec(self, n):
+        self.emit_line("exec %s%s",
+            self.decompile_expr(n.body),
+            (" in %s" % ", ".join(map(self.decompile_expr, filter(None, [n.globals, n.locals])))
+                if n.globals else ""),
+        )
+
     def visit_Assert(self, n):
         self.emit_line("assert %s%s",
             self.decompile_expr(n.test),
@@ -331,7 +371,7 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
             self.emit_line("@%s", self.decompile_expr(d))
         self.emit_line("def %(name)s(%(args)s):",
             name = n.name,
-            args = ExpressionDecompilingVisitor().visit_args(n.args),
+            args = self.expression_visitor().visit_args(n.args),
         )
         self.indent_visit(n.body)
 
@@ -1,8 +1,92 @@
 import ast
+import copy
 import StringIO
 import json
+import re
 
-class ExpressionDecompilingVisitor(ast.NodeVisitor):
+import jsruntime
+import visitor
+
+extension = ".js"
+
+def template_literal(parts):
+    # parts are (is_expr, text) pairs, text being JS source for expressions
+    rv = []
+    for is_expr, text in parts:
+        if is_expr:
+            rv.append("${%s}" % text)
+        else:
+            # JSON escapes are valid in template literals as well, only
+            # backticks and ${ need escaping on top of that
+            text = json.dumps(text)[1:-1].replace('\\"', '"')
+            rv.append(text.replace("`", "\\`").replace("${", "\\${"))
+    return "`%s`" % "".join(rv)
+
+class ExpressionDecompilingVisitor(visitor.DispatchVisitor):
+
+    cmpops = {
+        ast.Eq : '(%s == %s)',
+        ast.NotEq : '(%s != %s)',
+        ast.Lt : '(%s < %s)',
+        ast.LtE : '(%s <= %s)',
+        ast.Gt : '(%s > %s)',
+        ast.GtE : '(%s >= %s)',
+        ast.Is : '(%s === %s)',
+        ast.IsNot : '(%s !== %s)',
+        ast.In : '(%s in %s)',
+        ast.NotIn : '!(%s in %s))',
+    }
+
+    binops = {
+        ast.Add : '+',
+        ast.Sub : '-',
+        ast.Mult : '*',
+        ast.Div : '/',
+        ast.Mod : '%',
+        ast.Pow : '**',
+        ast.LShift : '<<',
+        ast.RShift : '>>',
+        ast.BitOr : '|',
+        ast.BitXor : '^',
+        ast.BitAnd : '&',
+    }
+
+    boolops = {
+        ast.And : ' && ',
+        ast.Or : ' || ',
+    }
+
+    unops = {
+        ast.Invert : '~',
+        ast.Not : '!',
+        ast.UAdd : '+',
+        ast.USub : '-',
+    }
+
+    # Builtins and methods implemented by a runtime helper
+    builtin_helpers = {
+        'range' : 'range',
+        'xrange' : 'range',
+        'len' : 'len',
+        'set' : 'set',
+        'dict' : 'dict',
+    }
+    method_helpers = {
+        'keys' : 'keys',
+        'iterkeys' : 'keys',
+        'values' : 'values',
+        'itervalues' : 'values',
+        'items' : 'items',
+        'iteritems' : 'items',
+        'get' : 'get',
+    }
+
+    def __init__(self, runtime = None):
+        # Names of the runtime helpers used, see jsruntime
+        self.runtime = runtime if runtime is not None else set()
+
+    def helper(self, name, *args):
+        return jsruntime.call(self.runtime, name, args)
 
     def visit_Expr(self, n):
         return "(%s)" % (self.visit(n.value),)
@@ -13,14 +97,20 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
     def visit_List(self, n):
         return "[%s]" % (", ".join([self.visit(e) for e in n.elts]))
 
+    def object_key(self, n):
+        # Literal keys are taken as is, anything else needs computing
+        if isinstance(n, (ast.Num, ast.Str)):
+            return self.visit(n)
+        return "[%s]" % self.visit(n)
+
     def visit_Set(self, n):
-        return "{%s}" % (", ".join(["%s:true" % self.visit(e) for e in n.elts]))
+        return "{%s}" % (", ".join(["%s:true" % self.object_key(e) for e in n.elts]))
 
     def visit_ListComp(self, n):
         return "(function(){ var rv=[]; %(fors)s rv.push(%(exp)s); %(closing_fors)s ; return rv; })()" % dict(
             closing_fors = "}}" * len(n.generators),
             exp = self.visit(n.elt),
-            fors = " ".join(map(self.visit_comprehension, n.generators))
+            fors = self.comprehension_loops(n.generators, '__iter'),
         )
 
     def visit_DictComp(self, n):
@@ -28,26 +118,108 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
             closing_fors = "}}" * len(n.generators),
             key = self.visit(n.key),
             val = self.visit(n.value),
-            fors = " ".join(map(self.visit_comprehension, n.generators))
+            fors = self.comprehension_loops(n.generators, '__iter'),
         )
 
     def visit_SetComp(self, n):
         return "(function(){ var rv={}; %(fors)s rv[%(exp)s] = true; %(closing_fors)s ; return rv;  })()" % dict(
             closing_fors = "}}" * len(n.generators),
             exp = self.visit(n.elt),
-            fors = " ".join(map(self.visit_comprehension, n.generators))
+            fors = self.comprehension_loops(n.generators, '__iter'),
         )
 
-    def visit_comprehension(self, n):
-        return "{ var __iter = %(iter)s; for (var %(tgt)s in __iter) { %(tgt)s = __iter[%(tgt)s]; %(ifs)s" % dict(
-            tgt = self.visit(n.target),
-            iter = self.visit(n.iter),
+    def visit_GeneratorExp(self, n):
+        # Unless consumed right away (see fused_reduction), built like a list
+        return self.visit_ListComp(n)
+
+    def loop_header(self, target, iterable, iter_name):
+        # Opens a block looping over the items of iterable, closed by "}}"
+        return "{ var %(it)s = %(iter)s; for (var %(it)s_i = 0; %(it)s_i < %(it)s.length; %(it)s_i++) { var %(tgt)s = %(it)s[%(it)s_i];" % dict(
+            it = iter_name,
+            tgt = self.visit(target),
+            iter = self.helper('list', self.visit(iterable)),
+        )
+
+    def visit_comprehension(self, n, iter_name = '__iter'):
+        return "%(loop)s %(ifs)s" % dict(
+            loop = self.loop_header(n.target, n.iter, iter_name),
             ifs = (" if (!(%s)) continue; " % " && ".join([
                 "(%s)" % self.visit(_if)
                 for _if in n.ifs
             ]) if n.ifs else ""),
         )
 
+    def comprehension_loops(self, generators, prefix):
+        # Opening of the nested loops, each with its own array variable
+        return " ".join([
+            self.visit_comprehension(g, "%s%d" % (prefix, i))
+            for i, g in enumerate(generators)
+        ])
+
+    # Builtins reducing a comprehension, run as a single loop over its
+    # elements without building the array: (before the loops, per element,
+    # after them)
+    reductions = {
+        'sum' : ("var __rv = %(start)s;", "__rv += %(exp)s;", "return __rv;"),
+        'min' : (
+            "var __rv, __first = true;",
+            "var __v = %(exp)s; if (__first || __v < __rv) { __rv = __v; __first = false; }",
+            'if (__first) { throw "ValueError"; } return __rv;',
+        ),
+        'max' : (
+            "var __rv, __first = true;",
+            "var __v = %(exp)s; if (__first || __v > __rv) { __rv = __v; __first = false; }",
+            'if (__first) { throw "ValueError"; } return __rv;',
+        ),
+        'any' : ("", "if (%(exp)s) { return true; }", "return false;"),
+        'all' : ("", "if (!(%(exp)s)) { return false; }", "return true;"),
+        'join' : (
+            'var __sep = %(sep)s, __rv = "", __first = true;',
+            '__rv += (__first ? "" : __sep) + %(exp)s; __first = false;',
+            "return __rv;",
+        ),
+    }
+
+    # Lists get all their elements evaluated even if the result is known early
+    list_reductions = dict(reductions,
+        any = ("var __rv = false;", "if (%(exp)s) { __rv = true; }", "return __rv;"),
+        all = ("var __rv = true;", "if (!(%(exp)s)) { __rv = false; }", "return __rv;"),
+    )
+
+    def fused_reduction(self, n):
+        if n.keywords or n.starargs or n.kwargs or not n.args:
+            return None
+        comp = n.args[0]
+        if not isinstance(comp, (ast.ListComp, ast.GeneratorExp)):
+            return None
+        params = dict(start = "0", sep = None)
+        if (        isinstance(n.func, ast.Attribute)
+                    and n.func.attr == 'join'
+                    and isinstance(n.func.value, ast.Str)
+                ):
+            name = 'join'
+            params['sep'] = self.visit(n.func.value)
+        elif isinstance(n.func, ast.Name) and n.func.id in self.reductions and n.func.id != 'join':
+            name = n.func.id
+        else:
+            return None
+        if name == 'sum' and len(n.args) == 2:
+            params['start'] = self.visit(n.args[1])
+        elif len(n.args) != 1:
+            return None
+        if isinstance(comp, ast.ListComp):
+            before, step, after = self.list_reductions[name]
+        else:
+            before, step, after = self.reductions[name]
+        params['exp'] = self.visit(comp.elt)
+        return "(function(){ %s %s %s %s ; %s })()" % (
+            before % params,
+            self.comprehension_loops(comp.generators, '__iter'),
+            step % params,
+            "}}" * len(comp.generators),
+            after,
+        )
+
     def visit_Num(self, n):
         return json.dumps(n.n)
 
@@ -58,6 +230,10 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
         return n.id
 
     def visit_Subscript(self, n):
+        if isinstance(n.slice, ast.Slice) and isinstance(n.ctx, ast.Load):
+            bounds = [n.slice.lower, n.slice.upper] + ([n.slice.step] if n.slice.step else [])
+            return self.helper('slice', self.visit(n.value),
+                *[self.visit(b) if b is not None else "null" for b in bounds])
         return "%s[%s]" % (self.visit(n.value), self.visit(n.slice))
 
     def visit_Attribute(self, n):
@@ -78,7 +254,75 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
     def visit_Repr(self, n):
         return "JSON.stringify(%s)" % (self.visit(n.value),)
 
+    def format_template(self, n):
+        # "..." % (...) using only %s, as emitted for string building
+        if not (isinstance(n.op, ast.Mod) and isinstance(n.left, ast.Str)):
+            return None
+        values = n.right.elts if isinstance(n.right, ast.Tuple) else [n.right]
+        pieces = re.split(r"(%.)", n.left.s)
+        if any([p.startswith('%') and p not in ('%s', '%%') for p in pieces]):
+            return None
+        if len([p for p in pieces if p == '%s']) != len(values):
+            return None
+        values = iter(values)
+        parts = []
+        for p in pieces:
+            if p == '%s':
+                parts.append((True, self.visit(self.unwrap_str(next(values)))))
+            elif p == '%%':
+                parts.append((False, '%'))
+            elif p:
+                parts.append((False, p))
+        return template_literal(parts)
+
+    def join_template(self, n):
+        # "sep".join((a, b, ...)) over a literal sequence
+        if not (isinstance(n.func, ast.Attribute)
+                and n.func.attr == 'join'
+                and isinstance(n.func.value, ast.Str)
+                and len(n.args) == 1
+                and isinstance(n.args[0], (ast.Tuple, ast.List))):
+            return None
+        parts = []
+        for i, e in enumerate(n.args[0].elts):
+            if i and n.func.value.s:
+                parts.append((False, n.func.value.s))
+            if isinstance(e, ast.Str):
+                parts.append((False, e.s))
+            else:
+                parts.append((True, self.visit(self.unwrap_str(e))))
+        return template_literal(parts)
+
+    def helper_call(self, n):
+        # Builtins and methods with a runtime helper
+        if n.keywords or n.starargs or n.kwargs:
+            return None
+        if isinstance(n.func, ast.Name) and n.func.id in self.builtin_helpers:
+            return self.helper(self.builtin_helpers[n.func.id], *map(self.visit, n.args))
+        elif isinstance(n.func, ast.Attribute) and n.func.attr in self.method_helpers:
+            if n.func.attr == 'get':
+                if len(n.args) not in (1, 2):
+                    return None
+                return self.helper('get', *[self.visit(n.func.value)] + map(self.visit, n.args))
+            elif n.args:
+                return None
+            # keys() and iterkeys() share a helper, which gets the method
+            # name to call on receivers that aren't dicts
+            return self.helper(self.method_helpers[n.func.attr],
+                self.visit(n.func.value), '"%s"' % n.func.attr)
+        return None
+
+    def unwrap_str(self, n):
+        # Interpolation already converts to string
+        if (isinstance(n, ast.Call) and isinstance(n.func, ast.Name)
+                and n.func.id == 'str' and len(n.args) == 1):
+            return n.args[0]
+        return n
+
     def visit_Call(self, n):
+        template = self.join_template(n) or self.fused_reduction(n) or self.helper_call(n)
+        if template is not None:
+            return template
         if n.keywords or n.starargs or n.kwargs:
             raise NotImplementedError
         return "%s(%s)" % (self.visit(n.func),
@@ -89,61 +333,35 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
 
     def visit_Compare(self, n):
         parts = []
-        cmpops = {
-            ast.Eq : '(%s == %s)',
-            ast.NotEq : '(%s != %s)',
-            ast.Lt : '(%s < %s)',
-            ast.LtE : '(%s <= %s)',
-            ast.Gt : '(%s > %s)',
-            ast.GtE : '(%s >= %s)',
-            ast.Is : '(%s === %s)',
-            ast.IsNot : '(%s !== %s)',
-            ast.In : '(%s in %s)',
-            ast.NotIn : '!(%s in %s))',
-        }
         prev = self.visit(n.left)
         for op, v in zip(n.ops, n.comparators):
             cur = self.visit(v)
-            parts.append(cmpops[type(op)] % (prev, cur))
+            if isinstance(op, ast.In):
+                parts.append(self.helper('contains', cur, prev))
+            elif isinstance(op, ast.NotIn):
+                parts.append("(!%s)" % self.helper('contains', cur, prev))
+            else:
+                parts.append(self.cmpops[type(op)] % (prev, cur))
             prev = cur
         return "(%s)" % " && ".join(parts)
 
     def visit_BinOp(self, n):
-        binops = {
-            ast.Add : '+',
-            ast.Sub : '-',
-            ast.Mult : '*',
-            ast.Div : '/',
-            ast.Mod : '%',
-            ast.Pow : '**',
-            ast.LShift : '<<',
-            ast.RShift : '>>',
-            ast.BitOr : '|',
-            ast.BitXor : '^',
-            ast.BitAnd : '&',
-            ast.FloorDiv : '/',
-        }
+        template = self.format_template(n)
+        if template is not None:
+            return template
+        if isinstance(n.op, ast.FloorDiv):
+            return self.helper('floordiv', self.visit(n.left), self.visit(n.right))
         return "(%s)" % " ".join([
             self.visit(n.left),
-            binops[type(n.op)],
+            self.binops[type(n.op)],
             self.visit(n.right)
         ])
 
     def visit_BoolOp(self, n):
-        boolops = {
-            ast.And : ' && ',
-            ast.Or : ' || ',
-        }
-        return "(%s)" % boolops[type(n.op)].join(map(self.visit, n.values))
+        return "(%s)" % self.boolops[type(n.op)].join(map(self.visit, n.values))
 
     def visit_UnaryOp(self, n):
-        unops = {
-            ast.Invert : '~',
-            ast.Not : '!',
-            ast.UAdd : '+',
-            ast.USub : '-',
-        }
-        return "(%s(%s))" % (unops[type(n.op)], self.visit(n.operand))
+        return "(%s(%s))" % (self.unops[type(n.op)], self.visit(n.operand))
 
     def visit_Lambda(self, n):
         return "(function(%s){ return %s; })" % (
@@ -164,19 +382,40 @@ class ExpressionDecompilingVisitor(ast.NodeVisitor):
 
     def visit_Dict(self, n):
         return "{%s}" % ", ".join([
-            "%s : %s" % (self.visit(k), self.visit(v))
+            "%s : %s" % (self.object_key(k), self.visit(v))
             for k,v in zip(n.keys, n.values)
         ])
 
 
-class StatementDecompilingVisitor(ast.NodeVisitor):
+class StatementDecompilingVisitor(visitor.DispatchVisitor):
+
+    augops = {
+        ast.Add : '+=',
+        ast.Sub : '-=',
+        ast.Mult : '*=',
+        ast.Div : '/=',
+        ast.Mod : '%=',
+        ast.Pow : '**=',
+        ast.LShift : '<<=',
+        ast.RShift : '>>=',
+        ast.BitOr : '|=',
+        ast.BitXor : '^=',
+        ast.BitAnd : '&=',
+    }
 
     def __init__(self):
         self.indent = 0
         self.buf = StringIO.StringIO()
+        # Labels break needs to use to leave each enclosing loop
+        self.loops = []
+        self.loop_ids = 0
+        self.runtime = set()
+
+    def expression_visitor(self):
+        return ExpressionDecompilingVisitor(self.runtime)
 
     def decompile_expr(self, n):
-        return ExpressionDecompilingVisitor().visit(n)
+        return self.expression_visitor().visit(n)
 
     def emit_line(self, fmt, *p, **kw):
         extra_indent = kw.pop('extra_indent', 0)
@@ -188,7 +427,10 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         self.emit_line("%s;", self.decompile_expr(n.value))
 
     def visit_Return(self, n):
-        self.emit_line("return %s;", self.decompile_expr(n.value))
+        if n.value is None:
+            self.emit_line("return;")
+        else:
+            self.emit_line("return %s;", self.decompile_expr(n.value))
 
     def visit_Delete(self, n):
         self.emit_line("%s = undefined;", ", ".join(map(self.decompile_expr, n.targets)))
@@ -200,23 +442,14 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         )
 
     def visit_AugAssign(self, n):
-        binops = {
-            ast.Add : '+=',
-            ast.Sub : '-=',
-            ast.Mult : '*=',
-            ast.Div : '/=',
-            ast.Mod : '%=',
-            ast.Pow : '**=',
-            ast.LShift : '<<=',
-            ast.RShift : '>>=',
-            ast.BitOr : '|=',
-            ast.BitXor : '^=',
-            ast.BitAnd : '&=',
-            ast.FloorDiv : '/=',
-        }
+        if isinstance(n.op, ast.FloorDiv):
+            target = self.decompile_expr(n.target)
+            self.emit_line("%s = %s;", target, self.expression_visitor().helper(
+                'floordiv', target, self.decompile_expr(n.value)))
+            return
         self.emit_line("%s %s %s;",
             self.decompile_expr(n.target),
-            binops[type(n.op)],
+            self.augops[type(n.op)],
             self.decompile_expr(n.value),
         )
 
@@ -230,20 +463,44 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         self.emit_line("console.log(%s);", ", ".join(parts))
 
     def visit_For(self, n):
-        self.emit_line("{ var __iter = %(iter)s ; for (var %(target)s in __iter) { %(target)s = __iter[%(target)s];",
-            target = self.decompile_expr(n.target),
-            iter = self.decompile_expr(n.iter),
-        )
-        self.indent_visit(n.body)
+        if isinstance(n.iter, ast.GeneratorExp):
+            return self.fused_For(n)
+        self.loop_ids += 1
+        self.emit_line("%s", self.expression_visitor().loop_header(
+            n.target, n.iter, "__iter%d" % self.loop_ids))
+        self.loop_visit(n.body)
         if n.orelse:
             raise NotImplementedError
         self.emit_line("}}")
 
+    def fused_For(self, n):
+        # Runs the body inside the generator's own loops, so its elements
+        # never make it to an array. A labeled block lets break leave them all.
+        if n.orelse:
+            raise NotImplementedError
+        self.loop_ids += 1
+        label = "__fused%d" % self.loop_ids
+        gen = copy.deepcopy(n.iter)
+        # Generator variables are private, unlike JS vars
+        targets = set([
+            v.id for g in gen.generators for v in ast.walk(g.target)
+            if isinstance(v, ast.Name)
+        ])
+        for v in ast.walk(gen):
+            if isinstance(v, ast.Name) and v.id in targets:
+                v.id = "%s_%s" % (label, v.id)
+        self.emit_line("%s: %s", label,
+            self.expression_visitor().comprehension_loops(gen.generators, label + '_'))
+        self.emit_line("%s = %s;", self.decompile_expr(n.target), self.decompile_expr(gen.elt),
+            extra_indent = 4)
+        self.loop_visit(n.body, label)
+        self.emit_line("%s", "}}" * len(gen.generators))
+
     def visit_While(self, n):
         self.emit_line("while (%(test)s) {",
             test = self.decompile_expr(n.test),
         )
-        self.indent_visit(n.body)
+        self.loop_visit(n.body)
         if n.orelse:
             raise NotImplementedError
         self.emit_line("}")
@@ -256,7 +513,9 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         self.indent_visit(n.body)
         if n.orelse:
             if len(n.orelse) == 1 and type(n.orelse[0]) == ast.If:
+                # Which closes the whole chain
                 self.visit_If(n.orelse[0], '} else if')
+                return
             else:
                 self.emit_line("} else {")
                 self.indent_visit(n.orelse)
@@ -317,7 +576,10 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
         self.emit_line("continue;")
 
     def visit_Break(self, n):
-        self.emit_line("break;")
+        if self.loops and self.loops[-1]:
+            self.emit_line("break %s;", self.loops[-1])
+        else:
+            self.emit_line("break;")
 
     def visit_Global(self, n):
         pass
@@ -347,10 +609,17 @@ class StatementDecompilingVisitor(ast.NodeVisitor):
             self.visit(s)
         self.indent -= 4
 
+    def loop_visit(self, nl, label = None):
+        self.loops.append(label)
+        try:
+            self.indent_visit(nl)
+        finally:
+            self.loops.pop()
+
 def decompile(n):
     v = StatementDecompilingVisitor()
     v.visit(n)
-    return v.buf.getvalue()
+    return jsruntime.prelude(v.runtime) + v.buf.getvalue()
 
 def decompile_expr(e):
     return ExpressionDecompilingVisitor().visit(e)
@@ -2,30 +2,51 @@ import ast
 
 import decompile_js
 
+extension = decompile_js.extension
+
 class ExpressionDecompilingVisitor(decompile_js.ExpressionDecompilingVisitor):
 
+    const_names = {
+        'None' : 'null',
+        'True' : 'true',
+        'False' : 'false',
+    }
+
+    builtins = {
+        'int' : 'parseInt',
+        'float' : 'parseFloat',
+        'str' : 'String',
+        'repr' : 'JSON.stringify',
+    }
+
+    binop_formats = {
+        ast.Add : '(%s + %s)',
+        ast.Sub : '(%s - %s)',
+        ast.Mult : '(%s * %s)',
+        ast.Div : '(%s / %s)',
+        ast.Mod : '(%s %% %s)',
+        ast.Pow : '(%s ** %s)',
+        ast.LShift : '(%s << %s)',
+        ast.RShift : '(%s >> %s)',
+        ast.BitOr : '(%s | %s)',
+        ast.BitXor : '(%s ^ %s)',
+        ast.BitAnd : '(%s & %s)',
+    }
+
     def visit_Name(self, n):
-        builtins = {
-            'None' : 'null',
-            'True' : 'true',
-            'False' : 'false',
-        }
-        if n.id in builtins:
-            return builtins[n.id]
+        if n.id in self.const_names:
+            return self.const_names[n.id]
         else:
             return n.id
 
     def visit_Call(self, n):
+        template = self.join_template(n) or self.fused_reduction(n) or self.helper_call(n)
+        if template is not None:
+            return template
         if n.keywords or n.starargs or n.kwargs:
             raise NotImplementedError
-        builtins = {
-            'int' : 'parseInt',
-            'float' : 'parseFloat',
-            'str' : 'String',
-            'repr' : 'JSON.stringify',
-        }
-        if isinstance(n.func, ast.Name) and n.func.id in builtins and len(n.args) == 1:
-            func = builtins[n.func.id]
+        if isinstance(n.func, ast.Name) and n.func.id in self.builtins and len(n.args) == 1:
+            func = self.builtins[n.func.id]
         else:
             func = self.visit(n.func)
         return "%s(%s)" % (func,
@@ -34,43 +55,13 @@ class ExpressionDecompilingVisitor(decompile_js.ExpressionDecompilingVisitor):
             ]))
         )
 
-    def visit_Compare(self, n):
-        parts = []
-        cmpops = {
-            ast.Eq : '(%s == %s)',
-            ast.NotEq : '(%s != %s)',
-            ast.Lt : '(%s < %s)',
-            ast.LtE : '(%s <= %s)',
-            ast.Gt : '(%s > %s)',
-            ast.GtE : '(%s >= %s)',
-            ast.Is : '(%s === %s)',
-            ast.IsNot : '(%s !== %s)',
-            ast.In : '(%s in %s)',
-            ast.NotIn : '!(%s in %s))',
-        }
-        prev = self.visit(n.left)
-        for op, v in zip(n.ops, n.comparators):
-            cur = self.visit(v)
-            parts.append(cmpops[type(op)] % (prev, cur))
-            prev = cur
-        return "(%s)" % " && ".join(parts)
-
     def visit_BinOp(self, n):
-        binops = {
-            ast.Add : '(%s + %s)',
-            ast.Sub : '(%s - %s)',
-            ast.Mult : '(%s * %s)',
-            ast.Div : '(%s / %s)',
-            ast.Mod : '(%s %% %s)',
-            ast.Pow : '(%s ** %s)',
-            ast.LShift : '(%s << %s)',
-            ast.RShift : '(%s >> %s)',
-            ast.BitOr : '(%s | %s)',
-            ast.BitXor : '(%s ^ %s)',
-            ast.BitAnd : '(%s & %s)',
-            ast.FloorDiv : '(parseInt(%s / %s))',
-        }
-        return binops[type(n.op)] % (
+        template = self.format_template(n)
+        if template is not None:
+            return template
+        if isinstance(n.op, ast.FloorDiv):
+            return self.helper('floordiv', self.visit(n.left), self.visit(n.right))
+        return self.binop_formats[type(n.op)] % (
             self.visit(n.left),
             self.visit(n.right),
         )
@@ -78,13 +69,13 @@ class ExpressionDecompilingVisitor(decompile_js.ExpressionDecompilingVisitor):
 
 class StatementDecompilingVisitor(decompile_js.StatementDecompilingVisitor):
 
-    def decompile_expr(self, n):
-        return ExpressionDecompilingVisitor().visit(n)
+    def expression_visitor(self):
+        return ExpressionDecompilingVisitor(self.runtime)
 
 def decompile(n):
     v = StatementDecompilingVisitor()
     v.visit(n)
-    return v.buf.getvalue()
+    return decompile_js.jsruntime.prelude(v.runtime) + v.buf.getvalue()
 
 def decompile_expr(e):
     return ExpressionDecompilingVisitor().visit(e)
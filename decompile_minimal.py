@@ -0,0 +1,161 @@
+import ast
+
+import decompile as python_decompile
+
+extension = python_decompile.extension
+
+# Binding strength of each kind of expression, loosest first, as in the
+# grammar: lambda, if-else, or, and, not, comparisons, |, ^, &, shifts,
+# + -, * / // %, unary + - ~, **, and then everything that's an atom
+LAMBDA, IFEXP, OR, AND, NOT, COMPARE, BITOR, BITXOR, BITAND, SHIFT, ARITH, TERM, UNARY, POWER, ATOM = range(15)
+
+binop_precedence = {
+    ast.BitOr : BITOR,
+    ast.BitXor : BITXOR,
+    ast.BitAnd : BITAND,
+    ast.LShift : SHIFT,
+    ast.RShift : SHIFT,
+    ast.Add : ARITH,
+    ast.Sub : ARITH,
+    ast.Mult : TERM,
+    ast.Div : TERM,
+    ast.FloorDiv : TERM,
+    ast.Mod : TERM,
+    ast.Pow : POWER,
+}
+
+def precedence(n):
+    if isinstance(n, ast.Lambda):
+        return LAMBDA
+    elif isinstance(n, ast.IfExp):
+        return IFEXP
+    elif isinstance(n, ast.BoolOp):
+        return OR if isinstance(n.op, ast.Or) else AND
+    elif isinstance(n, ast.UnaryOp):
+        return NOT if isinstance(n.op, ast.Not) else UNARY
+    elif isinstance(n, ast.Compare):
+        return COMPARE
+    elif isinstance(n, ast.BinOp):
+        return binop_precedence[type(n.op)]
+    elif isinstance(n, ast.Num) and repr(n.n).startswith('-'):
+        # Parsed as a unary minus applied to the number
+        return UNARY
+    return ATOM
+
+class ExpressionDecompilingVisitor(python_decompile.ExpressionDecompilingVisitor):
+    # Only emits the parentheses precedence and associativity need for the
+    # output to parse back to the same tree. Nested ands, ors and
+    # comparisons keep theirs, since they'd otherwise parse as one.
+
+    def operand(self, n, weakest):
+        # n as an operand that binds at least as strongly as weakest
+        if precedence(n) < weakest:
+            return "(%s)" % self.visit(n)
+        return self.visit(n)
+
+    def visit_Expr(self, n):
+        return self.visit(n.value)
+
+    def visit_Compare(self, n):
+        parts = [self.operand(n.left, COMPARE + 1)]
+        for op, v in zip(n.ops, n.comparators):
+            parts.append(self.cmpops[type(op)])
+            parts.append(self.operand(v, COMPARE + 1))
+        return " ".join(parts)
+
+    def visit_BinOp(self, n):
+        p = precedence(n)
+        if isinstance(n.op, ast.Pow):
+            # Right associative, and the exponent may be a unary operation
+            left, right = ATOM, UNARY
+        else:
+            left, right = p, p + 1
+        return "%s %s %s" % (
+            self.operand(n.left, left),
+            self.binops[type(n.op)],
+            self.operand(n.right, right),
+        )
+
+    def visit_BoolOp(self, n):
+        p = precedence(n)
+        return self.boolops[type(n.op)].join([self.operand(v, p + 1) for v in n.values])
+
+    def visit_UnaryOp(self, n):
+        if isinstance(n.op, ast.Not):
+            return "not %s" % self.operand(n.operand, NOT)
+        elif isinstance(n.op, ast.USub) and isinstance(n.operand, ast.Num):
+            # -1 would parse as the number -1
+            return "-(%s)" % self.visit(n.operand)
+        return "%s%s" % (self.unops[type(n.op)], self.operand(n.operand, UNARY))
+
+    def visit_Lambda(self, n):
+        args = self.visit_args(n.args)
+        return "lambda %s: %s" % (args, self.visit(n.body)) if args else "lambda: %s" % self.visit(n.body)
+
+    def visit_IfExp(self, n):
+        return "%s if %s else %s" % (
+            self.operand(n.body, OR),
+            self.operand(n.test, OR),
+            self.visit(n.orelse),
+        )
+
+    def visit_Attribute(self, n):
+        if isinstance(n.value, ast.Num):
+            # 1.real would be read as a float
+            return "(%s).%s" % (self.visit(n.value), n.attr)
+        return "%s.%s" % (self.operand(n.value, ATOM), n.attr)
+
+    def visit_Subscript(self, n):
+        return "%s[%s]" % (self.operand(n.value, ATOM), self.visit(n.slice))
+
+    def visit_Slice(self, n):
+        return "%s:%s%s" % (
+            (self.operand(n.lower, IFEXP) if n.lower else ""),
+            (self.operand(n.upper, IFEXP) if n.upper else ""),
+            (":%s" % (self.operand(n.step, IFEXP),) if n.step else ""),
+        )
+
+    def visit_Call(self, n):
+        return "%s(%s)" % (self.operand(n.func, ATOM),
+            ", ".join(filter(None, [
+                ", ".join(map(self.visit, n.args)),
+                ", ".join(["%s=%s" % (k.arg, self.visit(k.value)) for k in n.keywords]),
+                ("*%s" % (self.visit(n.starargs),) if n.starargs else None),
+                ("**%s" % (self.visit(n.kwargs),) if n.kwargs else None),
+            ]))
+        )
+
+    def visit_Repr(self, n):
+        return "`%s`" % (self.visit(n.value),)
+
+    def visit_comprehension(self, n):
+        return "for %s in %s%s" % (
+            self.visit(n.target),
+            self.operand(n.iter, OR),
+            "".join([" if %s" % self.operand(_if, OR) for _if in n.ifs]),
+        )
+
+    def visit_Dict(self, n):
+        return "{%s}" % ", ".join([
+            "%s : %s" % (self.operand(k, IFEXP), self.visit(v))
+            for k,v in zip(n.keys, n.values)
+        ])
+
+    def visit_DictComp(self, n):
+        return "{%s:%s %s}" % (
+            self.operand(n.key, IFEXP), self.visit(n.value),
+            " ".join(map(self.visit_comprehension, n.generators))
+        )
+
+class StatementDecompilingVisitor(python_decompile.StatementDecompilingVisitor):
+
+    def expression_visitor(self):
+        return ExpressionDecompilingVisitor()
+
+def decompile(n):
+    v = StatementDecompilingVisitor()
+    v.visit(n)
+    return v.buf.getvalue()
+
+def decompile_expr(e):
+    return ExpressionDecompilingVisitor().visit(e)
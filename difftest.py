@@ -0,0 +1,305 @@
+from __future__ import print_function
+
+import argparse
+import ast
+import cPickle
+import gc
+import imp
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import types
+
+import rewrite
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Recorded calls are stored as the repr of their arguments, which
+# ast.literal_eval reads back with the exact same types (json would turn
+# str into unicode and tuples into lists)
+
+def encode_call(name, args, kwargs):
+    try:
+        encoded = repr(tuple(args)), repr(kwargs)
+        if ast.literal_eval(encoded[0]) != tuple(args) or ast.literal_eval(encoded[1]) != kwargs:
+            return None
+    except (ValueError, SyntaxError):
+        return None
+    return { 'function' : name, 'args' : encoded[0], 'kwargs' : encoded[1] }
+
+def decode_call(call):
+    return (
+        call['function'],
+        ast.literal_eval(call.get('args', '()')),
+        ast.literal_eval(call.get('kwargs', '{}')),
+    )
+
+def run_module(path):
+    # Runs the module as __main__ in this process, keeping it around after
+    mod = imp.new_module('__main__')
+    mod.__file__ = path
+    sys.modules['__main__'] = mod
+    with open(path, "r") as f:
+        code = compile(f.read(), path, 'exec', 0, True)
+    exec code in mod.__dict__
+    return mod
+
+def record_calls(path, max_per_function):
+    # Calls to the module's own top-level functions while it runs, with
+    # arguments that have a literal form
+    calls = []
+    counts = {}
+    def profile(frame, event, arg):
+        if event != 'call' or frame.f_code.co_filename != path:
+            return
+        name = frame.f_code.co_name
+        f = frame.f_globals.get(name)
+        if not isinstance(f, types.FunctionType) or f.__code__ is not frame.f_code:
+            return
+        if counts.get(name, 0) >= max_per_function:
+            return
+        code = frame.f_code
+        names = code.co_varnames[:code.co_argcount]
+        args = [frame.f_locals[a] for a in names]
+        kwargs = {}
+        i = code.co_argcount
+        if code.co_flags & 0x04:
+            args.extend(frame.f_locals[code.co_varnames[i]])
+            i += 1
+        if code.co_flags & 0x08:
+            kwargs = frame.f_locals[code.co_varnames[i]]
+        call = encode_call(name, args, kwargs)
+        if call is not None:
+            counts[name] = counts.get(name, 0) + 1
+            calls.append(call)
+
+    sys.setprofile(profile)
+    try:
+        run_module(path)
+    finally:
+        sys.setprofile(None)
+    return calls
+
+def allocations(f, args, kwargs):
+    # Peak bytes allocated when tracemalloc is around, otherwise the net
+    # count of gc-tracked objects the call created
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            f(*args, **kwargs)
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return peak
+
+    enabled = gc.isenabled()
+    gc.disable()
+    gc.collect()
+    try:
+        before = gc.get_count()[0]
+        f(*args, **kwargs)
+        return gc.get_count()[0] - before
+    finally:
+        if enabled:
+            gc.enable()
+
+def time_call(f, args, kwargs, repeat, min_time = 0.002):
+    # Best time per call, looping each run enough for the timer's resolution
+    timer = timeit.Timer(lambda : f(*args, **kwargs))
+    number = 1
+    while number < 1000000 and timer.timeit(number) < min_time:
+        number *= 10
+    return min(timer.repeat(repeat, number)) / number
+
+def run_calls(mod, calls, repeat):
+    results = []
+    stats = {}
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    for call in calls:
+        name, args, kwargs = decode_call(call)
+        f = getattr(mod, name, None)
+        if f is None:
+            results.append(('missing', name))
+            continue
+        try:
+            results.append(('return', repr(f(*args, **kwargs))))
+        except Exception as e:
+            results.append(('raise', "%s: %s" % (type(e).__name__, e)))
+            continue
+
+        # Only the first call's output counts, it's the same every time
+        sys.stdout = devnull
+        try:
+            best = time_call(f, args, kwargs, repeat)
+            allocs = allocations(f, args, kwargs)
+        finally:
+            sys.stdout = stdout
+        ncalls, seconds, total_allocs = stats.get(name, (0, 0.0, 0))
+        stats[name] = (ncalls + 1, seconds + best, total_allocs + allocs)
+    devnull.close()
+    return results, stats
+
+def child_main(argv):
+    mode, path, calls_path, results_path, param = argv
+    main = sys.modules['__main__']
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    if mode == 'record':
+        calls = record_calls(path, int(param))
+        with open(results_path, "w") as f:
+            json.dump(calls, f, indent=1)
+    else:
+        with open(calls_path, "r") as f:
+            calls = json.load(f)
+        mod = run_module(path)
+        sys.stdout.flush()
+        results, stats = run_calls(mod, calls, int(param))
+        with open(results_path, "wb") as f:
+            cPickle.dump((results, stats), f, 2)
+    sys.stdout.flush()
+    sys.modules['__main__'] = main
+
+def run_child(mode, path, calls_path, results_path, param, cwd):
+    p = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child',
+            mode, path, calls_path, results_path, str(param)],
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+        cwd = cwd,
+    )
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise RuntimeError("%s failed:\n%s" % (path, err))
+    return out
+
+def rewrite_module(path, ops, outdir):
+    with open(path, "r") as f:
+        root = ast.parse(f.read(), path)
+    root, decompile, output = rewrite.transform(root, ops)
+    if output is not None or decompile.extension != '.py':
+        raise ValueError("differential runs need Python source output")
+    rv = os.path.join(outdir, os.path.basename(path))
+    with open(rv, "w") as f:
+        f.write(decompile.decompile(root))
+        f.write("\n")
+    return rv
+
+def compare(path, ops, calls = None, repeat = 5, max_per_function = 10):
+    # Runs the module and its rewritten version in separate processes, then
+    # calls the recorded functions on both. Returns a report dict.
+    path = os.path.abspath(path)
+    cwd = os.path.dirname(path)
+    tmpdir = tempfile.mkdtemp(prefix='difftest')
+    try:
+        calls_path = os.path.join(tmpdir, 'calls.json')
+        if calls is None:
+            run_child('record', path, calls_path, calls_path, max_per_function, cwd)
+            with open(calls_path, "r") as f:
+                calls = json.load(f)
+        else:
+            with open(calls_path, "w") as f:
+                json.dump(calls, f)
+
+        rewritten = rewrite_module(path, ops, tmpdir)
+        runs = []
+        for name, module in (('original', path), ('rewritten', rewritten)):
+            results_path = os.path.join(tmpdir, name + '.pickle')
+            out = run_child('run', module, calls_path, results_path, repeat, cwd)
+            with open(results_path, "rb") as f:
+                runs.append((out,) + cPickle.load(f))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    (out_a, results_a, stats_a), (out_b, results_b, stats_b) = runs
+    mismatches = [
+        { 'call' : call, 'original' : a, 'rewritten' : b }
+        for call, a, b in zip(calls, results_a, results_b)
+        if a != b
+    ]
+    functions = {}
+    for name in sorted(set(stats_a) | set(stats_b)):
+        ncalls, time_a, allocs_a = stats_a.get(name, (0, 0.0, 0))
+        time_b, allocs_b = stats_b.get(name, (0, 0.0, 0))[1:]
+        functions[name] = {
+            'calls' : ncalls,
+            'original_time' : time_a,
+            'rewritten_time' : time_b,
+            'speedup' : time_a / time_b if time_b else None,
+            'original_allocs' : allocs_a,
+            'rewritten_allocs' : allocs_b,
+        }
+    return {
+        'module' : path,
+        'ops' : ops,
+        'calls' : calls,
+        'stdout_matches' : out_a == out_b,
+        'stdout' : { 'original' : out_a, 'rewritten' : out_b },
+        'mismatches' : mismatches,
+        'alloc_unit' : 'peak bytes' if tracemalloc is not None else 'gc objects',
+        'functions' : functions,
+    }
+
+def print_report(report, out = sys.stdout):
+    print("%s: %s" % (report['module'], " ".join(report['ops']) or "(no ops)"), file=out)
+    print("stdout: %s" % ("same" if report['stdout_matches'] else "DIFFERENT"), file=out)
+    print("returns: %d calls, %d mismatches" % (len(report['calls']), len(report['mismatches'])), file=out)
+    for m in report['mismatches']:
+        print("  %s%s: %r != %r" % (m['call']['function'], m['call']['args'],
+            m['original'], m['rewritten']), file=out)
+    if report['functions']:
+        print("%-24s %6s %12s %12s %8s %12s %12s" % ('function', 'calls',
+            'orig ms', 'new ms', 'speedup', 'orig allocs', 'new allocs'), file=out)
+    for name, f in sorted(report['functions'].iteritems()):
+        print("%-24s %6d %12.4f %12.4f %8s %12d %12d" % (
+            name, f['calls'],
+            f['original_time'] * 1000, f['rewritten_time'] * 1000,
+            "%.2fx" % f['speedup'] if f['speedup'] else "-",
+            f['original_allocs'], f['rewritten_allocs'],
+        ), file=out)
+    print("(allocs in %s)" % report['alloc_unit'], file=out)
+
+def main(argv):
+    if argv[1:2] == ['--child']:
+        return child_main(argv[2:])
+
+    parser = argparse.ArgumentParser(
+        description="Check a rewrite.py op list keeps a module's behavior, and measure its effect")
+    parser.add_argument('module')
+    parser.add_argument('--ops', default='', help="Space-separated rewrite.py op list")
+    parser.add_argument('--inputs', help="JSON file with the calls to make, recorded from a module run if not given")
+    parser.add_argument('--record', help="Save the calls used to this JSON file")
+    parser.add_argument('--max-per-function', type=int, default=10,
+        help="Calls recorded per function")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing runs per call (best is kept)")
+    parser.add_argument('--json', action='store_true', help="Print the full report as JSON")
+    args = parser.parse_args(argv[1:])
+
+    calls = None
+    if args.inputs:
+        with open(args.inputs, "r") as f:
+            calls = json.load(f)
+    try:
+        report = compare(args.module, args.ops.split(), calls, args.repeat, args.max_per_function)
+    except (ValueError, RuntimeError) as e:
+        sys.exit(str(e))
+    if args.record:
+        with open(args.record, "w") as f:
+            json.dump(report['calls'], f, indent=1)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+    else:
+        print_report(report)
+    return 0 if report['stdout_matches'] and not report['mismatches'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
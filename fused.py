@@ -0,0 +1,82 @@
+import ast
+
+import constprop
+import inlining
+
+class FusedTransformer(constprop.ConstPropTransformer, inlining.InlineTransformer):
+    # Applies the constprop and inline rewrites in a single bottom-up walk.
+    #
+    # Inlining only happens where InlineTransformer would eventually reach
+    # (outside function bodies, and not below calls that stay calls), so the
+    # result matches running "constprop inline" until nothing changes.
+
+    pass_name = 'fused'
+
+    # Bounds expansions nested inside expansions, which only self-applying
+    # lambdas can reach since recursive functions are never expanded
+    max_depth = 64
+
+    def __init__(self, bindings = None):
+        constprop.ConstPropTransformer.__init__(self, bindings)
+        inlining.InlineTransformer.__init__(self)
+        self.inline_enabled = True
+        self.depth = 0
+
+    def visit_without_inlining(self, n):
+        enabled, self.inline_enabled = self.inline_enabled, False
+        try:
+            return self.generic_visit(n)
+        finally:
+            self.inline_enabled = enabled
+
+    def visit_FunctionDef(self, n):
+        enabled = self.inline_enabled
+        n = self.visit_without_inlining(n)
+        if enabled:
+            return inlining.InlineTransformer.visit_FunctionDef(self, n)
+        return n
+
+    def visit_Call(self, n):
+        if not self.inline_enabled:
+            return constprop.ConstPropTransformer.visit_Call(self, n)
+
+        n = self.fold_call(self.visit_without_inlining(n))
+        if not isinstance(n, ast.Call):
+            return n
+
+        # Repeated passes would expand these one level at a time, forever
+        if self.depth >= self.max_depth:
+            self.missed(n, "expansions nested more than %d deep", self.max_depth)
+            return n
+        elif self.is_recursive(n.func):
+            self.missed(n, "can't inline %s, it's recursive", n.func.id)
+            return n
+        inlined = self.inline_call(n)
+        if inlined is n:
+            return n
+
+        # The callee's body comes in unfolded and calls in the arguments just
+        # became reachable, so simplify the expansion until no rule applies
+        self.depth += 1
+        try:
+            return self.visit(inlined)
+        finally:
+            self.depth -= 1
+
+    def is_recursive(self, func):
+        if not isinstance(func, ast.Name):
+            return False
+        seen = set()
+        pending = [func.id]
+        while pending:
+            name = pending.pop()
+            fdef = self.funcdefs.get(name)
+            if name in seen or not fdef:
+                continue
+            seen.add(name)
+            for c in ast.walk(fdef):
+                if isinstance(c, ast.Call) and isinstance(c.func, ast.Name):
+                    if c.func.id == func.id:
+                        return True
+                    pending.append(c.func.id)
+        return False
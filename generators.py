@@ -0,0 +1,277 @@
+import ast
+import collections
+
+import constprop
+import visitor
+
+def name_counts(n):
+    return collections.Counter([v.id for v in ast.walk(n) if isinstance(v, ast.Name)])
+
+def target_names(comp):
+    return set([
+        v.id for gen in comp.generators for v in ast.walk(gen.target)
+        if isinstance(v, ast.Name)
+    ])
+
+class GeneratorTransformer(visitor.DispatchTransformer):
+    # Turns list comprehensions whose list is only iterated once into
+    # generator expressions, so elements are produced as they're consumed
+    # instead of all being kept around:
+    #
+    #   sum([x * x for x in l])         consumed by a builtin
+    #   for x in [y * 2 for y in l]:    iterated by a loop
+    #   ys = [...]; return max(ys)      either, right after being bound
+    #
+    # Elements then get computed in between the consumer's work, so unless
+    # the consumer is a builtin consuming everything in order, the
+    # comprehension can't have effects or raise, since the consumer would
+    # now run (or any() and all() stop) before getting to the element that
+    # raises, and the consumer can't change what it reads. Arithmetic and
+    # comparisons are assumed to get operands they take, so only what can
+    # raise on those counts: calls, division, powers, shifts, subscripts
+    # and attribute loads.
+
+    pass_name = 'genexp'
+
+    # Consume all elements in order, whatever they do
+    consumers = ('sum', 'min', 'max', 'sorted', 'set', 'frozenset', 'tuple', 'list', 'dict')
+    # Stop at the first element that decides the result
+    short_circuit = ('any', 'all')
+    introspection = ('locals', 'vars', 'dir', 'eval')
+
+    # Methods that only add to the container they're called on
+    adders = ('append', 'extend', 'add', 'update', 'insert', 'setdefault')
+
+    # Raise for some values of the types they take
+    raising_ops = (ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.LShift, ast.RShift)
+
+    def __init__(self):
+        self.bindings = None
+        self.scope = None
+        self.scope_names = None
+        self.class_body = False
+
+    def is_bound(self, name):
+        return self.bindings is not None and self.bindings.bindings.get(name, 0) > 0
+
+    def visit_Module(self, n):
+        if self.bindings is None:
+            self.bindings = constprop.BindingsVisitor()
+            self.bindings.visit(n)
+        if self.bindings.opaque:
+            return n
+        return self.visit_scope(n)
+
+    def visit_FunctionDef(self, n):
+        return self.visit_scope(n)
+
+    def visit_ClassDef(self, n):
+        # Class scopes aren't visible from generator expressions
+        class_body, self.class_body = self.class_body, True
+        try:
+            return self.generic_visit(n)
+        finally:
+            self.class_body = class_body
+
+    def visit_scope(self, n):
+        saved = self.scope, self.scope_names, self.class_body
+        self.scope = n
+        self.scope_names = name_counts(n)
+        self.class_body = False
+        try:
+            if any([name in self.scope_names for name in self.introspection]):
+                return n
+            return self.generic_visit(n)
+        finally:
+            self.scope, self.scope_names, self.class_body = saved
+
+    def generic_visit(self, n):
+        n = super(GeneratorTransformer, self).generic_visit(n)
+        for field in ('body', 'orelse', 'finalbody'):
+            stmts = getattr(n, field, None)
+            if isinstance(stmts, list):
+                self.rewrite_block(stmts)
+        return n
+
+    def is_pure_call(self, n):
+        return (
+            not (n.keywords or n.starargs or n.kwargs)
+            and isinstance(n.func, ast.Name)
+            and n.func.id in constprop.ConstPropTransformer.builtins
+            and not self.is_bound(n.func.id)
+        )
+
+    def is_declared_global(self, name):
+        return self.bindings is None or name in self.bindings.declared_global
+
+    def is_fresh(self, name):
+        # Whether name is a local container nothing else can see: bound
+        # once in the function to a new one, and only used to add to it,
+        # to pass it to pure builtins, or to return it
+        if not isinstance(self.scope, ast.FunctionDef) or self.is_declared_global(name):
+            return False
+        bound = None
+        for v in ast.walk(self.scope):
+            if isinstance(v, ast.Assign):
+                if any([isinstance(t, ast.Name) and t.id == name for t in v.targets]):
+                    if bound is not None or len(v.targets) != 1:
+                        return False
+                    bound = v
+        if bound is None or not isinstance(bound.value, (ast.List, ast.Dict, ast.Set, ast.ListComp, ast.SetComp, ast.DictComp)):
+            return False
+        allowed = 1
+        for v in ast.walk(self.scope):
+            if isinstance(v, ast.Call):
+                if (        isinstance(v.func, ast.Attribute)
+                            and isinstance(v.func.value, ast.Name)
+                            and v.func.value.id == name
+                            and v.func.attr in self.adders
+                        ):
+                    allowed += 1
+                elif self.is_pure_call(v):
+                    allowed += len([a for a in v.args if isinstance(a, ast.Name) and a.id == name])
+            elif isinstance(v, ast.Return) and isinstance(v.value, ast.Name) and v.value.id == name:
+                allowed += 1
+        return self.scope_names[name] == allowed
+
+    def effects(self, nodes, allow_fresh = False):
+        # Why evaluating nodes could do something others would notice, or None
+        for n in nodes:
+            for v in ast.walk(n):
+                if isinstance(v, (ast.Yield, ast.Exec, ast.Print)):
+                    # print may call __str__ on anything
+                    return "contains a %s" % type(v).__name__
+                elif isinstance(v, ast.Call) and not self.is_pure_call(v):
+                    if (        allow_fresh
+                                and isinstance(v.func, ast.Attribute)
+                                and isinstance(v.func.value, ast.Name)
+                                and v.func.attr in self.adders
+                                and self.is_fresh(v.func.value.id)
+                            ):
+                        continue
+                    return "calls something that may have side effects"
+        return None
+
+    def raising(self, comp):
+        # What could raise while producing comp's elements, or None. The
+        # outermost iterable is evaluated up front either way.
+        nodes = [comp.elt]
+        for i, gen in enumerate(comp.generators):
+            nodes.extend([gen.target] + gen.ifs + ([gen.iter] if i else []))
+        for n in nodes:
+            for v in ast.walk(n):
+                if isinstance(v, ast.BinOp) and isinstance(v.op, self.raising_ops):
+                    return "a %s" % type(v.op).__name__
+                elif isinstance(v, (ast.Call, ast.Subscript, ast.Attribute)):
+                    return "a %s" % type(v).__name__
+                elif isinstance(v, (ast.Tuple, ast.List)) and isinstance(v.ctx, ast.Store):
+                    return "an unpacking"
+        return None
+
+    def rejection(self, comp, consumer = None, body = ()):
+        # Why comp can't be made a generator, or None. consumer is the name
+        # of the builtin consuming it, body the statements run in between
+        # elements otherwise.
+        if self.bindings is None or self.scope_names is None:
+            return "needs the whole module"
+        elif self.bindings.opaque:
+            return "the module uses exec or import *"
+        elif self.class_body:
+            return "it's in a class body"
+        names = name_counts(comp)
+        if any([self.scope_names[t] != names[t] for t in target_names(comp)]):
+            return "its leaked variable is used"
+        if consumer in self.consumers:
+            return None
+        reason = self.effects([comp])
+        if reason is not None:
+            return "it " + reason
+        reason = self.raising(comp)
+        if reason is not None:
+            return "it has %s, which may raise" % reason
+        reason = self.effects(body, True)
+        if reason is not None:
+            return "the loop " + reason
+        free = set([
+            name for name in names
+            if name not in constprop.ConstPropTransformer.builtins or self.is_bound(name)
+        ]) - target_names(comp)
+        if any([isinstance(v, ast.Name) and v.id in free for stmt in body for v in ast.walk(stmt)]):
+            return "the loop uses names it reads"
+        return None
+
+    def consumer(self, n):
+        # The name of the builtin if n is a call passing it a single iterable
+        if (        isinstance(n, ast.Call)
+                    and isinstance(n.func, ast.Name)
+                    and (n.func.id in self.consumers or n.func.id in self.short_circuit)
+                    and not self.is_bound(n.func.id)
+                    and len(n.args) == 1
+                    and not (n.starargs or n.kwargs)
+                    and (not n.keywords or n.func.id in ('min', 'max', 'sorted'))
+                ):
+            return n.func.id
+        return None
+
+    def convert(self, comp, reason):
+        if reason is not None:
+            self.missed(comp, "can't make a generator, " + reason)
+            return comp
+        self.applied(comp, "list is only iterated once, made a generator")
+        return ast.copy_location(ast.GeneratorExp(elt=comp.elt, generators=comp.generators), comp)
+
+    def visit_Call(self, n):
+        n = self.generic_visit(n)
+        consumer = self.consumer(n)
+        if consumer is not None and isinstance(n.args[0], ast.ListComp):
+            n.args[0] = self.convert(n.args[0], self.rejection(n.args[0], consumer))
+        return n
+
+    def visit_For(self, n):
+        n = self.generic_visit(n)
+        if isinstance(n.iter, ast.ListComp):
+            n.iter = self.convert(n.iter, self.rejection(n.iter, body=n.body))
+        return n
+
+    def rewrite_block(self, stmts):
+        # Lists bound to a name used once, by the next statement
+        if not isinstance(self.scope, ast.FunctionDef):
+            return
+        for stmt, next_stmt in zip(stmts, stmts[1:]):
+            if not (        isinstance(stmt, ast.Assign)
+                            and len(stmt.targets) == 1
+                            and isinstance(stmt.targets[0], ast.Name)
+                            and isinstance(stmt.value, ast.ListComp)
+                        ):
+                continue
+            name = stmt.targets[0].id
+            if self.scope_names[name] != 2 or self.is_declared_global(name):
+                continue
+            reason = self.bound_rejection(stmt.value, name, next_stmt)
+            if reason is not False:
+                stmt.value = self.convert(stmt.value, reason)
+
+    def bound_rejection(self, comp, name, stmt):
+        # False if stmt doesn't consume name at all
+        if isinstance(stmt, ast.For) and isinstance(stmt.iter, ast.Name) and stmt.iter.id == name:
+            return self.rejection(comp, body=stmt.body)
+        if not isinstance(stmt, (ast.Return, ast.Assign, ast.Expr, ast.AugAssign)):
+            return False
+        calls = [
+            v for v in ast.walk(stmt.value)
+            if isinstance(v, ast.Call) and self.consumer(v)
+            and isinstance(v.args[0], ast.Name) and v.args[0].id == name
+        ]
+        if not calls:
+            return False
+        call = calls[0]
+        for v in ast.walk(stmt.value):
+            if isinstance(v, (ast.ListComp, ast.GeneratorExp, ast.SetComp, ast.DictComp, ast.Lambda)):
+                if call in list(ast.walk(v)):
+                    return "it's consumed more than once"
+        # Everything else in the statement may run before the consumer
+        others = [v for v in ast.walk(stmt) if isinstance(v, ast.Call) and v is not call]
+        reason = self.effects(others)
+        if reason is not None:
+            return "the statement consuming it " + reason
+        return self.rejection(comp, self.consumer(call))
@@ -0,0 +1,237 @@
+import __builtin__
+import ast
+
+import constprop
+import visitor
+
+BUILTINS = frozenset(dir(__builtin__))
+
+def top_level_names(stmt):
+    # Names a module or class body statement always binds when it runs
+    if isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+        return [stmt.name]
+    elif isinstance(stmt, (ast.Import, ast.ImportFrom)):
+        return [a.asname or a.name.split('.')[0] for a in stmt.names if a.name != '*']
+    elif isinstance(stmt, ast.Assign):
+        return [v.id for t in stmt.targets for v in ast.walk(t) if isinstance(v, ast.Name)]
+    return []
+
+class ScopeVisitor(visitor.DispatchVisitor):
+    # Collects what a function's own scope binds, and the names it loads,
+    # noting which loads run once per iteration of some loop. Nested
+    # functions, lambdas and classes are scopes of their own, only their
+    # decorators, defaults and bases are evaluated in this one.
+
+    def __init__(self):
+        self.bound = set()
+        self.declared_global = set()
+        # [(Name node, in a loop)]
+        self.loads = []
+        self.depth = 0
+
+    def visit_function(self, n):
+        # Defaults are evaluated in the enclosing scope
+        for a in n.args.args:
+            self.visit(a)
+        self.bound.update(filter(None, [n.args.vararg, n.args.kwarg]))
+        for stmt in n.body:
+            self.visit(stmt)
+
+    def visit_looped(self, nodes):
+        self.depth += 1
+        try:
+            for n in nodes:
+                self.visit(n)
+        finally:
+            self.depth -= 1
+
+    def visit_Name(self, n):
+        if isinstance(n.ctx, ast.Load):
+            self.loads.append((n, self.depth > 0))
+        else:
+            self.bound.add(n.id)
+
+    def visit_alias(self, n):
+        self.bound.add(n.asname or n.name.split('.')[0])
+
+    def visit_Global(self, n):
+        self.declared_global.update(n.names)
+
+    def visit_FunctionDef(self, n):
+        self.bound.add(n.name)
+        for d in n.decorator_list + n.args.defaults:
+            self.visit(d)
+
+    def visit_Lambda(self, n):
+        for d in n.args.defaults:
+            self.visit(d)
+
+    def visit_ClassDef(self, n):
+        self.bound.add(n.name)
+        for d in n.decorator_list + n.bases:
+            self.visit(d)
+
+    def visit_For(self, n):
+        self.visit(n.iter)
+        self.visit_looped([n.target] + n.body)
+        for stmt in n.orelse:
+            self.visit(stmt)
+
+    def visit_While(self, n):
+        self.visit_looped([n.test] + n.body)
+        for stmt in n.orelse:
+            self.visit(stmt)
+
+    def visit_comp(self, n):
+        # Generator expression, set and dict comprehension variables are
+        # local to them, but still shadow the names they use
+        self.visit(n.generators[0].iter)
+        looped = [n.generators[0].target] + n.generators[0].ifs
+        for gen in n.generators[1:]:
+            looped.extend([gen.target, gen.iter] + gen.ifs)
+        if isinstance(n, ast.DictComp):
+            looped.extend([n.key, n.value])
+        else:
+            looped.append(n.elt)
+        self.visit_looped(looped)
+
+    visit_ListComp = visit_GeneratorExp = visit_SetComp = visit_DictComp = visit_comp
+
+class HoistTransformer(visitor.DispatchTransformer):
+    # Makes functions look up the globals and builtins they use more than
+    # once, or inside loops, only once. For Python output they become
+    # parameters defaulting to themselves, `def f(x, str=str)`, looked up
+    # once when the def runs; otherwise (or when the signature can't take
+    # more parameters) they're bound to renamed locals on entry.
+    #
+    # The name must not be rebound anywhere in the module, and globals
+    # must be bound once by a top-level statement before the function's, so
+    # they already have their final value by the time the lookup happens.
+    # Code outside the module replacing them is assumed not to happen. The
+    # JS backends translate builtins by name, so only globals get hoisted
+    # for them.
+
+    pass_name = 'hoist'
+
+    introspection = ('locals', 'vars', 'dir')
+
+    def __init__(self):
+        self.bindings = None
+        self.module_defs = {}
+        self.top_index = None
+        self.class_names = None
+
+    def visit_Module(self, n):
+        if self.bindings is None:
+            self.bindings = constprop.BindingsVisitor()
+            self.bindings.visit(n)
+        if self.bindings.opaque:
+            return n
+        # Name -> index of the top-level statement binding it
+        self.module_defs = {}
+        for i, stmt in enumerate(n.body):
+            for name in top_level_names(stmt):
+                self.module_defs.setdefault(name, i)
+        for i, stmt in enumerate(n.body):
+            self.top_index = i
+            n.body[i] = self.visit(stmt)
+        self.top_index = None
+        return n
+
+    def visit_ClassDef(self, n):
+        saved = self.class_names
+        self.class_names = set([name for stmt in n.body for name in top_level_names(stmt)])
+        try:
+            return self.generic_visit(n)
+        finally:
+            self.class_names = saved
+
+    def visit_FunctionDef(self, n):
+        class_names, self.class_names = self.class_names, None
+        try:
+            n = self.generic_visit(n)
+        finally:
+            self.class_names = class_names
+        if self.top_index is None:
+            return n
+        return self.hoist(n, class_names or ())
+
+    def rejection(self, name):
+        # Why name can't be hoisted out of functions, or None
+        if name in self.bindings.declared_global:
+            return "it's declared global"
+        count = self.bindings.bindings.get(name, 0)
+        if name in self.module_defs:
+            if count != 1:
+                return "it's rebound"
+            elif self.module_defs[name] >= self.top_index:
+                return "it's bound after the function"
+            return None
+        elif name in BUILTINS and name not in constprop.ConstPropTransformer.const_names:
+            if count:
+                return "it's rebound"
+            elif self.backend is not None:
+                return "the backend translates builtins by name"
+            return None
+        return "it's not a global"
+
+    def local_name(self, name, used):
+        local = "_" + name
+        while local in used or self.bindings.bindings.get(local, 0) or local in self.module_defs:
+            local = "_" + local
+        used.add(local)
+        return local
+
+    def hoist(self, n, class_names):
+        scope = ScopeVisitor()
+        scope.visit_function(n)
+        if any([v.id in self.introspection for v, looped in scope.loads]):
+            return n
+        refs = {}
+        for v, looped in scope.loads:
+            if v.id not in scope.bound and v.id not in scope.declared_global and v.id not in class_names:
+                refs.setdefault(v.id, []).append((v, looped))
+        names = []
+        for name in sorted(refs):
+            if len(refs[name]) < 2 and not refs[name][0][1]:
+                continue
+            reason = self.rejection(name)
+            if reason is None:
+                names.append(name)
+            elif reason != "it's not a global":
+                self.missed(n, "can't hoist %s out of %s, " + reason, name, n.name)
+        if not names:
+            return n
+
+        # Defaults are evaluated in the enclosing scope, for methods the
+        # class body, which is why names it binds were left out. With **kw
+        # a keyword named like one would land in the parameter instead.
+        as_defaults = (
+            self.backend is None
+            and not n.args.vararg
+            and not n.args.kwarg
+            and not n.decorator_list
+        )
+        if as_defaults:
+            for name in names:
+                n.args.args.append(ast.copy_location(ast.Name(id=name, ctx=ast.Param()), n))
+                n.args.defaults.append(ast.copy_location(ast.Name(id=name, ctx=ast.Load()), n))
+        else:
+            used = set([v.id for v in ast.walk(n) if isinstance(v, ast.Name)])
+            entry = []
+            for name in names:
+                local = self.local_name(name, used)
+                for v, looped in refs[name]:
+                    v.id = local
+                entry.append(ast.copy_location(ast.Assign(
+                    targets = [ast.Name(id=local, ctx=ast.Store())],
+                    value = ast.Name(id=name, ctx=ast.Load()),
+                ), n.body[0]))
+            docstring = 1 if isinstance(n.body[0], ast.Expr) and isinstance(n.body[0].value, ast.Str) else 0
+            n.body[docstring:docstring] = entry
+
+        made_local = sum([len(refs[name]) for name in names])
+        looped = sum([1 for name in names for v, l in refs[name] if l])
+        self.applied(n, "hoisted %s in %s %s, %d lookups made local (%d in loops)",
+            ", ".join(names), n.name, "as defaults" if as_defaults else "on entry", made_local, looped)
+        return ast.fix_missing_locations(n)
@@ -1,7 +1,9 @@
 import ast
 import copy
 
-class ReplaceContextTransformer(ast.NodeTransformer):
+import visitor
+
+class ReplaceContextTransformer(visitor.DispatchTransformer):
 
     def __init__(self, context):
         self.context = context
@@ -9,21 +11,31 @@ class ReplaceContextTransformer(ast.NodeTransformer):
     def visit_Name(self, n):
         return self.context.get(n.id, n)
 
-class InlineTransformer(ast.NodeTransformer):
+class InlineTransformer(visitor.DispatchTransformer):
+
+    pass_name = 'inline'
 
     def __init__(self):
         self.funcdefs = {}
+        # Why each definition that can't be inlined was rejected
+        self.rejected = {}
 
-    def is_inlineable_expr(self, funcdef, call):
-        if call.starargs or call.kwargs:
-            return False
+    def def_rejection(self, funcdef):
         if len(funcdef.body) != 1 or not isinstance(funcdef.body[0], ast.Return):
-            return False
+            return "its body isn't a single return"
         if funcdef.args.args and not all([ isinstance(a, ast.Name) for a in funcdef.args.args ]):
-            return False
+            return "it unpacks arguments"
+        return None
+
+    def expr_rejection(self, funcdef, call):
+        if call.starargs or call.kwargs:
+            return "the call has * or ** arguments"
+        reason = self.def_rejection(funcdef)
+        if reason is not None:
+            return reason
         if len(funcdef.args.args) != len(call.args):
-            return False
-        return True
+            return "the argument count doesn't match"
+        return None
 
     def get_inline_expr(self, funcdef, call):
         context = {}
@@ -39,24 +51,37 @@ class InlineTransformer(ast.NodeTransformer):
     def visit_FunctionDef(self, n):
         fdef = self.funcdefs.get(n.name, True)
         if fdef is True:
-            # First time
-            self.funcdefs[n.name] = n
+            # First time, only definitions that can be inlined are kept around
+            reason = self.def_rejection(n)
+            self.funcdefs[n.name] = n if reason is None else None
         else:
             # More than one definition not inlineable
             self.funcdefs[n.name] = None
+            reason = "it's defined more than once"
+        if reason is not None:
+            self.rejected[n.name] = reason
         return n
 
     def visit_Call(self, n):
+        return self.inline_call(n)
+
+    def inline_call(self, n):
         if isinstance(n.func, ast.Name) and self.funcdefs.get(n.func.id):
             fdef = self.funcdefs.get(n.func.id)
-            if self.is_inlineable_expr(fdef, n):
-                return self.get_inline_expr(fdef, n)
+        elif isinstance(n.func, ast.Name) and n.func.id in self.rejected:
+            self.missed(n, "can't inline %s, " + self.rejected[n.func.id], n.func.id)
+            return n
         elif isinstance(n.func, ast.Lambda):
             fdef = ast.FunctionDef(
                 name='<lambda>',
                 args=n.func.args,
                 body=[ast.Return(value=n.func.body)]
             )
-            if self.is_inlineable_expr(fdef, n):
-                return self.get_inline_expr(fdef, n)
-        return n
+        else:
+            return n
+        reason = self.expr_rejection(fdef, n)
+        if reason is not None:
+            self.missed(n, "can't inline %s, " + reason, fdef.name)
+            return n
+        self.applied(n, "inlined %s", fdef.name)
+        return self.get_inline_expr(fdef, n)
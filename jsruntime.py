@@ -0,0 +1,144 @@
+# Helpers the JS backends call for Python semantics plain JS operators
+# don't have. Decompilers record the ones they use, and only those (and
+# what they depend on) get emitted ahead of the code.
+#
+# Each handles one kind of operation, so call sites stay monomorphic, and
+# dicts and sets are plain objects, sets mapping their items to true.
+# Dict method helpers can't tell from the call site that the receiver is a
+# dict, so they call the receiver's own method when it has one.
+
+PREFIX = '__py_'
+
+# name : (dependencies, source), in the order they're emitted
+HELPERS = [
+    ('list', ((), """
+function __py_list(x) {
+    if (Array.isArray(x)) return x;
+    if (typeof x === "string") return x.split("");
+    return Object.keys(x);
+}
+""")),
+    ('range', ((), """
+function __py_range(start, stop, step) {
+    if (stop === undefined) { stop = start; start = 0; }
+    if (step === undefined) step = 1;
+    if (step === 0) throw "ValueError";
+    var rv = [], i;
+    if (step > 0) for (i = start; i < stop; i += step) rv.push(i);
+    else for (i = start; i > stop; i += step) rv.push(i);
+    return rv;
+}
+""")),
+    ('len', ((), """
+function __py_len(x) {
+    if (typeof x === "string" || Array.isArray(x)) return x.length;
+    return Object.keys(x).length;
+}
+""")),
+    ('floordiv', ((), """
+function __py_floordiv(a, b) {
+    if (b === 0) throw "ZeroDivisionError";
+    return Math.floor(a / b);
+}
+""")),
+    ('contains', ((), """
+function __py_contains(container, item) {
+    if (typeof container === "string" || Array.isArray(container)) return container.indexOf(item) >= 0;
+    return Object.prototype.hasOwnProperty.call(container, item);
+}
+""")),
+    ('slice_index', ((), """
+function __py_slice_index(i, n, lo, hi) {
+    if (i < 0) { i += n; return i < lo ? lo : i; }
+    return i > hi ? hi : i;
+}
+""")),
+    ('slice', (('slice_index',), """
+function __py_slice(seq, lower, upper, step) {
+    var n = seq.length, rv = [], i;
+    if (step === undefined || step === null) step = 1;
+    if (step === 0) throw "ValueError";
+    if (step > 0) {
+        lower = lower === null ? 0 : __py_slice_index(lower, n, 0, n);
+        upper = upper === null ? n : __py_slice_index(upper, n, 0, n);
+        if (step === 1) return seq.slice(lower, Math.max(lower, upper));
+        for (i = lower; i < upper; i += step) rv.push(seq[i]);
+    } else {
+        lower = lower === null ? n - 1 : __py_slice_index(lower, n, -1, n - 1);
+        upper = upper === null ? -1 : __py_slice_index(upper, n, -1, n - 1);
+        for (i = lower; i > upper; i += step) rv.push(seq[i]);
+    }
+    return typeof seq === "string" ? rv.join("") : rv;
+}
+""")),
+    ('set', (('list',), """
+function __py_set(items) {
+    var rv = {};
+    if (items === undefined) return rv;
+    items = __py_list(items);
+    for (var i = 0; i < items.length; i++) rv[items[i]] = true;
+    return rv;
+}
+""")),
+    ('dict', (('list',), """
+function __py_dict(pairs) {
+    var rv = {};
+    if (pairs === undefined) return rv;
+    if (!Array.isArray(pairs)) {
+        for (var k in pairs) if (Object.prototype.hasOwnProperty.call(pairs, k)) rv[k] = pairs[k];
+        return rv;
+    }
+    for (var i = 0; i < pairs.length; i++) rv[pairs[i][0]] = pairs[i][1];
+    return rv;
+}
+""")),
+    ('keys', ((), """
+function __py_keys(d, method) {
+    if (typeof d[method] === "function") return d[method]();
+    return Object.keys(d);
+}
+""")),
+    ('values', ((), """
+function __py_values(d, method) {
+    if (typeof d[method] === "function") return d[method]();
+    var keys = Object.keys(d), rv = new Array(keys.length);
+    for (var i = 0; i < keys.length; i++) rv[i] = d[keys[i]];
+    return rv;
+}
+""")),
+    ('items', ((), """
+function __py_items(d, method) {
+    if (typeof d[method] === "function") return d[method]();
+    var keys = Object.keys(d), rv = new Array(keys.length);
+    for (var i = 0; i < keys.length; i++) rv[i] = [keys[i], d[keys[i]]];
+    return rv;
+}
+""")),
+    ('get', ((), """
+function __py_get(d, key, dflt) {
+    if (typeof d.get === "function") return d.get.apply(d, Array.prototype.slice.call(arguments, 1));
+    if (Object.prototype.hasOwnProperty.call(d, key)) return d[key];
+    return dflt === undefined ? null : dflt;
+}
+""")),
+]
+
+DEPENDENCIES = dict([(name, deps) for name, (deps, source) in HELPERS])
+
+def call(used, name, args):
+    # Records the helper as used, returns the JS calling it
+    used.add(name)
+    return "%s%s(%s)" % (PREFIX, name, ", ".join(args))
+
+def prelude(used):
+    needed = set()
+    pending = list(used)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(DEPENDENCIES[name])
+    return "".join([
+        source.lstrip("\n") for name, (deps, source) in HELPERS
+        if name in needed
+    ])
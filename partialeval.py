@@ -0,0 +1,548 @@
+import __future__
+import ast
+import copy
+import operator
+
+import constprop
+import visitor
+
+class NotEvaluable(Exception):
+    # Takes a message format and its arguments, kept apart for remarks
+    pass
+
+class _Return(Exception):
+    def __init__(self, value):
+        self.value = value
+
+class _Break(Exception):
+    pass
+
+class _Continue(Exception):
+    pass
+
+def bound_names(stmts):
+    # Every name bound anywhere in the statements, nested scopes included
+    rv = set()
+    for stmt in stmts:
+        for n in ast.walk(stmt):
+            if isinstance(n, ast.Name) and not isinstance(n.ctx, ast.Load):
+                rv.add(n.id)
+            elif isinstance(n, (ast.FunctionDef, ast.ClassDef)):
+                rv.add(n.name)
+    return rv
+
+def count_nodes(stmts):
+    return sum([len(list(ast.walk(stmt))) for stmt in stmts])
+
+class Frame(object):
+
+    def __init__(self, fdef, args):
+        self.env = dict(zip([a.id for a in fdef.args.args], args))
+        self.local_names = bound_names(fdef.body) | set(self.env)
+
+class Interpreter(visitor.DispatchVisitor):
+    # Evaluates calls to module functions on constant arguments. Anything
+    # that could have side effects or depend on runtime state (globals other
+    # than module constants, non-whitelisted calls, attribute access, print,
+    # raise...) raises NotEvaluable, so a call that finishes only went through
+    # pure code. Values created here are private to the evaluation, so local
+    # containers may be mutated.
+
+    builtins = dict(constprop.ConstPropTransformer.builtins, **{
+        'list' : list,
+        'set' : set,
+        'dict' : dict,
+        'enumerate' : enumerate,
+        'zip' : zip,
+        'reversed' : reversed,
+        'all' : all,
+        'any' : any,
+        'divmod' : divmod,
+        'round' : round,
+        'range' : range,
+    })
+
+    list_methods = set([
+        'append', 'count', 'extend', 'index', 'insert', 'pop', 'remove',
+        'reverse',
+    ])
+
+    methods = dict(constprop.ConstPropTransformer.methods, **{
+        list : list_methods,
+        dict : set(['copy', 'get', 'has_key', 'items', 'keys', 'pop', 'setdefault', 'values']),
+        set : set(['add', 'discard', 'difference', 'intersection', 'issubset', 'union']),
+    })
+
+    inplace_binops = {
+        ast.Add : operator.iadd,
+        ast.Sub : operator.isub,
+        ast.Mult : operator.imul,
+        ast.Div : operator.idiv,
+        ast.Mod : operator.imod,
+        ast.Pow : operator.ipow,
+        ast.LShift : operator.ilshift,
+        ast.RShift : operator.irshift,
+        ast.BitOr : operator.ior,
+        ast.BitXor : operator.ixor,
+        ast.BitAnd : operator.iand,
+        ast.FloorDiv : operator.ifloordiv,
+    }
+
+    max_depth = 32
+
+    def __init__(self, transformer, max_steps, max_value_size):
+        self.transformer = transformer
+        self.max_steps = max_steps
+        self.max_value_size = max_value_size
+        self.steps = 0
+        self.depth = 0
+        self.frame = None
+        self.binops = dict(transformer.binops)
+        self.inplace_binops = dict(self.inplace_binops)
+        if transformer.true_division:
+            self.binops[ast.Div] = operator.truediv
+            self.inplace_binops[ast.Div] = operator.itruediv
+
+    def call(self, fdef, args):
+        if len(args) != len(fdef.args.args) or self.depth >= self.max_depth:
+            raise NotEvaluable("can't call %s", fdef.name)
+        frame, self.frame = self.frame, Frame(fdef, args)
+        self.depth += 1
+        try:
+            self.exec_block(fdef.body)
+        except _Return as r:
+            return r.value
+        except (NotEvaluable, _Break, _Continue):
+            raise
+        except Exception as e:
+            # The call raises for these arguments, leave it to the runtime
+            raise NotEvaluable("%s raised %s", fdef.name, type(e).__name__)
+        finally:
+            self.frame = frame
+            self.depth -= 1
+        return None
+
+    def visit(self, n):
+        self.steps += 1
+        if self.steps > self.max_steps:
+            raise NotEvaluable("step budget exhausted")
+        return visitor.DispatchVisitor.visit(self, n)
+
+    def generic_visit(self, n):
+        raise NotEvaluable("can't evaluate %s", type(n).__name__)
+
+    def checked(self, val):
+        if constprop.value_size(val) > self.max_value_size:
+            raise NotEvaluable("memory budget exhausted")
+        return val
+
+    def binop(self, ops, op, l, r):
+        if not self.transformer.is_cheap_binop(op, l, r, self.max_value_size):
+            raise NotEvaluable("memory budget exhausted")
+        return self.checked(ops[type(op)](l, r))
+
+    def exec_block(self, stmts):
+        for stmt in stmts:
+            self.visit(stmt)
+
+    def assign(self, target, val):
+        if isinstance(target, ast.Name):
+            self.frame.env[target.id] = val
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            vals = list(val)
+            if len(vals) != len(target.elts):
+                raise NotEvaluable("unpacking mismatch")
+            for t, v in zip(target.elts, vals):
+                self.assign(t, v)
+        elif isinstance(target, ast.Subscript) and isinstance(target.slice, ast.Index):
+            container = self.visit(target.value)
+            if not isinstance(container, (list, dict)):
+                raise NotEvaluable("can't assign items of %s", type(container).__name__)
+            container[self.visit(target.slice.value)] = val
+        else:
+            raise NotEvaluable("can't assign to %s", type(target).__name__)
+
+    # Statements
+
+    def visit_Assign(self, n):
+        val = self.visit(n.value)
+        for target in n.targets:
+            self.assign(target, val)
+
+    def visit_AugAssign(self, n):
+        val = self.visit(n.value)
+        if isinstance(n.target, ast.Name):
+            cur = self.visit_Name(ast.Name(id=n.target.id, ctx=ast.Load()))
+        elif isinstance(n.target, ast.Subscript):
+            cur = self.visit(ast.Subscript(value=n.target.value, slice=n.target.slice, ctx=ast.Load()))
+        else:
+            raise NotEvaluable("can't assign to %s", type(n.target).__name__)
+        self.assign(n.target, self.binop(self.inplace_binops, n.op, cur, val))
+
+    def visit_Expr(self, n):
+        if not isinstance(n.value, ast.Str):
+            self.visit(n.value)
+
+    def visit_Pass(self, n):
+        pass
+
+    def visit_Return(self, n):
+        raise _Return(self.visit(n.value) if n.value is not None else None)
+
+    def visit_Break(self, n):
+        raise _Break()
+
+    def visit_Continue(self, n):
+        raise _Continue()
+
+    def visit_If(self, n):
+        if self.visit(n.test):
+            self.exec_block(n.body)
+        else:
+            self.exec_block(n.orelse)
+
+    def loop_body(self, body):
+        # Returns False when the loop was broken out of
+        try:
+            self.exec_block(body)
+        except _Continue:
+            pass
+        except _Break:
+            return False
+        return True
+
+    def visit_While(self, n):
+        while self.visit(n.test):
+            if not self.loop_body(n.body):
+                return
+        self.exec_block(n.orelse)
+
+    def visit_For(self, n):
+        for item in self.visit(n.iter):
+            self.assign(n.target, item)
+            if not self.loop_body(n.body):
+                return
+        self.exec_block(n.orelse)
+
+    # Expressions
+
+    def visit_Num(self, n):
+        return n.n
+
+    def visit_Str(self, n):
+        return n.s
+
+    def visit_Name(self, n):
+        if n.id in self.frame.local_names:
+            if n.id not in self.frame.env:
+                raise NotEvaluable("%s referenced before assignment", n.id)
+            return self.frame.env[n.id]
+        t = self.transformer
+        if n.id in t.const_names:
+            return t.const_names[n.id]
+        elif n.id in t.constants:
+            # Module constants are shared, evaluation works on copies
+            return copy.deepcopy(t.constants[n.id])
+        raise NotEvaluable("global %s isn't constant", n.id)
+
+    def visit_Tuple(self, n):
+        return tuple(map(self.visit, n.elts))
+
+    def visit_List(self, n):
+        return map(self.visit, n.elts)
+
+    def visit_Set(self, n):
+        return set(map(self.visit, n.elts))
+
+    def visit_Dict(self, n):
+        return dict(zip(map(self.visit, n.keys), map(self.visit, n.values)))
+
+    def visit_BinOp(self, n):
+        return self.binop(self.binops, n.op, self.visit(n.left), self.visit(n.right))
+
+    def visit_UnaryOp(self, n):
+        return self.transformer.unops[type(n.op)](self.visit(n.operand))
+
+    def visit_Compare(self, n):
+        prev = self.visit(n.left)
+        for op, v in zip(n.ops, n.comparators):
+            cur = self.visit(v)
+            if not self.transformer.cmpops[type(op)](prev, cur):
+                return False
+            prev = cur
+        return True
+
+    def visit_BoolOp(self, n):
+        for v in n.values:
+            rv = self.visit(v)
+            if isinstance(n.op, ast.And) != bool(rv):
+                break
+        return rv
+
+    def visit_IfExp(self, n):
+        return self.visit(n.body) if self.visit(n.test) else self.visit(n.orelse)
+
+    def visit_Subscript(self, n):
+        val = self.visit(n.value)
+        if isinstance(n.slice, ast.Index):
+            return val[self.visit(n.slice.value)]
+        elif isinstance(n.slice, ast.Slice):
+            bounds = [n.slice.lower, n.slice.upper, n.slice.step]
+            return val[slice(*[b if b is None else self.visit(b) for b in bounds])]
+        raise NotEvaluable("can't evaluate %s", type(n.slice).__name__)
+
+    def comprehension(self, generators, add):
+        if not generators:
+            add()
+            return
+        gen = generators[0]
+        for item in self.visit(gen.iter):
+            self.assign(gen.target, item)
+            if all([self.visit(c) for c in gen.ifs]):
+                self.comprehension(generators[1:], add)
+
+    def visit_ListComp(self, n):
+        rv = []
+        self.comprehension(n.generators, lambda : rv.append(self.checked(self.visit(n.elt))))
+        return self.checked(rv)
+
+    def visit_GeneratorExp(self, n):
+        # Evaluated eagerly, which pure code can't tell apart, but its
+        # targets don't leak into the function's scope
+        env = dict(self.frame.env)
+        try:
+            return iter(self.visit_ListComp(n))
+        finally:
+            self.frame.env = env
+
+    def visit_Call(self, n):
+        if n.starargs or n.kwargs:
+            raise NotEvaluable("can't evaluate * or ** arguments")
+        args = map(self.visit, n.args)
+        kwargs = dict([(kw.arg, self.visit(kw.value)) for kw in n.keywords])
+        t = self.transformer
+
+        if isinstance(n.func, ast.Name) and n.func.id not in self.frame.local_names:
+            name = n.func.id
+            fdef = t.funcdefs.get(name)
+            if fdef is not None:
+                if kwargs:
+                    raise NotEvaluable("can't evaluate keyword arguments")
+                return self.call(fdef, args)
+            f = self.builtins.get(name)
+            if f is None or t.is_bound(name):
+                raise NotEvaluable("%s isn't known to be pure", name)
+            if name == 'range' and len(xrange(*args)) > self.max_value_size:
+                raise NotEvaluable("memory budget exhausted")
+        elif isinstance(n.func, ast.Attribute):
+            name = n.func.attr
+            obj = self.visit(n.func.value)
+            if name not in self.methods.get(type(obj), ()):
+                raise NotEvaluable("%s.%s isn't known to be pure", type(obj).__name__, name)
+            f = getattr(obj, name)
+        else:
+            raise NotEvaluable("can't evaluate calls to %s", type(n.func).__name__)
+
+        if not t.is_cheap_call(name, args, self.max_value_size):
+            raise NotEvaluable("memory budget exhausted")
+        return self.checked(f(*args, **kwargs))
+
+class SubstituteTransformer(visitor.DispatchTransformer):
+
+    def __init__(self, transformer, values):
+        self.transformer = transformer
+        self.values = values
+
+    def visit_Name(self, n):
+        if isinstance(n.ctx, ast.Load) and n.id in self.values:
+            return self.transformer.make_const(self.values[n.id], n)
+        return n
+
+class PartialEvalTransformer(constprop.ConstPropTransformer):
+    # Replaces calls to module functions on constant arguments with their
+    # result, evaluated under a step and memory budget. Calls where only
+    # some arguments are constant get a clone of the function specialized
+    # for them, when folding the constants in shrinks it.
+
+    pass_name = 'partialeval'
+
+    max_steps = 100000
+    max_value_size = 1 << 16
+    max_specializations = 4
+    min_specialization_gain = 3
+
+    def __init__(self, bindings = None):
+        constprop.ConstPropTransformer.__init__(self, bindings)
+        self.funcdefs = {}
+        self.true_division = False
+        # How many defs, classes or compound statements deep the visit is,
+        # only unconditional module level defs can be evaluated
+        self.nesting = 0
+        # Specialized clones need a module to be added to
+        self.in_module = False
+        self.specializations = {}
+        self.clones = {}
+        # Name of the function a clone is being built for
+        self.specializing = None
+
+    def is_evaluable_def(self, n):
+        return (
+            not n.decorator_list
+            and not (n.args.vararg or n.args.kwarg or n.args.defaults)
+            and all([isinstance(a, ast.Name) for a in n.args.args])
+            and self.bindings is not None
+            and self.bindings.bindings.get(n.name, 0) == 1
+        )
+
+    def visit_Module(self, n):
+        for stmt in n.body:
+            if isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__':
+                if 'division' in [alias.name for alias in stmt.names]:
+                    self.true_division = True
+        self.in_module = True
+        try:
+            n = constprop.ConstPropTransformer.visit_Module(self, n)
+        finally:
+            self.in_module = False
+
+        body = []
+        for stmt in n.body:
+            body.append(stmt)
+            if isinstance(stmt, ast.FunctionDef):
+                body.extend(self.clones.pop(stmt.name, ()))
+        n.body = body
+        return n
+
+    def visit_nested(self, n):
+        self.nesting += 1
+        try:
+            return self.generic_visit(n)
+        finally:
+            self.nesting -= 1
+
+    visit_ClassDef = visit_If = visit_For = visit_While = visit_With = visit_nested
+    visit_TryExcept = visit_TryFinally = visit_nested
+
+    def visit_FunctionDef(self, n):
+        module_level = self.nesting == 0
+        n = self.visit_nested(n)
+        # Only registered once visited, so calls that run before the
+        # definition (or inside it) are left alone
+        if module_level and self.is_evaluable_def(n):
+            self.funcdefs[n.name] = n
+        return n
+
+    def visit_Call(self, n):
+        n = constprop.ConstPropTransformer.visit_Call(self, n)
+        if not (isinstance(n, ast.Call) and isinstance(n.func, ast.Name)):
+            return n
+        fdef = self.funcdefs.get(n.func.id)
+        if (        fdef is None
+                    or n.keywords or n.starargs or n.kwargs
+                    or len(n.args) != len(fdef.args.args)
+                ):
+            return n
+
+        const = map(self.is_const, n.args)
+        if all(const):
+            return self.evaluate(n, fdef)
+        elif any(const) and self.in_module:
+            return self.specialize(n, fdef, const)
+        return n
+
+    def evaluate(self, n, fdef):
+        interp = Interpreter(self, self.max_steps, self.max_value_size)
+        try:
+            val = interp.call(fdef, map(self.get_value, n.args))
+        except NotEvaluable as e:
+            self.missed(n, "can't evaluate %s(), " + e.args[0], fdef.name, *e.args[1:])
+            return n
+        return self.fold(n, self.size_limit(fdef.name), lambda : val)
+
+    def specialize(self, n, fdef, const):
+        params = [a.id for a in fdef.args.args]
+        bound = dict([
+            (p, self.get_value(a))
+            for p, a, c in zip(params, n.args, const)
+            if c
+        ])
+        key = (fdef.name, tuple(sorted([(p, repr(v)) for p, v in bound.iteritems()])))
+        if key not in self.specializations:
+            if self.specializing is not None:
+                # Calls in the clone being built are left alone, or recursive
+                # functions would get a clone per constant they recurse on
+                self.missed(n, "not specializing %s inside a specialization of %s", fdef.name, self.specializing)
+                return n
+            clones = self.clones.setdefault(fdef.name, [])
+            if len(clones) >= self.max_specializations:
+                self.missed(n, "%s already has %d specializations", fdef.name, len(clones))
+                return n
+            self.specializations[key] = None
+            self.specializing = fdef.name
+            try:
+                clone = self.make_specialization(fdef, bound)
+            finally:
+                self.specializing = None
+            self.specializations[key] = clone and clone.name
+            if clone is not None:
+                clones.append(clone)
+                self.applied(n, "specialized %s as %s", fdef.name, clone.name)
+            else:
+                self.missed(n, "specializing %s doesn't simplify it", fdef.name)
+
+        name = self.specializations[key]
+        if not name:
+            return n
+        return ast.copy_location(ast.Call(
+            func = ast.copy_location(ast.Name(id=name, ctx=ast.Load()), n.func),
+            args = [a for a, c in zip(n.args, const) if not c],
+            keywords = [],
+            starargs = None,
+            kwargs = None,
+        ), n)
+
+    def clone_name(self, name):
+        i = 1
+        while True:
+            rv = "%s__%d" % (name, i)
+            if not self.is_bound(rv) and rv not in self.funcdefs and rv not in self.specializations.values():
+                return rv
+            i += 1
+
+    def make_specialization(self, fdef, bound):
+        clone = copy.deepcopy(fdef)
+        clone.name = self.clone_name(fdef.name)
+        clone.args.args = [a for a in clone.args.args if a.id not in bound]
+
+        # Parameters never rebound are substituted, the rest are assigned
+        # on entry, which is what passing them would've done
+        rebound = bound_names(clone.body)
+        substitute = dict([
+            (p, v) for p, v in bound.iteritems()
+            if p not in rebound and constprop.is_immutable(v)
+        ])
+        prologue = [
+            ast.copy_location(ast.Assign(
+                targets = [ast.Name(id=p, ctx=ast.Store())],
+                value = self.make_const(v, fdef),
+            ), fdef)
+            for p, v in sorted(bound.iteritems())
+            if p not in substitute
+        ]
+        body = [SubstituteTransformer(self, substitute).visit(stmt) for stmt in clone.body]
+        if prologue and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Str):
+            # Keep the docstring first
+            body = body[:1] + prologue + body[1:]
+        else:
+            body = prologue + body
+        clone.body = body
+
+        before = count_nodes(clone.body)
+        self.nesting += 1
+        try:
+            clone.body = [self.visit(stmt) for stmt in clone.body]
+        finally:
+            self.nesting -= 1
+        if before - count_nodes(clone.body) < self.min_specialization_gain:
+            return None
+        return clone
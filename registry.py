@@ -0,0 +1,187 @@
+import ast
+import importlib
+
+# Op kinds
+PASS = 'pass'
+BACKEND = 'backend'
+OUTPUT = 'output'
+# Handled by the driver itself rather than the pipeline
+MODE = 'mode'
+
+# Plugins register their ops from a function exposed under this entry point
+# group, called with the registry, eg:
+#
+#   entry_points = { 'ast_fondling.ops' : ['ours = ourpkg.ops:register'] }
+#
+#   def register(registry):
+#       registry.register('ourpass', registry.PASS, 'ourpkg.ourpass:OurTransformer',
+#           invalidates=('constprop',), accepts=('Call',))
+ENTRY_POINTS = 'ast_fondling.ops'
+
+class UnknownOpError(ValueError):
+    pass
+
+class Op(object):
+    # target is "module:attribute" for passes (the transformer class) and
+    # outputs (the writer function), or "module" for backends, and is only
+    # imported when the op gets used.
+    #
+    # requires: ops that must come earlier in the op list
+    # invalidates: ops that may find new work after this one runs
+    # accepts: names of the node types the pass rewrites, so it can be
+    #   skipped on trees that have none, or None if it looks at everything
+    # streamable: whether the pass works on one top-level statement at a
+    #   time, given the module's bindings up front
+
+    def __init__(self, name, kind, target = None, requires = (), invalidates = (), accepts = None, streamable = True, description = ''):
+        self.name = name
+        self.kind = kind
+        self.target = target
+        self.requires = tuple(requires)
+        self.invalidates = tuple(invalidates)
+        self.accepts = tuple(accepts) if accepts is not None else None
+        self.streamable = streamable
+        self.description = description
+        self.loaded = None
+
+    def load(self):
+        if self.loaded is None:
+            module, _, attr = self.target.partition(':')
+            rv = importlib.import_module(module)
+            if attr:
+                rv = getattr(rv, attr)
+            self.loaded = rv
+        return self.loaded
+
+    def create(self):
+        return self.load()()
+
+    def applies_to(self, present):
+        # present is the set of node type names in the tree
+        return self.accepts is None or not present.isdisjoint(self.accepts)
+
+    def __repr__(self):
+        return "<%s op %s>" % (self.kind, self.name)
+
+def node_types(root):
+    return set([type(n).__name__ for n in ast.walk(root)])
+
+class Registry(object):
+
+    PASS = PASS
+    BACKEND = BACKEND
+    OUTPUT = OUTPUT
+    MODE = MODE
+
+    def __init__(self, group = ENTRY_POINTS):
+        self.group = group
+        self.ops = {}
+        self.plugins_loaded = group is None
+
+    def register(self, name, kind, target = None, **kw):
+        op = self.ops[name] = Op(name, kind, target, **kw)
+        return op
+
+    def load_plugins(self):
+        # Only done when an op isn't built in, or for listings, since
+        # scanning installed distributions is slow
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for ep in pkg_resources.iter_entry_points(self.group):
+            ep.load()(self)
+
+    def get(self, name):
+        op = self.ops.get(name)
+        if op is None:
+            self.load_plugins()
+            op = self.ops.get(name)
+            if op is None:
+                raise UnknownOpError("unknown op %r, known ops are: %s" % (name, ", ".join(self.names())))
+        return op
+
+    def names(self, kind = None):
+        self.load_plugins()
+        return sorted([name for name, op in self.ops.iteritems() if kind is None or op.kind == kind])
+
+    def resolve(self, names):
+        # The ops for an op list, checking they exist and their requirements
+        rv = [self.get(name) for name in names]
+        seen = set()
+        for op in rv:
+            missing = [r for r in op.requires if r not in seen]
+            if missing:
+                raise UnknownOpError("%s needs %s earlier in the op list" % (op.name, ", ".join(missing)))
+            seen.add(op.name)
+        return rv
+
+    def schedulable(self, op, done):
+        # Whether running op after the ops in done could do anything: its
+        # requirements ran, and it hasn't run since the last op that can
+        # give it new work
+        if any([r not in done for r in op.requires]):
+            return False
+        for prev in reversed(done):
+            if prev == op.name:
+                return False
+            elif op.name in self.get(prev).invalidates:
+                return True
+        return True
+
+registry = Registry()
+
+registry.register('constprop', PASS, 'constprop:ConstPropTransformer',
+    invalidates = ('inline', 'partialeval', 'strconcat', 'vectorize', 'unroll'),
+    description = "Propagate and fold constants")
+registry.register('inline', PASS, 'inlining:InlineTransformer',
+    # Inlined bodies can have calls that are inlineable in turn
+    invalidates = ('constprop', 'inline', 'partialeval', 'strconcat', 'vectorize'),
+    accepts = ('Call',),
+    description = "Inline single-expression functions")
+registry.register('fused', PASS, 'fused:FusedTransformer',
+    invalidates = ('partialeval', 'strconcat', 'vectorize'),
+    description = "constprop and inline to a fixed point in one walk")
+registry.register('strconcat', PASS, 'strconcat:StringConcatTransformer',
+    invalidates = ('constprop',),
+    accepts = ('BinOp',),
+    description = "Turn chains of string concatenations into joins and formats")
+registry.register('partialeval', PASS, 'partialeval:PartialEvalTransformer',
+    invalidates = ('constprop', 'inline', 'strconcat', 'vectorize'),
+    description = "Evaluate and specialize pure functions on constant arguments")
+registry.register('vectorize', PASS, 'vectorize:VectorizeTransformer',
+    accepts = ('ListComp', 'GeneratorExp'),
+    # Adds its prelude at the top of the module
+    streamable = False,
+    description = "Run element-wise comprehensions as numpy array expressions")
+registry.register('tailcall', PASS, 'tailcall:TailCallTransformer',
+    accepts = ('Return',),
+    description = "Turn self tail calls into loops")
+registry.register('genexp', PASS, 'generators:GeneratorTransformer',
+    accepts = ('ListComp',),
+    description = "Turn lists only iterated once into generators")
+registry.register('hoist', PASS, 'hoist:HoistTransformer',
+    accepts = ('FunctionDef',),
+    # Needs to know which top-level statement binds each global
+    streamable = False,
+    description = "Look up globals and builtins functions use repeatedly once per call")
+registry.register('unroll', PASS, 'unroll:UnrollTransformer',
+    # Copies of the body get folded again, but may enable more elsewhere
+    invalidates = ('constprop', 'inline', 'partialeval', 'strconcat', 'vectorize'),
+    accepts = ('For',),
+    description = "Unroll loops with a few constant iterations")
+
+registry.register('js', BACKEND, 'decompile_js', description = "Emit JavaScript")
+registry.register('js2', BACKEND, 'decompile_js_v2', description = "Emit JavaScript, second version")
+registry.register('pymin', BACKEND, 'decompile_minimal', description = "Emit Python with only the parentheses it needs")
+
+registry.register('pyc', OUTPUT, 'compile_pyc:write_pyc', description = "Write a .pyc next to the source")
+registry.register('pyzip', OUTPUT, 'compile_pyc:write_zip', description = "Write a .zip next to the source")
+
+registry.register('stream', MODE, description = "Rewrite one top-level statement at a time")
+registry.register('remarks', MODE, description = "Print a summary of optimization remarks")
+registry.register('remarks-json', MODE, description = "Print all optimization remarks as JSON")
+registry.register('auto', MODE, description = "Use the op sequence recorded by autotune.py")
@@ -0,0 +1,58 @@
+from __future__ import print_function
+
+import collections
+import json
+import re
+import sys
+
+class Remark(object):
+    __slots__ = ('pass_name', 'kind', 'reason', 'message', 'filename', 'lineno', 'col_offset')
+
+    def __init__(self, pass_name, kind, reason, message, filename, lineno, col_offset):
+        self.pass_name = pass_name
+        self.kind = kind
+        # The message before filling in the specifics, to group by
+        self.reason = reason
+        self.message = message
+        self.filename = filename
+        self.lineno = lineno
+        self.col_offset = col_offset
+
+    def as_dict(self):
+        return dict([(k, getattr(self, k)) for k in self.__slots__])
+
+    def __str__(self):
+        return "%s:%s:%s: %s %s: %s" % (
+            self.filename, self.lineno, self.col_offset,
+            self.pass_name, self.kind, self.message)
+
+class RemarkCollector(object):
+    # Gathers the remarks passes emit through DispatchTransformer.remark
+
+    def __init__(self, filename = None):
+        self.filename = filename
+        self.remarks = []
+
+    def add(self, pass_name, kind, node, reason, message):
+        self.remarks.append(Remark(pass_name, kind, reason, message, self.filename,
+            getattr(node, 'lineno', None), getattr(node, 'col_offset', None)))
+
+    def as_json(self, **kw):
+        return json.dumps([r.as_dict() for r in self.remarks], **kw)
+
+    def summary(self):
+        # {pass: {kind: count}} and {pass: {(kind, reason): count}}
+        counts = collections.defaultdict(collections.Counter)
+        reasons = collections.defaultdict(collections.Counter)
+        for r in self.remarks:
+            counts[r.pass_name][r.kind] += 1
+            reasons[r.pass_name][(r.kind, r.reason)] += 1
+        return counts, reasons
+
+    def print_summary(self, out = sys.stderr, top = 5):
+        counts, reasons = self.summary()
+        for pass_name in sorted(counts):
+            print("%s: %d applied, %d missed" % (pass_name,
+                counts[pass_name]['applied'], counts[pass_name]['missed']), file=out)
+            for (kind, reason), count in reasons[pass_name].most_common(top):
+                print("  %5d %-7s %s" % (count, kind, re.sub('%[a-z]', '...', reason)), file=out)
@@ -2,22 +2,94 @@ from __future__ import print_function
 
 import ast
 import sys
-import decompile
+import decompile as default_decompile
+import registry
 
-with open(sys.argv[1], "r") as f:
-    root = ast.parse(f.read(), sys.argv[1])
+def pipeline(ops):
+    passes = []
+    decompile = default_decompile
+    backend = None
+    output = None
 
-for op in sys.argv[2:]:
-    if op == 'constprop':
-        import constprop
-        root = constprop.ConstPropTransformer().visit(root)
-    elif op == 'js':
-        import decompile_js as decompile
-    elif op == 'js2':
-        import decompile_js_v2 as decompile
-    elif op == 'inline':
-        import inlining
-        root = inlining.InlineTransformer().visit(root)
+    for op in registry.registry.resolve(ops):
+        if op.kind == registry.PASS:
+            passes.append(op.create())
+        elif op.kind == registry.BACKEND:
+            decompile = op.load()
+            backend = op.name
+        elif op.kind == registry.OUTPUT:
+            output = op.load()
 
-print(decompile.decompile(root))
+    for p in passes:
+        p.backend = backend
+    return passes, decompile, output
 
+def transform(root, ops, remarks = None):
+    passes, decompile, output = pipeline(ops)
+    pass_ops = [op for op in registry.registry.resolve(ops) if op.kind == registry.PASS]
+    present = None
+    for op, p in zip(pass_ops, passes):
+        # Passes with nothing to rewrite in the tree don't need to walk it
+        if present is None:
+            present = registry.node_types(root)
+        if not op.applies_to(present):
+            continue
+        p.remarks = remarks
+        root = p.visit(root)
+        present = None
+    return root, decompile, output
+
+def report_remarks(remarks, ops):
+    if 'remarks-json' in ops:
+        sys.stderr.write(remarks.as_json(indent=1) + "\n")
+    if 'remarks' in ops:
+        remarks.print_summary(sys.stderr)
+
+def main(argv):
+    ops = argv[2:]
+    try:
+        registry.registry.resolve(ops)
+    except registry.UnknownOpError as e:
+        sys.exit(str(e))
+    if 'auto' in ops:
+        import autotune
+        ops = autotune.expand_auto(argv[1], ops)
+    remarks = None
+    if 'remarks' in ops or 'remarks-json' in ops:
+        import remarks as remarks_module
+        remarks = remarks_module.RemarkCollector(argv[1])
+
+    if 'stream' in ops:
+        import stream
+        whole = sorted(set([
+            op.name for op in registry.registry.resolve(ops)
+            if op.kind == registry.PASS and not op.streamable
+        ]))
+        if whole:
+            sys.exit("stream can't be combined with %s, they need the whole module" % ", ".join(whole))
+        passes, decompile, output = pipeline([op for op in ops if op != 'stream'])
+        if output is not None:
+            sys.exit("stream can't be combined with bytecode output")
+        for p in passes:
+            p.remarks = remarks
+        with open(argv[1], "r") as f:
+            stream.rewrite_stream(f, argv[1], passes, decompile, sys.stdout)
+        print()
+        if remarks is not None:
+            report_remarks(remarks, ops)
+        return
+
+    with open(argv[1], "r") as f:
+        root = ast.parse(f.read(), argv[1])
+
+    root, decompile, output = transform(root, ops, remarks)
+    if remarks is not None:
+        report_remarks(remarks, ops)
+
+    if output is not None:
+        print(output(root, argv[1]))
+    else:
+        print(decompile.decompile(root))
+
+if __name__ == '__main__':
+    main(sys.argv)
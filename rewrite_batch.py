@@ -0,0 +1,158 @@
+from __future__ import print_function
+
+import argparse
+import ast
+import errno
+import os
+import os.path
+import Queue
+import sys
+import threading
+import multiprocessing
+
+import registry
+import rewrite
+
+def rewrite_one(filename, source, mtime, ops):
+    if 'auto' in ops:
+        # Workers don't write the manifest, they'd race each other
+        import autotune
+        ops = autotune.expand_auto(filename, ops, source, save=False)
+    root, decompile, output = rewrite.transform(ast.parse(source, filename), ops)
+    if output is not None:
+        import compile_pyc
+        code = compile_pyc.compile_module(root, filename)
+        if output is compile_pyc.write_zip:
+            return compile_pyc.zip_bytes(code, filename, mtime), '.zip'
+        return compile_pyc.pyc_bytes(code, mtime), '.pyc'
+    else:
+        return decompile.decompile(root), decompile.extension
+
+def _rewrite_job(job):
+    # Runs in a pool worker, so exceptions are turned into values to be
+    # reported by the writer rather than killing the whole run
+    filename = job[0]
+    try:
+        return filename, rewrite_one(*job), None
+    except Exception as e:
+        return filename, None, "%s: %s" % (type(e).__name__, e)
+
+class BatchRewriter(object):
+
+    def __init__(self, ops, outdir, basedir = '.', jobs = None, io_threads = 4, max_in_flight = 16):
+        self.ops = ops
+        self.outdir = outdir
+        self.basedir = basedir
+        self.jobs = jobs
+        self.io_threads = io_threads
+        # Every file holds one slot from the moment it starts being read until
+        # its output is on disk, which bounds the memory used by the pipeline
+        # regardless of how many files are queued
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.errors = []
+
+    def output_path(self, filename, ext):
+        rel = os.path.relpath(filename, self.basedir)
+        if rel.startswith(os.pardir):
+            rel = os.path.basename(filename)
+        return os.path.join(self.outdir, os.path.splitext(rel)[0] + ext)
+
+    def reader(self, names, pool, write_q):
+        def done(result):
+            write_q.put(result)
+        while True:
+            try:
+                filename = names.get_nowait()
+            except Queue.Empty:
+                return
+            self.in_flight.acquire()
+            try:
+                with open(filename, "r") as f:
+                    source = f.read()
+                    mtime = os.fstat(f.fileno()).st_mtime
+            except (IOError, OSError) as e:
+                write_q.put((filename, None, str(e)))
+                continue
+            pool.apply_async(_rewrite_job, ((filename, source, mtime, self.ops),), callback=done)
+
+    def writer(self, write_q):
+        while True:
+            item = write_q.get()
+            if item is None:
+                return
+            filename, result, error = item
+            try:
+                if error is None:
+                    data, ext = result
+                    path = self.output_path(filename, ext)
+                    try:
+                        os.makedirs(os.path.dirname(path))
+                    except OSError as e:
+                        if e.errno != errno.EEXIST:
+                            raise
+                    with open(path, "wb") as f:
+                        f.write(data)
+            except (IOError, OSError) as e:
+                error = str(e)
+            finally:
+                self.in_flight.release()
+            if error is not None:
+                self.errors.append((filename, error))
+                print("%s: %s" % (filename, error), file=sys.stderr)
+
+    def run(self, filenames):
+        names = Queue.Queue()
+        for filename in filenames:
+            names.put(filename)
+
+        write_q = Queue.Queue()
+        pool = multiprocessing.Pool(self.jobs)
+        readers = [
+            threading.Thread(target=self.reader, args=(names, pool, write_q))
+            for _ in xrange(self.io_threads)
+        ]
+        writers = [
+            threading.Thread(target=self.writer, args=(write_q,))
+            for _ in xrange(self.io_threads)
+        ]
+        for t in readers + writers:
+            t.daemon = True
+            t.start()
+
+        for t in readers:
+            t.join()
+        pool.close()
+        pool.join()
+        for t in writers:
+            write_q.put(None)
+        for t in writers:
+            t.join()
+
+        return not self.errors
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Rewrite many files concurrently")
+    parser.add_argument('-o', '--outdir', required=True)
+    parser.add_argument('-b', '--basedir', default='.',
+        help="Output paths mirror the input paths relative to this directory")
+    parser.add_argument('--ops', default='', help="Space-separated rewrite.py op list")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help="Transform processes (default: one per CPU)")
+    parser.add_argument('--io-threads', type=int, default=4)
+    parser.add_argument('--max-in-flight', type=int, default=16)
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv[1:])
+    try:
+        registry.registry.resolve(args.ops.split())
+    except registry.UnknownOpError as e:
+        sys.exit(str(e))
+
+    batch = BatchRewriter(args.ops.split(), args.outdir, args.basedir,
+        jobs = args.jobs,
+        io_threads = args.io_threads,
+        max_in_flight = args.max_in_flight,
+    )
+    return 0 if batch.run(args.files) else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
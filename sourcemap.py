@@ -3,10 +3,12 @@ from __future__ import print_function
 import ast
 import sys
 
+import visitor
+
 with open(sys.argv[1], "r") as f:
     root = ast.parse(f.read(), sys.argv[1])
 
-class mapping_visitor(ast.NodeVisitor):
+class mapping_visitor(visitor.DispatchVisitor):
     def __init__(self):
         self.funcs = {}
         self.classes = {}
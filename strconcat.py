@@ -0,0 +1,156 @@
+import ast
+
+import constprop
+import visitor
+
+class StringConcatTransformer(visitor.DispatchTransformer):
+    # Rewrites chains like str(a // 10) + "-" + str(1) + "-" + c, where every
+    # `+` allocates an intermediate string, into a single % format per run
+    # of constants and str() calls (here '%s-%s-' % (a // 10, 1) + c), and
+    # into a single "".join once there are enough pieces for that to be
+    # cheaper.
+    #
+    # '%s' % (u,) is unicode where str(u) is a str (or raises), and keeping
+    # the str() calls makes the format slower than the chain, so runs are
+    # only formatted when every str() call has an operand that can't be
+    # unicode.
+
+    pass_name = 'strconcat'
+
+    # Below this "".join is slower than chained `+` on CPython 2.7
+    min_join_parts = 12
+
+    def __init__(self):
+        self.bindings = None
+
+    def visit_Module(self, n):
+        if self.bindings is None:
+            self.bindings = constprop.BindingsVisitor()
+            self.bindings.visit(n)
+        return self.generic_visit(n)
+
+    def is_bound(self, name):
+        # Star imports and exec may bind anything
+        return self.bindings is not None and (self.bindings.opaque or self.bindings.bindings.get(name, 0) > 0)
+
+    def is_str_call(self, n):
+        return (
+            isinstance(n, ast.Call)
+            and isinstance(n.func, ast.Name)
+            and n.func.id == 'str'
+            and len(n.args) == 1
+            and not (n.keywords or n.starargs or n.kwargs)
+            and not self.is_bound('str')
+        )
+
+    def is_string(self, n):
+        if isinstance(n, ast.Str) or self.is_str_call(n):
+            return True
+        elif isinstance(n, ast.BinOp):
+            if isinstance(n.op, ast.Mod):
+                return isinstance(n.left, ast.Str)
+            elif isinstance(n.op, ast.Add):
+                return self.is_string(n.left)
+        elif isinstance(n, ast.Call):
+            return (
+                isinstance(n.func, ast.Attribute)
+                and n.func.attr == 'join'
+                and isinstance(n.func.value, ast.Str)
+            )
+        return False
+
+    def flatten(self, n):
+        # Once the leftmost operand is a string, every `+` in a left-nested
+        # chain is a concatenation, and so is a nested chain on the right
+        # that starts with a string itself
+        if isinstance(n, ast.BinOp) and isinstance(n.op, ast.Add):
+            if isinstance(n.right, ast.BinOp) and isinstance(n.right.op, ast.Add) and self.is_string(n.right):
+                return self.flatten(n.left) + self.flatten(n.right)
+            return self.flatten(n.left) + [n.right]
+        return [n]
+
+    def merge_constants(self, parts):
+        rv = []
+        for p in parts:
+            if isinstance(p, ast.Str) and rv and isinstance(rv[-1], ast.Str):
+                try:
+                    s = rv[-1].s + p.s
+                except UnicodeError:
+                    # Mixing non-ascii str with unicode, fails at runtime too
+                    pass
+                else:
+                    rv[-1] = ast.copy_location(ast.Str(s=s), rv[-1])
+                    continue
+            rv.append(p)
+        return rv
+
+    def is_non_unicode(self, n):
+        # Whether n's value can't be unicode. Floor division and modulo by a
+        # number are assumed to be arithmetic, a unicode format string
+        # would need a tuple or mapping to format with anything else.
+        if isinstance(n, ast.Num) or self.is_str_call(n):
+            return True
+        return (
+            isinstance(n, ast.BinOp)
+            and isinstance(n.op, (ast.FloorDiv, ast.Mod))
+            and isinstance(n.right, ast.Num)
+            and not isinstance(n.left, ast.Str)
+        )
+
+    def make_format(self, run):
+        calls = filter(self.is_str_call, run)
+        if not calls or len(run) == 1:
+            return run
+        if not all([self.is_non_unicode(c.args[0]) for c in calls]):
+            return run
+        template = []
+        values = []
+        for p in run:
+            if isinstance(p, ast.Str):
+                template.append(p.s.replace('%', '%%'))
+            else:
+                template.append('%s')
+                values.append(p.args[0])
+        try:
+            template = "".join(template)
+        except UnicodeError:
+            return run
+        return [ast.copy_location(ast.BinOp(
+            left = ast.copy_location(ast.Str(s=template), run[0]),
+            op = ast.Mod(),
+            right = ast.copy_location(ast.Tuple(elts=values, ctx=ast.Load()), run[0]),
+        ), run[0])]
+
+    def visit_BinOp(self, n):
+        if not (isinstance(n.op, ast.Add) and self.is_string(n)):
+            return self.generic_visit(n)
+
+        parts = self.merge_constants([self.visit(p) for p in self.flatten(n)])
+
+        pieces = []
+        run = []
+        for p in parts:
+            if isinstance(p, ast.Str) or self.is_str_call(p):
+                run.append(p)
+            else:
+                pieces.extend(self.make_format(run))
+                pieces.append(p)
+                run = []
+        pieces.extend(self.make_format(run))
+
+        if len(pieces) >= self.min_join_parts:
+            self.applied(n, "joined %d pieces", len(pieces))
+            return ast.copy_location(ast.Call(
+                func = ast.Attribute(value=ast.Str(s=''), attr='join', ctx=ast.Load()),
+                args = [ast.Tuple(elts=pieces, ctx=ast.Load())],
+                keywords = [],
+                starargs = None,
+                kwargs = None,
+            ), n)
+
+        if len(pieces) < len(parts):
+            self.applied(n, "merged %d pieces into %d", len(parts), len(pieces))
+        rv = pieces[0]
+        for p in pieces[1:]:
+            rv = ast.copy_location(ast.BinOp(left=rv, op=ast.Add(), right=p), n)
+        return rv
@@ -0,0 +1,114 @@
+import __future__
+import ast
+import StringIO
+import tokenize
+
+import constprop
+import jsruntime
+
+# Keywords that continue the compound statement before them rather than
+# starting a new one
+CONTINUATIONS = ('else', 'elif', 'except', 'finally')
+
+def iter_statements(readline):
+    # Yields (lineno, source) for each top-level statement, reading only as
+    # far ahead as needed to know the statement is over
+    lines = []
+    first = 1
+    def read():
+        line = readline()
+        lines.append(line)
+        return line
+
+    depth = 0
+    line_start = True
+    started = False
+    decorated = False
+    for tok_type, tok, (srow, scol), _, _ in tokenize.generate_tokens(read):
+        if tok_type == tokenize.INDENT:
+            depth += 1
+        elif tok_type == tokenize.DEDENT:
+            depth -= 1
+        elif tok_type == tokenize.NEWLINE:
+            line_start = True
+        elif tok_type in (tokenize.NL, tokenize.COMMENT):
+            pass
+        elif tok_type == tokenize.ENDMARKER:
+            break
+        elif line_start:
+            line_start = False
+            if depth == 0:
+                if started and not decorated and tok not in CONTINUATIONS:
+                    yield first, "".join(lines[:srow - first])
+                    del lines[:srow - first]
+                    first = srow
+                started = True
+                decorated = (tok == '@')
+
+    if started:
+        yield first, "".join(lines)
+
+def future_flags(stmt):
+    flags = 0
+    if isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__':
+        for alias in stmt.names:
+            feature = getattr(__future__, alias.name, None)
+            if feature is not None:
+                flags |= feature.compiler_flag
+    return flags
+
+def iter_parsed(f, filename):
+    flags = 0
+    for lineno, source in iter_statements(f.readline):
+        # Future imports in earlier statements change how later ones parse
+        root = compile(source, filename, 'exec', ast.PyCF_ONLY_AST | flags, True)
+        ast.increment_lineno(root, lineno - 1)
+        for stmt in root.body:
+            flags |= future_flags(stmt)
+            yield stmt
+
+def prescan(f, filename, passes):
+    # Most passes need to know which names are never rebound anywhere in
+    # the module before they can rewrite any statement, which takes a
+    # first pass over the file that only keeps the binding counts
+    needy = [p for p in passes if getattr(p, 'bindings', False) is None]
+    if needy:
+        bindings = constprop.BindingsVisitor()
+        for stmt in iter_parsed(f, filename):
+            bindings.add_statement(stmt)
+        f.seek(0)
+        for p in needy:
+            if isinstance(p, constprop.ConstPropTransformer):
+                p.set_bindings(bindings)
+            else:
+                p.bindings = bindings
+
+def rewrite_stream(f, filename, passes, decompile, out):
+    # Passes are applied statement by statement and keep whatever they carry
+    # across statements (the inliner's definitions, constprop's module
+    # constants), so peak memory is bounded by the largest statement rather
+    # than the whole module
+    prescan(f, filename, passes)
+    v = decompile.StatementDecompilingVisitor()
+    for stmt in iter_parsed(f, filename):
+        stmts = [stmt]
+        for p in passes:
+            stmts = transform_stmts(p, stmts)
+        for stmt in stmts:
+            v.visit(stmt)
+        out.write(v.buf.getvalue())
+        v.buf = StringIO.StringIO()
+    if getattr(v, 'runtime', None):
+        # JS function declarations are hoisted, so the runtime helpers can
+        # come last, once it's known which ones got used
+        out.write(jsruntime.prelude(v.runtime))
+
+def transform_stmts(p, stmts):
+    rv = []
+    for stmt in stmts:
+        stmt = p.visit(stmt)
+        if isinstance(stmt, list):
+            rv.extend(stmt)
+        elif stmt is not None:
+            rv.append(stmt)
+    return rv
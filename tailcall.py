@@ -0,0 +1,180 @@
+import ast
+
+import constprop
+import visitor
+
+def reads(n, name):
+    return any([isinstance(v, ast.Name) and v.id == name for v in ast.walk(n)])
+
+def terminates(stmts):
+    # Whether control never gets past the end of the statements
+    if not stmts:
+        return False
+    last = stmts[-1]
+    if isinstance(last, ast.If):
+        return terminates(last.body) and terminates(last.orelse)
+    return isinstance(last, (ast.Return, ast.Raise, ast.Continue))
+
+class TailCallTransformer(visitor.DispatchTransformer):
+    # Turns functions that return calls to themselves into a loop, so
+    # `return f(x - 1, acc * x)` reassigns the parameters and starts over
+    # instead of piling up frames. Only calls in tail position outside of
+    # loops and try/with blocks are converted, other recursive calls stay.
+
+    # Things whose behavior would change if the function's locals survived
+    # from one "call" to the next: closures capture variables, not values
+    closures = (
+        ast.Lambda, ast.FunctionDef, ast.ClassDef, ast.GeneratorExp,
+        ast.SetComp, ast.DictComp, ast.Yield, ast.Exec,
+    )
+    introspection = ('locals', 'vars', 'dir')
+
+    pass_name = 'tailcall'
+
+    def __init__(self):
+        self.bindings = None
+
+    def visit_Module(self, n):
+        if self.bindings is None:
+            self.bindings = constprop.BindingsVisitor()
+            self.bindings.visit(n)
+        return self.generic_visit(n)
+
+    def rejection(self, n):
+        # Why n can't be converted, or None
+        if self.bindings is None:
+            return "needs the whole module"
+        elif self.bindings.bindings.get(n.name, 0) != 1:
+            return "its name is rebound"
+        elif n.decorator_list:
+            return "it's decorated"
+        elif n.args.vararg or n.args.kwarg:
+            return "it takes * or ** arguments"
+        elif not all([isinstance(a, ast.Name) for a in n.args.args]):
+            return "it unpacks arguments"
+        for stmt in n.body:
+            for v in ast.walk(stmt):
+                if isinstance(v, self.closures):
+                    return "it contains a %s" % type(v).__name__
+                if isinstance(v, ast.Name) and v.id in self.introspection:
+                    return "it calls %s" % v.id
+        return None
+
+    def call_args(self, fdef, call):
+        # Parameter values passed by a self call, or None if they can't be
+        # known from the call alone
+        if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == fdef.name):
+            return None
+        if call.starargs or call.kwargs:
+            return None
+        params = [a.id for a in fdef.args.args]
+        if len(call.args) > len(params):
+            return None
+        # In evaluation order, positional arguments first
+        values = zip(params, call.args)
+        for kw in call.keywords:
+            if kw.arg not in params or kw.arg in [p for p, v in values]:
+                return None
+            values.append((kw.arg, kw.value))
+        defaults = dict(zip(params[len(params) - len(fdef.args.defaults):], fdef.args.defaults))
+        for p in params:
+            if p not in [q for q, v in values]:
+                # Defaults are evaluated once, only literals can be repeated
+                default = defaults.get(p)
+                if not (isinstance(default, (ast.Num, ast.Str)) or (
+                        isinstance(default, ast.Name) and default.id in constprop.ConstPropTransformer.const_names)):
+                    return None
+                values.append((p, default))
+        return values
+
+    def temp_name(self, fdef, param, used):
+        name = "%s_next" % param
+        while name in used or self.bindings.bindings.get(name, 0):
+            name = "_" + name
+        used.add(name)
+        return name
+
+    def reassign(self, fdef, values, used, node):
+        changed = [
+            (p, v) for p, v in values
+            if not (isinstance(v, ast.Name) and v.id == p)
+        ]
+        # Assigning in place is fine as long as no value reads a parameter
+        # already reassigned. Values without calls can be reordered for it,
+        # eg: acc before n in f(n - 1, acc * n), and only those in a cycle
+        # (like a, b = b, a) need temporaries.
+        direct = []
+        cyclic = changed
+        if not any([isinstance(x, ast.Call) for p, v in changed for x in ast.walk(v)]):
+            cyclic = list(changed)
+            progress = True
+            while progress:
+                progress = False
+                for i, (p, v) in enumerate(cyclic):
+                    if not any([reads(w, p) for q, w in cyclic if q != p]):
+                        direct.append(cyclic.pop(i))
+                        progress = True
+                        break
+        elif not any([reads(v, q) for i, (p, v) in enumerate(changed) for q, w in changed[:i]]):
+            direct, cyclic = changed, []
+
+        rv = []
+        for p, v in direct:
+            rv.append(ast.Assign(targets=[ast.Name(id=p, ctx=ast.Store())], value=v))
+        temps = [self.temp_name(fdef, p, used) for p, v in cyclic]
+        for t, (p, v) in zip(temps, cyclic):
+            rv.append(ast.Assign(targets=[ast.Name(id=t, ctx=ast.Store())], value=v))
+        for t, (p, v) in zip(temps, cyclic):
+            rv.append(ast.Assign(
+                targets = [ast.Name(id=p, ctx=ast.Store())],
+                value = ast.Name(id=t, ctx=ast.Load()),
+            ))
+        rv.append(ast.Continue())
+        return [ast.copy_location(stmt, node) for stmt in rv]
+
+    def rewrite_block(self, fdef, stmts, used):
+        # Returns the new statements and how many tail calls were replaced
+        rv = []
+        count = 0
+        for stmt in stmts:
+            if isinstance(stmt, ast.Return) and stmt.value is not None:
+                values = self.call_args(fdef, stmt.value)
+                if values is not None:
+                    rv.extend(self.reassign(fdef, values, used, stmt))
+                    count += 1
+                    continue
+            elif isinstance(stmt, ast.If):
+                stmt.body, nbody = self.rewrite_block(fdef, stmt.body, used)
+                stmt.orelse, norelse = self.rewrite_block(fdef, stmt.orelse, used)
+                count += nbody + norelse
+            rv.append(stmt)
+        return rv, count
+
+    def visit_FunctionDef(self, n):
+        n = self.generic_visit(n)
+        reason = self.rejection(n)
+        if reason is not None:
+            if any([self.call_args(n, v) is not None for v in ast.walk(n) if isinstance(v, ast.Call)]):
+                self.missed(n, "can't convert %s, " + reason, n.name)
+            return n
+
+        used = set([v.id for stmt in n.body for v in ast.walk(stmt) if isinstance(v, ast.Name)])
+        body = n.body
+        docstring = []
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Str):
+            docstring, body = body[:1], body[1:]
+        body, count = self.rewrite_block(n, body, used)
+        if not count:
+            return n
+        self.applied(n, "converted %d tail calls in %s", count, n.name)
+
+        if isinstance(body[-1], ast.Continue):
+            body.pop()
+        elif not terminates(body):
+            # Falling off the end returns None rather than looping again
+            body.append(ast.copy_location(ast.Return(value=None), body[-1]))
+        # def f(x): return f(x) leaves nothing but the loop itself
+        body = body or [ast.copy_location(ast.Pass(), n)]
+        loop = ast.copy_location(ast.While(test=ast.Num(n=1), body=body, orelse=[]), body[0])
+        n.body = docstring + [loop]
+        return ast.fix_missing_locations(n)
@@ -0,0 +1,26 @@
+import ast
+import unittest
+
+import constprop
+import decompile
+
+def rewrite(source):
+    return decompile.decompile(constprop.ConstPropTransformer().visit(ast.parse(source)))
+
+class BuiltinFoldingTest(unittest.TestCase):
+
+    def test_folds_builtins(self):
+        self.assertEqual(rewrite("x = abs(-2) + len('ab')\n"), "x = 4\n")
+
+    def test_rebound_builtin(self):
+        self.assertIn("abs(-2)", rewrite("def abs(x):\n    return x\nx = abs(-2)\n"))
+
+    def test_opaque_module(self):
+        # Either could rebind any builtin
+        for prelude in ["from numpy import *\n", "exec 'round = int'\n"]:
+            out = rewrite(prelude + "x = round(2.5)\ny = abs(-2)\n")
+            self.assertIn("round(2.5)", out)
+            self.assertIn("abs(-2)", out)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import ast
+import glob
+import os.path
+import random
+import unittest
+
+import decompile_minimal
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LEAVES = ['a', 'b', '1', '2.5', '-3', '1j', "'s'", '[a]', '(a, b)', 'f(a)', 'a.b', 'a[1:2]', '{a: b}']
+BINOPS = ['+', '-', '*', '/', '//', '%', '**', '<<', '>>', '|', '^', '&']
+CMPOPS = ['<', '<=', '==', '!=', 'in', 'not in', 'is', 'is not']
+UNOPS = ['not ', '-', '+', '~']
+POSTFIX = ['(%s).x', '(%s)[0]', '(%s)(a)', '(%s)[a:b]', '[x for x in (%s) if (x)]', '{(%s): 1}', '`%s`']
+
+def expression(rnd, depth):
+    # Python source for a random expression, parenthesized all the way,
+    # so how it parses doesn't depend on precedence
+    if depth == 0:
+        return rnd.choice(LEAVES)
+    sub = lambda : expression(rnd, depth - 1)
+    kind = rnd.randint(0, 9)
+    if kind < 3:
+        return '(%s %s %s)' % (sub(), rnd.choice(BINOPS), sub())
+    elif kind == 3:
+        return '(%s ** %s)' % (sub(), sub())
+    elif kind == 4:
+        return '(%s %s %s)' % (sub(), rnd.choice(['and', 'or']), sub())
+    elif kind == 5:
+        return '(%s %s %s)' % (sub(), rnd.choice(CMPOPS), sub())
+    elif kind == 6:
+        return '(%s(%s))' % (rnd.choice(UNOPS), sub())
+    elif kind == 7:
+        return '(lambda x: %s)' % sub()
+    elif kind == 8:
+        return '(%s if %s else %s)' % (sub(), sub(), sub())
+    return rnd.choice(POSTFIX) % sub()
+
+class RoundTripTest(unittest.TestCase):
+
+    def assertRoundTrips(self, tree, source = None):
+        out = decompile_minimal.decompile(tree)
+        try:
+            again = ast.parse(out)
+        except SyntaxError as e:
+            self.fail("%s\n%s => %s" % (e, source, out))
+        self.assertEqual(ast.dump(again), ast.dump(tree), "%s => %s" % (source, out))
+
+    def test_modules(self):
+        for filename in sorted(glob.glob(os.path.join(HERE, '*.py'))):
+            with open(filename, "r") as f:
+                source = f.read()
+            self.assertRoundTrips(ast.parse(source, filename), filename)
+
+    def test_expressions(self):
+        rnd = random.Random(1)
+        for _ in xrange(5000):
+            source = expression(rnd, rnd.randint(1, 5))
+            self.assertRoundTrips(ast.parse(source), source)
+
+    def test_minimal(self):
+        for source in [
+                'a + b * c',
+                '(a + b) * c',
+                'a - (b - c)',
+                'a ** b ** c',
+                '(a ** b) ** c',
+                '-a ** -b',
+                '(-1) ** 2',
+                'not a and b',
+                '(a or b) and c',
+                'a if b else lambda: c',
+                '(a, b)[0].c',
+                ]:
+            self.assertEqual(decompile_minimal.decompile(ast.parse(source)), source + "\n")
+
+if __name__ == '__main__':
+    unittest.main()
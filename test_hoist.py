@@ -0,0 +1,31 @@
+import ast
+import unittest
+
+import decompile
+import hoist
+
+def rewrite(source):
+    return decompile.decompile(hoist.HoistTransformer().visit(ast.parse(source)))
+
+def run(source, expr):
+    env = {}
+    exec compile(source, '<test>', 'exec') in env
+    return eval(expr, env)
+
+class HoistTest(unittest.TestCase):
+
+    def test_defaults(self):
+        source = "def f(a):\n    return len(a) + len(a)\n"
+        out = rewrite(source)
+        self.assertIn("def f(a, len=len):", out)
+        self.assertEqual(run(out, "f([1, 2])"), 4)
+
+    def test_keyword_arguments(self):
+        # A len= keyword has to keep going to **kw
+        source = "def f(a, **kw):\n    return len(a) + len(kw) + len(kw)\n"
+        out = rewrite(source)
+        self.assertIn("def f(a, **kw):", out)
+        self.assertEqual(run(out, "f([1], len=3)"), run(source, "f([1], len=3)"))
+
+if __name__ == '__main__':
+    unittest.main()
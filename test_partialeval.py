@@ -0,0 +1,45 @@
+import ast
+import unittest
+
+import constprop
+import decompile
+import partialeval
+import remarks
+
+def rewrite(source):
+    collector = remarks.RemarkCollector('t.py')
+    p = partialeval.PartialEvalTransformer()
+    p.remarks = collector
+    return decompile.decompile(p.visit(ast.parse(source))), collector
+
+class MakeConstTest(unittest.TestCase):
+
+    def test_nested_without_literal_form(self):
+        folder = constprop.ConstPropTransformer()
+        n = ast.parse('x').body[0]
+        for val in [[{}], (1, [2, {}]), set([object()]), [set()], [float('nan')], ([1], (float('inf'),))]:
+            self.assertIsNone(folder.make_const(val, n), repr(val))
+
+    def test_nested_literals(self):
+        folder = constprop.ConstPropTransformer()
+        n = ast.parse('x').body[0]
+        for val in [[1, 'a'], (1, [2, (None, True)]), [], set([1])]:
+            const = folder.make_const(val, n)
+            self.assertEqual(folder.get_value(const), val)
+
+class EvaluateTest(unittest.TestCase):
+
+    def test_results_without_literal_form(self):
+        for result in ['[{}]', '(1, [{2: 3}])', '[set()]', 'set()', '[1j]']:
+            source = "def f():\n    return %s\nx = f()\n" % result
+            out, collector = rewrite(source)
+            self.assertIn("x = f()", out)
+            self.assertIn("Call result has no literal form",
+                [r.message for r in collector.remarks])
+
+    def test_literal_result(self):
+        out, collector = rewrite("def f():\n    return [1, (2, 'a')]\nx = f()\n")
+        self.assertIn("x = [1, (2, 'a')]", out)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import ast
+import unittest
+
+import decompile
+import tailcall
+
+def rewrite(source):
+    return decompile.decompile(tailcall.TailCallTransformer().visit(ast.parse(source)))
+
+def run(source, expr):
+    env = {}
+    exec compile(source, '<test>', 'exec') in env
+    return eval(expr, env)
+
+class TailCallTest(unittest.TestCase):
+
+    def test_accumulator(self):
+        source = (
+            "def fact(n, acc=1):\n"
+            "    if n <= 1:\n"
+            "        return acc\n"
+            "    return fact(n - 1, acc * n)\n"
+        )
+        out = rewrite(source)
+        self.assertIn("while 1:", out)
+        self.assertEqual(run(out, "fact(2000) == fact(2000 - 1) * 2000"), True)
+        self.assertEqual(run(out, "fact(5)"), run(source, "fact(5)"))
+
+    def test_swap(self):
+        source = (
+            "def f(a, b, n):\n"
+            "    if not n:\n"
+            "        return (a, b)\n"
+            "    return f(b, a, n - 1)\n"
+        )
+        out = rewrite(source)
+        self.assertIn("while 1:", out)
+        for n in range(4):
+            self.assertEqual(run(out, "f(1, 2, %d)" % n), run(source, "f(1, 2, %d)" % n))
+
+    def test_only_tail_call(self):
+        for source in [
+                "def f(x):\n    return f(x)\n",
+                "def f(x):\n    'doc'\n    return f(x)\n",
+                ]:
+            out = rewrite(source)
+            tree = ast.parse(out)
+            loop = tree.body[0].body[-1]
+            self.assertIsInstance(loop, ast.While)
+            self.assertEqual([type(stmt) for stmt in loop.body], [ast.Pass])
+
+if __name__ == '__main__':
+    unittest.main()
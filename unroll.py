@@ -0,0 +1,230 @@
+import ast
+import copy
+import sys
+
+import constprop
+import visitor
+
+class CantUnroll(Exception):
+    pass
+
+# Scopes of their own, which see variables rather than their values at
+# the time they're created
+SCOPES = (ast.FunctionDef, ast.ClassDef, ast.Lambda, ast.GeneratorExp, ast.SetComp, ast.DictComp)
+
+def loop_jumps(stmts):
+    # Types of the break and continue statements in stmts that belong to
+    # the loop they're the body of, not to loops nested in it
+    rv = set()
+    pending = list(stmts)
+    while pending:
+        n = pending.pop()
+        if isinstance(n, (ast.Break, ast.Continue)):
+            rv.add(type(n))
+        elif isinstance(n, (ast.For, ast.While)):
+            pending.extend(n.orelse)
+        elif not isinstance(n, SCOPES):
+            pending.extend(ast.iter_child_nodes(n))
+    return rv
+
+def size(stmts):
+    return sum([1 for stmt in stmts for _ in ast.walk(stmt)])
+
+class UnrollTransformer(visitor.DispatchTransformer):
+    # Replaces for loops over constant tuples, lists and strings, or over
+    # range() with constant arguments, by a copy of the body per item, with
+    # the loop variable's value substituted when nothing could tell, and
+    # constants folded again in each copy:
+    #
+    #   for i in range(3):       i = 0
+    #       x += i * 2           x += 0
+    #                            i = 1
+    #                            x += 2
+    #                            ...
+    #
+    # break and continue are supported in if statements, by nesting what
+    # runs after them in the else branch, and the loop's else runs after
+    # the last copy unless some break jumped over it. Loops with more than
+    # max_trips items, or that would take more than max_nodes nodes
+    # unrolled, are left alone.
+
+    pass_name = 'unroll'
+
+    max_trips = 8
+    max_nodes = 400
+
+    def __init__(self, max_trips = None, max_nodes = None):
+        self.bindings = None
+        if max_trips is not None:
+            self.max_trips = max_trips
+        if max_nodes is not None:
+            self.max_nodes = max_nodes
+
+    def visit_Module(self, n):
+        if self.bindings is None:
+            self.bindings = constprop.BindingsVisitor()
+            self.bindings.visit(n)
+        if self.bindings.opaque:
+            return n
+        return self.generic_visit(n)
+
+    def trip_values(self, n):
+        # The constant nodes the loop iterates over, or None
+        it = n.iter
+        folder = constprop.ConstPropTransformer()
+        if isinstance(it, (ast.Tuple, ast.List)) and all(map(folder.is_const, it.elts)):
+            return it.elts
+        elif isinstance(it, ast.Str):
+            return [ast.copy_location(ast.Str(s=c), it) for c in it.s]
+        elif (      isinstance(it, ast.Call)
+                    and isinstance(it.func, ast.Name)
+                    and it.func.id in ('range', 'xrange')
+                    and not self.bindings.bindings.get(it.func.id, 0)
+                    and 1 <= len(it.args) <= 3
+                    and not (it.keywords or it.starargs or it.kwargs)
+                    and all([isinstance(a, ast.Num) and isinstance(a.n, (int, long)) for a in it.args])
+                ):
+            args = [a.n for a in it.args]
+            if len(args) == 3 and args[2] == 0:
+                return None
+            elif it.func.id == 'xrange' and not all([-sys.maxint - 1 <= a <= sys.maxint for a in args]):
+                # Raises OverflowError
+                return None
+            # Don't build huge lists just to find out they're too long
+            start, stop, step = (args + [1])[:3] if len(args) > 1 else (0, args[0], 1)
+            count = max(0, (stop - start + step - (1 if step > 0 else -1)) // step)
+            if count > self.max_trips:
+                self.missed(n, "loop has more than %d iterations", self.max_trips)
+                return None
+            return [ast.copy_location(ast.Num(n=start + i * step), it) for i in range(count)]
+        return None
+
+    def substitutable(self, name, body):
+        # Whether nothing in body rebinds name, or could see the variable
+        # rather than its value
+        if name in self.bindings.declared_global:
+            return False
+        for stmt in body:
+            for u in ast.walk(stmt):
+                if isinstance(u, ast.Name) and u.id == name and not isinstance(u.ctx, ast.Load):
+                    return False
+                elif isinstance(u, SCOPES) and any([isinstance(w, ast.Name) and w.id == name for w in ast.walk(u)]):
+                    return False
+                elif isinstance(u, ast.Exec) or (isinstance(u, ast.Name) and u.id in ('locals', 'vars')):
+                    return False
+        return True
+
+    def substitutions(self, target, value, body):
+        # {name: value} for loop variables the body can read as constants
+        folder = constprop.ConstPropTransformer()
+        if isinstance(target, ast.Name):
+            if (        folder.is_const(value)
+                        and constprop.is_immutable(folder.get_value(value))
+                        and self.substitutable(target.id, body)
+                    ):
+                return { target.id : value }
+        elif (      isinstance(target, (ast.Tuple, ast.List))
+                    and isinstance(value, (ast.Tuple, ast.List))
+                    and len(target.elts) == len(value.elts)
+                ):
+            rv = {}
+            for t, v in zip(target.elts, value.elts):
+                rv.update(self.substitutions(t, v, body))
+            return rv
+        return {}
+
+    def substitute(self, stmts, values):
+        class Substitute(ast.NodeTransformer):
+            def visit_Name(_, n):
+                if isinstance(n.ctx, ast.Load) and n.id in values:
+                    return ast.copy_location(copy.deepcopy(values[n.id]), n)
+                return n
+        return [Substitute().visit(stmt) for stmt in stmts]
+
+    def fold(self, stmts):
+        folder = constprop.ConstPropTransformer(self.bindings)
+        # Names bound once in the source are bound once per copy now
+        folder.candidates = set()
+        folder.remarks = self.remarks
+        return self.prune([folder.visit(stmt) for stmt in stmts])
+
+    def prune(self, stmts):
+        # Drops the branches of ifs whose test folded to a constant
+        folder = constprop.ConstPropTransformer()
+        rv = []
+        for stmt in stmts:
+            if isinstance(stmt, ast.If) and folder.is_const(stmt.test):
+                rv.extend(self.prune(stmt.body if folder.get_value(stmt.test) else stmt.orelse))
+                continue
+            if isinstance(stmt, (ast.If, ast.For, ast.While, ast.With, ast.TryExcept, ast.TryFinally)):
+                for field in ('body', 'orelse', 'finalbody'):
+                    block = getattr(stmt, field, None)
+                    if block:
+                        block = self.prune(block)
+                        if not block and field != 'orelse':
+                            block = [ast.copy_location(ast.Pass(), stmt)]
+                        setattr(stmt, field, block)
+            rv.append(stmt)
+        return rv
+
+    def sequence(self, stmts, after, cont):
+        # Statements running stmts and then after, with continue going on
+        # with cont and break with nothing. Raises CantUnroll for jumps it can't
+        # nest like that, or when break and continue together would need too
+        # many copies of what follows.
+        for i, stmt in enumerate(stmts):
+            if isinstance(stmt, ast.Continue):
+                return stmts[:i] + copy.deepcopy(cont)
+            elif isinstance(stmt, ast.Break):
+                return stmts[:i]
+            elif loop_jumps([stmt]):
+                if not isinstance(stmt, ast.If):
+                    raise CantUnroll("break or continue outside of if statements")
+                rest = self.sequence(stmts[i + 1:], after, cont)
+                body = self.sequence(stmt.body, rest, cont)
+                orelse = self.sequence(stmt.orelse, copy.deepcopy(rest), cont)
+                if size(body) + size(orelse) > self.max_nodes:
+                    raise CantUnroll("it would take more than %d nodes unrolled" % self.max_nodes)
+                if not body and orelse:
+                    # if x: break, else the rest: if not x: the rest
+                    stmt.test = ast.copy_location(ast.UnaryOp(op=ast.Not(), operand=stmt.test), stmt.test)
+                    body, orelse = orelse, []
+                stmt.body = body or [ast.copy_location(ast.Pass(), stmt)]
+                stmt.orelse = orelse
+                return stmts[:i + 1]
+        return stmts + after
+
+    def visit_For(self, n):
+        n = self.generic_visit(n)
+        if self.bindings is None or self.bindings.opaque:
+            # Without the module's bindings range() could be rebound
+            return n
+        values = self.trip_values(n)
+        if values is None:
+            return n
+        if len(values) > self.max_trips:
+            self.missed(n, "loop has more than %d iterations", self.max_trips)
+            return n
+
+        jumps = loop_jumps(n.body)
+        # Without breaks everything goes on to the next copy, which can then
+        # just follow instead of being nested in the copy before
+        cont = [] if ast.Break not in jumps else copy.deepcopy(n.orelse)
+        chained = []
+        try:
+            for value in reversed(values):
+                body = copy.deepcopy(n.body)
+                body = self.fold(self.substitute(body, self.substitutions(n.target, value, body)))
+                assign = ast.copy_location(ast.Assign(targets=[copy.deepcopy(n.target)], value=copy.deepcopy(value)), n)
+                if ast.Break in jumps:
+                    cont = [assign] + self.sequence(body, cont, cont)
+                else:
+                    chained[:0] = [assign] + self.sequence(body, [], [])
+                if size(cont) + size(chained) > self.max_nodes:
+                    raise CantUnroll("it would take more than %d nodes unrolled" % self.max_nodes)
+        except CantUnroll as e:
+            self.missed(n, "can't unroll loop, %s", str(e))
+            return n
+        rv = cont if ast.Break in jumps else chained + n.orelse
+        self.applied(n, "unrolled loop with %d iterations", len(values))
+        return [ast.fix_missing_locations(stmt) for stmt in rv] or ast.copy_location(ast.Pass(), n)
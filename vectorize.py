@@ -0,0 +1,377 @@
+import ast
+import copy
+
+import constprop
+import visitor
+
+# Added to modules where something got vectorized. _vec_apply evaluates the
+# vectorized version on an array when the input is one (or a list that can
+# be turned into one without changing results), and the original code
+# otherwise.
+PRELUDE = """
+try:
+    import numpy as _vec_np
+except ImportError:
+    _vec_np = None
+from itertools import imap as _vec_imap
+
+_vec_reducers = {'sum' : sum, 'min' : min, 'max' : max}
+
+def _vec_array(seq, ints, lists, invariants):
+    if isinstance(seq, _vec_np.ndarray):
+        if seq.ndim != 1 or not (seq.dtype == _vec_np.float64 or (ints and seq.dtype == _vec_np.int64)):
+            return None
+    elif not lists or type(seq) is not list or not (%(min_len)d <= len(seq) <= %(max_len)d):
+        return None
+    if invariants is not None:
+        for v in invariants():
+            if not (type(v) is float or (type(v) is int and -%(bound)d < v < %(bound)d)):
+                return None
+    if type(seq) is not list:
+        return seq
+    types = set(_vec_imap(type, seq))
+    if types == set([float]):
+        return _vec_np.fromiter(seq, _vec_np.float64, len(seq))
+    elif ints and types == set([int]):
+        a = _vec_np.fromiter(seq, _vec_np.int64, len(seq))
+        if -%(bound)d < a.min() and a.max() < %(bound)d:
+            return a
+    return None
+
+def _vec_apply(seq, vectorized, fallback, reducer, ints, lists, invariants):
+    a = None
+    if _vec_np is not None:
+        a = _vec_array(seq, ints, lists, invariants)
+    if a is None:
+        return fallback(seq)
+    rv = vectorized(a)
+    if type(seq) is list and rv.dtype.kind in 'bi' and reducer == 'sum':
+        return int(rv.sum())
+    elif type(seq) is list and rv.dtype.kind == 'i' and rv.size and reducer == 'min':
+        return int(rv.min())
+    elif type(seq) is list and rv.dtype.kind == 'i' and rv.size and reducer == 'max':
+        return int(rv.max())
+    # Float reductions go through the builtins, numpy sums in a different
+    # order and handles nan differently
+    rv = rv.tolist() if type(seq) is list else list(rv)
+    return rv if reducer is None else _vec_reducers[reducer](rv)
+"""
+
+class NotVectorizable(Exception):
+    pass
+
+class FreeLoadsVisitor(visitor.DispatchVisitor):
+    # Counts uses of each name outside comprehensions binding it, which
+    # would see a list comprehension's leaked target
+
+    def __init__(self):
+        self.counts = {}
+        self.bound = []
+
+    def visit_comp(self, n):
+        names = set()
+        for gen in n.generators:
+            names.update([t.id for t in ast.walk(gen.target) if isinstance(t, ast.Name)])
+        self.bound.append(names)
+        self.generic_visit(n)
+        self.bound.pop()
+
+    visit_ListComp = visit_GeneratorExp = visit_SetComp = visit_DictComp = visit_comp
+
+    def visit_Name(self, n):
+        if not isinstance(n.ctx, ast.Store) and not any([n.id in b for b in self.bound]):
+            self.counts[n.id] = self.counts.get(n.id, 0) + 1
+
+def depends(n, name):
+    return any([isinstance(v, ast.Name) and v.id == name for v in ast.walk(n)])
+
+def count_operations(n):
+    return len([
+        v for v in ast.walk(n)
+        if isinstance(v, (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Call, ast.IfExp))
+    ])
+
+def lambda_(arg, body):
+    return ast.Lambda(
+        args = ast.arguments(
+            args = [ast.Name(id=arg, ctx=ast.Param())] if arg is not None else [],
+            vararg = None,
+            kwarg = None,
+            defaults = [],
+        ),
+        body = body,
+    )
+
+class ElementVectorizer(visitor.DispatchVisitor):
+    # Translates an element-wise expression on target into the same
+    # expression on the array named array. Visiting returns the new node and
+    # its degree, how many bounded values get multiplied together, which
+    # tells whether int64 could overflow where python ints wouldn't.
+
+    binops = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod)
+    cmpops = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+    max_int_degree = 2
+
+    def __init__(self, target, array, is_bound, bound):
+        self.target = target
+        self.array = array
+        self.is_bound = is_bound
+        self.bound = bound
+        self.invariants = []
+        self.ints = True
+
+    def generic_visit(self, n):
+        raise NotVectorizable(type(n).__name__)
+
+    def vectorize(self, n):
+        rv, degree = self.visit(n)
+        if degree > self.max_int_degree:
+            self.ints = False
+        return rv
+
+    def condition(self, n):
+        if isinstance(n, ast.BoolOp):
+            op = ast.BitAnd() if isinstance(n.op, ast.And) else ast.BitOr()
+            rv = self.condition(n.values[0])
+            for v in n.values[1:]:
+                rv = ast.BinOp(left=rv, op=op, right=self.condition(v))
+            return rv
+        elif isinstance(n, ast.UnaryOp) and isinstance(n.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=self.condition(n.operand))
+        elif isinstance(n, ast.Compare):
+            return self.vectorize(n)
+        # Truthiness of a number
+        return ast.Compare(left=self.vectorize(n), ops=[ast.NotEq()], comparators=[ast.Num(n=0)])
+
+    def visit_Name(self, n):
+        if n.id == self.target:
+            return ast.Name(id=self.array, ctx=ast.Load()), 1
+        elif n.id in ('True', 'False', 'None'):
+            raise NotVectorizable(n.id)
+        if n.id not in self.invariants:
+            self.invariants.append(n.id)
+        return ast.Name(id=n.id, ctx=ast.Load()), 1
+
+    def visit_Num(self, n):
+        if type(n.n) is int:
+            if not -self.bound < n.n < self.bound:
+                self.ints = False
+            if not -(1 << 53) < n.n < (1 << 53):
+                raise NotVectorizable("big int")
+        elif type(n.n) is not float:
+            raise NotVectorizable(type(n.n).__name__)
+        return ast.Num(n=n.n), 1
+
+    def visit_BinOp(self, n):
+        if not isinstance(n.op, self.binops):
+            raise NotVectorizable(type(n.op).__name__)
+        if isinstance(n.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+            # Only by nonzero constants, numpy doesn't raise on division by zero
+            if not (isinstance(n.right, ast.Num) and type(n.right.n) in (int, float) and n.right.n):
+                raise NotVectorizable("division by a variable")
+        if isinstance(n.op, ast.Div):
+            # Classic division floors ints
+            self.ints = False
+        left, ldegree = self.visit(n.left)
+        right, rdegree = self.visit(n.right)
+        if isinstance(n.op, ast.Mult):
+            degree = ldegree + rdegree
+        elif isinstance(n.op, (ast.Add, ast.Sub)):
+            degree = max(ldegree, rdegree)
+        else:
+            degree = ldegree
+        return ast.BinOp(left=left, op=type(n.op)(), right=right), degree
+
+    def visit_UnaryOp(self, n):
+        if not isinstance(n.op, (ast.UAdd, ast.USub)):
+            raise NotVectorizable(type(n.op).__name__)
+        operand, degree = self.visit(n.operand)
+        return ast.UnaryOp(op=type(n.op)(), operand=operand), degree
+
+    def visit_Compare(self, n):
+        if not all([isinstance(op, self.cmpops) for op in n.ops]):
+            raise NotVectorizable("comparison")
+        operands = [self.vectorize(v) for v in [n.left] + n.comparators]
+        rv = None
+        for op, l, r in zip(n.ops, operands, operands[1:]):
+            cmp = ast.Compare(left=l, ops=[type(op)()], comparators=[r])
+            rv = cmp if rv is None else ast.BinOp(left=rv, op=ast.BitAnd(), right=cmp)
+        return rv, 0
+
+    def visit_IfExp(self, n):
+        # Both branches get evaluated, and mixing an int constant with float
+        # elements would make a list of mixed types
+        if not (depends(n.body, self.target) and depends(n.orelse, self.target)):
+            raise NotVectorizable("constant branch")
+        self.ints = False
+        body, bdegree = self.visit(n.body)
+        orelse, odegree = self.visit(n.orelse)
+        return self.np_call('where', [self.condition(n.test), body, orelse]), max(bdegree, odegree)
+
+    def visit_Call(self, n):
+        if not (    isinstance(n.func, ast.Name)
+                    and n.func.id == 'abs'
+                    and not self.is_bound('abs')
+                    and len(n.args) == 1
+                    and not (n.keywords or n.starargs or n.kwargs)
+                ):
+            raise NotVectorizable("call")
+        arg, degree = self.visit(n.args[0])
+        return self.np_call('abs', [arg]), degree
+
+    def np_call(self, name, args):
+        return ast.Call(
+            func = ast.Attribute(value=ast.Name(id='_vec_np', ctx=ast.Load()), attr=name, ctx=ast.Load()),
+            args = args,
+            keywords = [],
+            starargs = None,
+            kwargs = None,
+        )
+
+class VectorizeTransformer(visitor.DispatchTransformer):
+    # Rewrites element-wise map/filter list comprehensions, and sum/min/max
+    # over them or over generator expressions, into numpy array expressions.
+    # Each site keeps the original code as a fallback, used unless the input
+    # is an array or a long enough list of all floats (or small ints, when
+    # the expression can't overflow int64).
+
+    pass_name = 'vectorize'
+
+    reducers = ('sum', 'min', 'max')
+    min_len = 32
+    min_list_work = 5
+    max_len = 1 << 20
+    int_bound = 1 << 16
+    prefix = '_vec_'
+
+    def __init__(self):
+        self.bindings = None
+        self.free_loads = None
+        self.class_body = False
+        self.used = False
+
+    def is_bound(self, name):
+        return self.bindings is not None and self.bindings.bindings.get(name, 0) > 0
+
+    def visit_Module(self, n):
+        # Needs the whole module, to check names and add the prelude
+        self.bindings = constprop.BindingsVisitor()
+        self.bindings.visit(n)
+        free = FreeLoadsVisitor()
+        free.visit(n)
+        if self.bindings.opaque or any([name.startswith(self.prefix) for name in free.counts]):
+            return n
+        self.free_loads = free.counts
+        n = self.generic_visit(n)
+        self.free_loads = None
+
+        if self.used:
+            prelude = ast.parse(PRELUDE % {
+                'min_len' : self.min_len,
+                'max_len' : self.max_len,
+                'bound' : self.int_bound,
+            }).body
+            pos = 0
+            if n.body and isinstance(n.body[0], ast.Expr) and isinstance(n.body[0].value, ast.Str):
+                pos = 1
+            while pos < len(n.body) and isinstance(n.body[pos], ast.ImportFrom) and n.body[pos].module == '__future__':
+                pos += 1
+            n.body[pos:pos] = prelude
+        return n
+
+    def visit_ClassDef(self, n):
+        # Class scopes aren't visible from the lambdas sites are wrapped in
+        class_body, self.class_body = self.class_body, True
+        try:
+            return self.generic_visit(n)
+        finally:
+            self.class_body = class_body
+
+    def visit_FunctionDef(self, n):
+        class_body, self.class_body = self.class_body, False
+        try:
+            return self.generic_visit(n)
+        finally:
+            self.class_body = class_body
+
+    def visit_ListComp(self, n):
+        n = self.generic_visit(n)
+        return self.vectorize(n, n, None) or n
+
+    def visit_Call(self, n):
+        if (        isinstance(n.func, ast.Name)
+                    and n.func.id in self.reducers
+                    and not self.is_bound(n.func.id)
+                    and len(n.args) == 1
+                    and isinstance(n.args[0], (ast.ListComp, ast.GeneratorExp))
+                    and not (n.keywords or n.starargs or n.kwargs)
+                ):
+            rv = self.vectorize(n, n.args[0], n.func.id)
+            if rv is not None:
+                return rv
+        return self.generic_visit(n)
+
+    def vectorize(self, n, comp, reducer):
+        if self.free_loads is None or self.class_body or len(comp.generators) != 1:
+            return None
+        gen = comp.generators[0]
+        if not isinstance(gen.target, ast.Name):
+            return None
+        target = gen.target.id
+        if isinstance(comp, ast.ListComp) and self.free_loads.get(target):
+            # Python 2 leaks the target, and it's used somewhere
+            return None
+        if isinstance(gen.iter, (ast.List, ast.Tuple, ast.Set, ast.Dict, ast.Str)):
+            # Literals are too short to be worth it
+            return None
+        if not (depends(comp.elt, target) and all([depends(c, target) for c in gen.ifs])):
+            return None
+
+        array = self.prefix + 'a'
+        v = ElementVectorizer(target, array, self.is_bound, self.int_bound)
+        try:
+            rv = v.vectorize(comp.elt)
+            if gen.ifs:
+                mask = v.condition(gen.ifs[0])
+                for c in gen.ifs[1:]:
+                    mask = ast.BinOp(left=mask, op=ast.BitAnd(), right=v.condition(c))
+                rv = ast.Subscript(value=rv, slice=ast.Index(value=mask), ctx=ast.Load())
+        except NotVectorizable as e:
+            self.missed(n, "can't vectorize %s", e.args[0])
+            return None
+
+        # Lists have to be type checked and converted, which is only paid
+        # off by enough operations per element
+        work = sum(map(count_operations, [comp.elt] + gen.ifs))
+
+        seq = self.prefix + 'seq'
+        fallback = copy.deepcopy(n)
+        fallback_comp = fallback if comp is n else fallback.args[0]
+        fallback_comp.generators[0].iter = ast.Name(id=seq, ctx=ast.Load())
+
+        if v.invariants:
+            invariants = lambda_(None, ast.Tuple(
+                elts = [ast.Name(id=name, ctx=ast.Load()) for name in v.invariants],
+                ctx = ast.Load(),
+            ))
+        else:
+            invariants = ast.Name(id='None', ctx=ast.Load())
+
+        self.used = True
+        self.applied(n, "vectorized %s", reducer or "comprehension")
+        rv = ast.Call(
+            func = ast.Name(id=self.prefix + 'apply', ctx=ast.Load()),
+            args = [
+                gen.iter,
+                lambda_(array, rv),
+                lambda_(seq, fallback),
+                ast.Name(id='None', ctx=ast.Load()) if reducer is None else ast.Str(s=reducer),
+                ast.Name(id=str(v.ints), ctx=ast.Load()),
+                ast.Name(id=str(work >= self.min_list_work), ctx=ast.Load()),
+                invariants,
+            ],
+            keywords = [],
+            starargs = None,
+            kwargs = None,
+        )
+        return ast.fix_missing_locations(ast.copy_location(rv, n))
@@ -0,0 +1,59 @@
+import ast
+
+NODE_CLASSES = [
+    c for c in vars(ast).itervalues()
+    if isinstance(c, type) and issubclass(c, ast.AST)
+]
+
+def _handler(cls, node_class):
+    f = getattr(cls, 'visit_' + node_class.__name__, None)
+    if f is None:
+        f = cls.generic_visit
+    # Keep the plain function, calling unbound methods re-checks self's type
+    return getattr(f, '__func__', f)
+
+class DispatchMeta(type):
+    # Builds, once per visitor class, the table mapping node classes to the
+    # visit_* handler that ast.NodeVisitor.visit would look up by name on
+    # every call. Handlers added to a class after it's created are not seen.
+
+    def __init__(cls, name, bases, d):
+        super(DispatchMeta, cls).__init__(name, bases, d)
+        cls._dispatch = dict([
+            (node_class, _handler(cls, node_class))
+            for node_class in NODE_CLASSES
+        ])
+
+def _visit(self, node):
+    try:
+        f = self._dispatch[node.__class__]
+    except KeyError:
+        # Node classes not defined by the ast module
+        f = self._dispatch[node.__class__] = _handler(type(self), node.__class__)
+    return f(self, node)
+
+class DispatchVisitor(ast.NodeVisitor):
+    __metaclass__ = DispatchMeta
+    visit = _visit
+
+class DispatchTransformer(ast.NodeTransformer):
+    __metaclass__ = DispatchMeta
+    visit = _visit
+
+    # Passes explain what they did (and why they didn't) to this, when set
+    # to a remarks.RemarkCollector, under their op name
+    remarks = None
+    pass_name = None
+    # Name of the backend op the tree is going to, None for Python
+    backend = None
+
+    def remark(self, kind, node, message, *args):
+        if self.remarks is not None:
+            self.remarks.add(self.pass_name or type(self).__name__, kind, node,
+                message, message % args if args else message)
+
+    def applied(self, node, message, *args):
+        self.remark('applied', node, message, *args)
+
+    def missed(self, node, message, *args):
+        self.remark('missed', node, message, *args)